@@ -6,7 +6,20 @@ from flask import Flask
 from flask_mail import Mail
 from config import config
 from app.models import Database
-from app.utils import CacheManager
+from app.utils import CacheManager, SettingsSnapshot, current_principal
+from app.utils.request_log import init_logging, init_request_logging
+from app.utils.metrics import init_metrics
+from app.utils.profiling import init_profiling
+from app.utils.password_pool import init_password_pool
+from app.utils.rate_limit import create_bucket_store
+from app.utils.session_store import init_sessions
+from app.utils.analytics import init_analytics
+from app.utils.lifecycle import init_scheduler
+from app.utils.feed import init_feed
+from app.utils.referral_tree import init_referral_tree
+from app.utils.referral_clicks import init_referral_clicks
+from app.utils.user_purge import init_user_purge
+from app.utils.uploads import init_upload_gc
 
 
 # Initialize extensions
@@ -28,6 +41,14 @@ def create_app(config_name='development'):
     # Load configuration
     app.config.from_object(config[config_name])
 
+    # Behind a reverse proxy, take the client address and scheme from its
+    # X-Forwarded-* headers (login throttling and referral click dedupe and
+    # attribution are keyed on the client IP)
+    hops = app.config['TRUSTED_PROXY_HOPS']
+    if hops:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
     # Ensure upload folders exist
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     os.makedirs(app.config['ATTACHED_ASSETS_FOLDER'], exist_ok=True)
@@ -50,6 +71,7 @@ def create_app(config_name='development'):
     # Run migrations (SQLite only)
     if db_type == 'sqlite':
         db.migrate_add_referrer_approval()
+        db.migrate_add_user_deleted_at()
         db.migrate_add_activity_criteria()
         db.migrate_fix_activity_status()
 
@@ -59,45 +81,51 @@ def create_app(config_name='development'):
     cache = CacheManager()
     app.cache = cache
 
+    # Initialize admin settings snapshot
+    app.settings = SettingsSnapshot(db)
+
+    # Password hashing off the request thread
+    init_password_pool(app, app.settings)
+
+    # Login throttling buckets
+    app.rate_limits = create_bucket_store(app, db)
+
+    # Server-side sessions with a cached user principal
+    init_sessions(app, db)
+
     # Initialize Flask-Mail
     mail.init_app(app)
 
-    # Configure logging (always enabled)
-    import logging
-    from logging.handlers import RotatingFileHandler
-
-    # Create logs directory
-    if not os.path.exists('logs'):
-        os.mkdir('logs')
-
-    # File handler for all environments
-    file_handler = RotatingFileHandler(
-        'logs/budtboy.log',
-        maxBytes=10485760,  # 10MB
-        backupCount=10
-    )
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s [%(levelname)s] %(name)s: %(message)s [in %(pathname)s:%(lineno)d]'
-    ))
-
-    # Set logging level based on environment
-    if app.config['DEBUG']:
-        file_handler.setLevel(logging.DEBUG)
-        app.logger.setLevel(logging.DEBUG)
-    else:
-        file_handler.setLevel(logging.INFO)
-        app.logger.setLevel(logging.INFO)
+    # Configure logging (always enabled, written off the request thread)
+    init_logging(app)
+    init_request_logging(app, db)
+
+    # Runtime metrics and Server-Timing headers
+    init_metrics(app, db, cache)
+
+    # On-demand request profiling for admins
+    init_profiling(app, app.settings)
 
-    app.logger.addHandler(file_handler)
+    # Background analytics rollups
+    init_analytics(app, db)
 
-    # Console handler for development
-    if app.config['DEBUG']:
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(logging.Formatter(
-            '%(levelname)s: %(message)s'
-        ))
-        console_handler.setLevel(logging.INFO)
-        app.logger.addHandler(console_handler)
+    # Time-driven activity status changes (one leader across workers)
+    init_scheduler(app, db)
+
+    # Friends feed backfill and unfriend cleanup
+    init_feed(app, db)
+
+    # Referral closure table (built from users.referred_by on first start)
+    init_referral_tree(app, db)
+
+    # Buffered referral link click tracking
+    init_referral_clicks(app, db)
+
+    # Background purge of deleted users
+    init_user_purge(app, db)
+
+    # Orphaned upload collector
+    init_upload_gc(app, db)
 
     app.logger.info(f'BudtBoy startup - Environment: {config_name}')
 
@@ -126,13 +154,6 @@ def create_app(config_name='development'):
 
         return send_file(full_path)
 
-    # Request logging middleware
-    @app.before_request
-    def log_request():
-        """Log all incoming requests"""
-        from flask import request
-        print(f"📥 {request.method} {request.path} - Query: {request.query_string.decode()}")
-
     # Check if user without referrer is trying to access restricted pages
     @app.before_request
     def check_referrer_restriction():
@@ -144,7 +165,7 @@ def create_app(config_name='development'):
             return
 
         # Skip for auth routes
-        if request.path.startswith('/auth') or request.path.startswith('/signin') or request.path.startswith('/callback') or request.path.startswith('/logout'):
+        if request.path.startswith('/auth') or request.path.startswith('/r/') or request.path.startswith('/signin') or request.path.startswith('/callback') or request.path.startswith('/logout'):
             return
 
         # Skip for API routes (we'll handle these separately)
@@ -160,9 +181,9 @@ def create_app(config_name='development'):
         if user_id == 1:
             return
 
-        # Check if user has a referrer
-        user = db.execute_query('SELECT referred_by FROM users WHERE id = %s', (user_id,))
-        if user and user[0]['referred_by'] is None:
+        # Check if user has a referrer (from the cached principal)
+        principal = current_principal()
+        if principal is not None and not principal['has_referrer']:
             # User has no referrer - only allow profile page
             allowed_paths = ['/profile', '/api/profile', '/api/profile/image', '/api/submit_referral_code']
 
@@ -217,7 +238,7 @@ def create_app(config_name='development'):
 
     @app.errorhandler(500)
     def internal_error(error):
-        app.logger.error(f'500 error: {error}')
+        app.logger.error(f'500 error: {error}', exc_info=getattr(error, 'original_exception', None))
         return {'error': 'Internal server error'}, 500
 
     return app
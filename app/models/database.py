@@ -1,5 +1,6 @@
 import sqlite3
 import threading
+import time
 from contextlib import contextmanager
 import sys
 import os
@@ -8,7 +9,7 @@ import os
 class Database:
     """Database manager supporting both SQLite and PostgreSQL"""
 
-    def __init__(self, db_path=None, db_url=None, db_type='sqlite'):
+    def __init__(self, db_path=None, db_url=None, db_type='sqlite', reuse_connections=False):
         """
         Initialize database connection
 
@@ -16,12 +17,18 @@ class Database:
             db_path: Path to SQLite database file
             db_url: PostgreSQL connection URL
             db_type: 'sqlite' or 'postgresql'
+            reuse_connections: Keep one open connection per thread instead of
+                connecting for every call
         """
         self.db_type = db_type.lower()
         self.db_path = db_path
         self.db_url = db_url
+        self.reuse_connections = reuse_connections
         self.local = threading.local()
 
+        # Callbacks receiving the elapsed seconds of each connection use
+        self.query_observers = []
+
         # Import PostgreSQL driver if needed
         if self.db_type == 'postgresql':
             try:
@@ -32,30 +39,63 @@ class Database:
             except ImportError:
                 raise ImportError("psycopg2-binary is required for PostgreSQL support. Install it with: pip install psycopg2-binary")
 
-    @contextmanager
-    def get_connection(self):
-        """Get database connection with context manager"""
+    def _connect(self):
+        """Open a new connection"""
         if self.db_type == 'sqlite':
             conn = sqlite3.connect(self.db_path, check_same_thread=False)
             conn.row_factory = sqlite3.Row
         else:  # postgresql
             conn = self.psycopg2.connect(self.db_url)
+        return conn
+
+    def close_connection(self):
+        """Close this thread's reused connection, if any"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            self.local.conn = None
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    @contextmanager
+    def get_connection(self):
+        """Get database connection with context manager"""
+        start = time.perf_counter()
+        if self.reuse_connections:
+            conn = getattr(self.local, 'conn', None)
+            if conn is None:
+                conn = self.local.conn = self._connect()
+        else:
+            conn = self._connect()
 
         try:
             yield conn
             conn.commit()
         except Exception as e:
-            conn.rollback()
+            if self.reuse_connections:
+                # The connection may be broken; start fresh on the next call
+                self.close_connection()
+            else:
+                conn.rollback()
             raise e
         finally:
-            conn.close()
+            if not self.reuse_connections:
+                conn.close()
+            if self.query_observers:
+                elapsed = time.perf_counter() - start
+                for observer in self.query_observers:
+                    observer(elapsed)
 
     def _convert_query_placeholders(self, query):
-        """Convert SQLite ? placeholders to PostgreSQL %s placeholders"""
+        """Convert between SQLite ? and PostgreSQL %s placeholders"""
         if self.db_type == 'postgresql':
             # Simply replace all ? with %s
             # psycopg2 will handle the parameter binding correctly
             query = query.replace('?', '%s')
+        else:
+            # Routes are mostly written with %s; sqlite3 only understands ?
+            query = query.replace('%s', '?')
         return query
 
     def execute_query(self, query, params=None):
@@ -124,6 +164,70 @@ class Database:
                 cursor.execute(query)
             return cursor.rowcount
 
+    def execute_many(self, query, params_seq, page_size=1000):
+        """Execute the same statement for many parameter tuples in one transaction"""
+        query = self._convert_query_placeholders(query)
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if self.db_type == 'sqlite':
+                cursor.executemany(query, params_seq)
+            else:  # postgresql
+                # execute_batch sends page_size statements per round trip
+                self.psycopg2_extras.execute_batch(cursor, query, params_seq, page_size=page_size)
+            return cursor.rowcount
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run several statements atomically on one connection
+
+        Yields a Transaction with execute_query/execute_update. Commits when
+        the block ends and rolls back if it raises. On SQLite the write lock
+        is taken up front (BEGIN IMMEDIATE), so concurrent transactions queue
+        on the busy timeout instead of failing to upgrade a read lock.
+        """
+        with self.get_connection() as conn:
+            if self.db_type == 'sqlite':
+                conn.execute('BEGIN IMMEDIATE')
+            yield Transaction(self, conn)
+
+    def stream_query(self, query, params=None, batch_size=1000):
+        """
+        Execute a query and yield its results incrementally
+
+        The first item is the list of column names, then every row as a tuple.
+        Rows are fetched batch_size at a time (a server-side cursor on
+        PostgreSQL), so memory stays flat however large the result is. Uses
+        its own connection, which is closed when the generator finishes or is
+        closed. Not reported to query_observers: the time spent is paced by
+        the client reading the rows.
+        """
+        query = self._convert_query_placeholders(query)
+        conn = self._connect()
+
+        try:
+            if self.db_type == 'sqlite':
+                conn.row_factory = None
+                cursor = conn.cursor()
+            else:  # postgresql
+                # Named cursor = server-side; rows stay on the server until fetched
+                cursor = conn.cursor(name=f'stream_{id(conn)}')
+                cursor.itersize = batch_size
+
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+            rows = cursor.fetchmany(batch_size)
+            yield [column[0] for column in cursor.description]
+
+            while rows:
+                yield from rows
+                rows = cursor.fetchmany(batch_size)
+        finally:
+            conn.close()
+
     def _get_create_table_syntax(self, table_sql):
         """Convert SQLite CREATE TABLE syntax to PostgreSQL if needed"""
         if self.db_type == 'sqlite':
@@ -157,8 +261,30 @@ class Database:
 
         return sql
 
+    def enable_wal(self):
+        """
+        Put a SQLite file in write-ahead log mode (stored in the file)
+
+        In the default rollback-journal mode an open read cursor, such as a
+        stream_query() export, holds a SHARED lock and every writer fails
+        with "database is locked". With WAL, readers and the writer don't
+        block each other.
+        """
+        conn = self._connect()
+        try:
+            mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+        except sqlite3.OperationalError as e:
+            print(f"⚠️ Could not enable WAL: {e}")
+            return False
+        finally:
+            conn.close()
+        return mode == 'wal'
+
     def init_db(self):
         """Initialize database schema"""
+        if self.db_type == 'sqlite' and self.db_path != ':memory:':
+            self.enable_wal()
+
         with self.get_connection() as conn:
             cursor = conn.cursor()
 
@@ -190,6 +316,7 @@ class Database:
                     approved_at TIMESTAMP,
                     approved_by INTEGER,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    deleted_at TIMESTAMP,
                     FOREIGN KEY (referred_by) REFERENCES users(id),
                     FOREIGN KEY (approved_by) REFERENCES users(id)
                 )
@@ -448,6 +575,139 @@ class Database:
             '''
             cursor.execute(self._get_create_table_syntax(table_sql))
 
+            # Server-side sessions (SESSION_BACKEND = 'database')
+            table_sql = '''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    user_id INTEGER,
+                    data TEXT NOT NULL,
+                    principal TEXT,
+                    expires_at REAL NOT NULL
+                )
+            '''
+            cursor.execute(self._get_create_table_syntax(table_sql))
+
+            # Login rate limit buckets (RATE_LIMIT_BACKEND = 'database')
+            table_sql = '''
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            '''
+            cursor.execute(self._get_create_table_syntax(table_sql))
+
+            # Taken registration slots per activity (guards max_participants)
+            table_sql = '''
+                CREATE TABLE IF NOT EXISTS activity_slots (
+                    activity_id INTEGER PRIMARY KEY,
+                    taken INTEGER NOT NULL DEFAULT 0
+                )
+            '''
+            cursor.execute(self._get_create_table_syntax(table_sql))
+
+            # Analytics rollups (hourly and daily counts per metric)
+            table_sql = '''
+                CREATE TABLE IF NOT EXISTS analytics_rollups (
+                    metric TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    bucket_start TEXT NOT NULL,
+                    value INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (metric, bucket, bucket_start)
+                )
+            '''
+            cursor.execute(self._get_create_table_syntax(table_sql))
+
+            # Analytics rollup progress per metric
+            table_sql = '''
+                CREATE TABLE IF NOT EXISTS analytics_state (
+                    metric TEXT PRIMARY KEY,
+                    watermark TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            '''
+            cursor.execute(self._get_create_table_syntax(table_sql))
+
+            # Leaderboard and participant list frozen when an activity closes (JSON)
+            table_sql = '''
+                CREATE TABLE IF NOT EXISTS activity_snapshots (
+                    activity_id INTEGER PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            '''
+            cursor.execute(self._get_create_table_syntax(table_sql))
+
+            # Friends' reviews feed, one row per reader and review (filled when a review is written)
+            table_sql = '''
+                CREATE TABLE IF NOT EXISTS feed_items (
+                    user_id INTEGER NOT NULL,
+                    review_id INTEGER NOT NULL,
+                    reviewer_id INTEGER NOT NULL,
+                    created_at TIMESTAMP NOT NULL,
+                    PRIMARY KEY (user_id, review_id)
+                )
+            '''
+            cursor.execute(self._get_create_table_syntax(table_sql))
+
+            # Reader/author pairs whose past reviews are already in feed_items
+            table_sql = '''
+                CREATE TABLE IF NOT EXISTS feed_follows (
+                    reader_id INTEGER NOT NULL,
+                    author_id INTEGER NOT NULL,
+                    PRIMARY KEY (reader_id, author_id)
+                )
+            '''
+            cursor.execute(self._get_create_table_syntax(table_sql))
+
+            # Every (referrer, user) pair along users.referred_by chains, with the number of hops
+            table_sql = '''
+                CREATE TABLE IF NOT EXISTS referral_closure (
+                    ancestor_id INTEGER NOT NULL,
+                    descendant_id INTEGER NOT NULL,
+                    depth INTEGER NOT NULL,
+                    PRIMARY KEY (ancestor_id, descendant_id)
+                )
+            '''
+            cursor.execute(self._get_create_table_syntax(table_sql))
+
+            # Leader election for background jobs that must run on one worker
+            table_sql = '''
+                CREATE TABLE IF NOT EXISTS scheduler_leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            '''
+            cursor.execute(self._get_create_table_syntax(table_sql))
+
+            # Orphaned uploads moved aside by the upload GC, deleted after the quarantine period
+            table_sql = '''
+                CREATE TABLE IF NOT EXISTS upload_quarantine (
+                    name TEXT PRIMARY KEY,
+                    size INTEGER,
+                    quarantined_at REAL NOT NULL
+                )
+            '''
+            cursor.execute(self._get_create_table_syntax(table_sql))
+
+            # Soft-deleted users waiting for (or done with) the purge job
+            table_sql = '''
+                CREATE TABLE IF NOT EXISTS user_purges (
+                    user_id INTEGER PRIMARY KEY,
+                    requested_by INTEGER,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    step TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    rows_deleted INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    started_at TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            '''
+            cursor.execute(self._get_create_table_syntax(table_sql))
+
             # Create indexes (skip for PostgreSQL if needed, or adjust syntax)
             if self.db_type == 'sqlite':
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)')
@@ -461,6 +721,22 @@ class Database:
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_friends_status ON friends(status)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_activities_status ON activities(status)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_participants_activity ON activity_participants(activity_id)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_buds_created ON buds_data(created_at)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_reviews_created ON reviews(created_at)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_activities_created ON activities(created_at)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_approved_at ON users(approved_at)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_referrer_approved_at ON users(referrer_approved_at)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_participants_registered ON activity_participants(registered_at)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_friends_friend ON friends(friend_id)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_feed_items_user_created ON feed_items(user_id, created_at, review_id)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_feed_items_reviewer ON feed_items(reviewer_id)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_feed_follows_author ON feed_follows(author_id)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_referral_closure_descendant ON referral_closure(descendant_id, depth)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_referrer_visitor ON referrals(referrer_user_id, ip_hash, user_agent_hash)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_referred ON referrals(referred_user_id)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_participants_bud ON activity_participants(bud_id, activity_id)')
             else:  # postgresql
                 # PostgreSQL uses different syntax for conditional index creation
                 indexes = [
@@ -474,7 +750,23 @@ class Database:
                     'CREATE INDEX IF NOT EXISTS idx_friends_user ON friends(user_id)',
                     'CREATE INDEX IF NOT EXISTS idx_friends_status ON friends(status)',
                     'CREATE INDEX IF NOT EXISTS idx_activities_status ON activities(status)',
-                    'CREATE INDEX IF NOT EXISTS idx_activity_participants_activity ON activity_participants(activity_id)'
+                    'CREATE INDEX IF NOT EXISTS idx_activity_participants_activity ON activity_participants(activity_id)',
+                    'CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id)',
+                    'CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at)',
+                    'CREATE INDEX IF NOT EXISTS idx_buds_created ON buds_data(created_at)',
+                    'CREATE INDEX IF NOT EXISTS idx_reviews_created ON reviews(created_at)',
+                    'CREATE INDEX IF NOT EXISTS idx_activities_created ON activities(created_at)',
+                    'CREATE INDEX IF NOT EXISTS idx_users_approved_at ON users(approved_at)',
+                    'CREATE INDEX IF NOT EXISTS idx_users_referrer_approved_at ON users(referrer_approved_at)',
+                    'CREATE INDEX IF NOT EXISTS idx_activity_participants_registered ON activity_participants(registered_at)',
+                    'CREATE INDEX IF NOT EXISTS idx_friends_friend ON friends(friend_id)',
+                    'CREATE INDEX IF NOT EXISTS idx_feed_items_user_created ON feed_items(user_id, created_at, review_id)',
+                    'CREATE INDEX IF NOT EXISTS idx_feed_items_reviewer ON feed_items(reviewer_id)',
+                    'CREATE INDEX IF NOT EXISTS idx_feed_follows_author ON feed_follows(author_id)',
+                    'CREATE INDEX IF NOT EXISTS idx_referral_closure_descendant ON referral_closure(descendant_id, depth)',
+                    'CREATE INDEX IF NOT EXISTS idx_referrals_referrer_visitor ON referrals(referrer_user_id, ip_hash, user_agent_hash)',
+                    'CREATE INDEX IF NOT EXISTS idx_referrals_referred ON referrals(referred_user_id)',
+                    'CREATE INDEX IF NOT EXISTS idx_activity_participants_bud ON activity_participants(bud_id, activity_id)'
                 ]
                 for index_sql in indexes:
                     try:
@@ -508,6 +800,21 @@ class Database:
                 cursor.execute('ALTER TABLE users ADD COLUMN referrer_approved_at TIMESTAMP')
                 print("✅ Added referrer_approved_at column")
 
+    def migrate_add_user_deleted_at(self):
+        """Add the users.deleted_at soft-delete column if it doesn't exist"""
+        # Skip for PostgreSQL - the column is already in init_db
+        if self.db_type == 'postgresql':
+            return
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("PRAGMA table_info(users)")
+            columns = [row[1] for row in cursor.fetchall()]
+
+            if 'deleted_at' not in columns:
+                cursor.execute('ALTER TABLE users ADD COLUMN deleted_at TIMESTAMP')
+                print("✅ Added deleted_at column")
+
     def migrate_add_activity_criteria(self):
         """Add activity criteria columns if they don't exist"""
         # Skip for PostgreSQL - these columns are already in init_db
@@ -557,3 +864,43 @@ class Database:
         # SQLite-specific migration code...
         # (keeping original code for SQLite compatibility)
         pass
+
+
+class Transaction:
+    """Statements sharing one connection and transaction (see Database.transaction)"""
+
+    def __init__(self, db, conn):
+        self.db = db
+        self.conn = conn
+
+    def _execute(self, query, params):
+        if self.db.db_type == 'sqlite':
+            cursor = self.conn.cursor()
+        else:  # postgresql
+            cursor = self.conn.cursor(cursor_factory=self.db.psycopg2_extras.RealDictCursor)
+        query = self.db._convert_query_placeholders(query)
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        return cursor
+
+    def execute_query(self, query, params=None):
+        """Execute a query and return results"""
+        cursor = self._execute(query, params)
+        return cursor.fetchall()
+
+    def execute_update(self, query, params=None):
+        """Execute insert/update/delete and return affected rows"""
+        cursor = self._execute(query, params)
+        return cursor.rowcount
+
+    def execute_many(self, query, params_seq, page_size=1000):
+        """Execute the same statement for many parameter tuples"""
+        query = self.db._convert_query_placeholders(query)
+        cursor = self.conn.cursor()
+        if self.db.db_type == 'sqlite':
+            cursor.executemany(query, params_seq)
+        else:  # postgresql
+            self.db.psycopg2_extras.execute_batch(cursor, query, params_seq, page_size=page_size)
+        return cursor.rowcount
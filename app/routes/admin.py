@@ -1,6 +1,6 @@
-from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, current_app
 from datetime import datetime, timedelta
-from app.utils import hash_password, verify_password, admin_required
+from app.utils import hash_password, verify_password, rehash_password, admin_required, PasswordPoolError, login_throttled
 from config import config
 import os
 
@@ -14,6 +14,7 @@ def get_db():
 
 
 @admin_bp.route('/login', methods=['GET', 'POST'])
+@login_throttled('admin_login', 'admin_name')
 def login_page():
     """Admin login page and handler"""
     if request.method == 'GET':
@@ -77,6 +78,7 @@ def login_page():
                 return jsonify({'error': 'บัญชีถูกล็อกเนื่องจากพยายามเข้าสู่ระบบหลายครั้ง'}), 403
 
             return jsonify({'error': 'ชื่อผู้ใช้หรือรหัสผ่านไม่ถูกต้อง'}), 401
+        rehash_password('admin_accounts', admin['id'], password, admin['password_hash'])
 
         # Reset login attempts
         db.execute_update(
@@ -92,8 +94,11 @@ def login_page():
 
         return jsonify({'success': True, 'message': 'เข้าสู่ระบบสำเร็จ'})
 
+    except PasswordPoolError as e:
+        current_app.logger.warning(f"Admin login rejected: {e}")
+        return jsonify({'error': 'ระบบกำลังทำงานหนัก กรุณาลองใหม่อีกครั้ง'}), 503
     except Exception as e:
-        print(f"Admin login error: {e}")
+        current_app.logger.exception(f"Admin login error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาดในการเข้าสู่ระบบ'}), 500
 
 
@@ -4,16 +4,89 @@ This file contains API endpoints for the application
 """
 from flask import Blueprint, request, jsonify, session, send_from_directory, current_app
 from werkzeug.utils import secure_filename
-from datetime import datetime
+from datetime import datetime, timedelta
 from app.utils import (
     api_login_required, api_admin_required,
-    allowed_file, generate_unique_filename,
-    dict_from_row, dicts_from_rows
+    allowed_file,
+    dict_from_row, dicts_from_rows,
+    current_principal, invalidate_principal, revoke_user_sessions
+)
+from app.utils.analytics import ROLLUP_METRICS, BUCKETS as ANALYTICS_BUCKETS, get_series
+from app.utils.export import EXPORT_FORMATS, export_response
+from app.utils.eligibility import compile_criteria, load_user_buds, check_buds
+from app.utils.registration import (
+    ActivityFull, AlreadyJoined, activity_is_full, register_participant, reset_slots
+)
+from app.utils.judging import (
+    judge_activity, get_leaderboard, invalidate_leaderboard, invalidate_bud_leaderboards,
+    load_participants, merge_standings
+)
+from app.utils.feed import FEED_PAGE_SIZE, FEED_MAX_PAGE_SIZE, fan_out_review, read_feed
+from app.utils.referral_tree import (
+    MAX_DEPTH as REFERRAL_MAX_DEPTH, REFERRAL_CACHE_PREFIX, ReferralCycle,
+    link_referral, lock_tree, downline_by_depth, branch_conversion,
+    top_referrers, invalidate_referral_cache
+)
+from app.utils.referral_clicks import attribute_request_signup, mark_converted, click_stats
+from app.utils.uploads import save_upload, serve_upload
+from app.utils.user_purge import request_purge, get_purge, list_purges
+from app.utils.lifecycle import (
+    SCHEDULED_STATUSES, load_snapshot, refresh_snapshots, sync_snapshot, drop_snapshot
 )
 import os
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+# Tables counted on the admin dashboard: (stat name, table, row filter or None)
+ADMIN_STAT_TABLES = [
+    ('users', 'users', 'deleted_at IS NULL'),
+    ('buds', 'buds_data', None),
+    ('reviews', 'reviews', None),
+    ('activities', 'activities', None),
+]
+
+# Longest series /admin/analytics returns per bucket size
+ANALYTICS_MAX_BUCKETS = {'day': 366, 'hour': 24 * 14}
+
+# Full dumps served by /admin/export/<dataset> ({where} takes optional filters)
+EXPORT_QUERIES = {
+    'buds': '''
+        SELECT b.*, u.username AS grower_name
+        FROM buds_data b
+        LEFT JOIN users u ON b.grower_id = u.id
+        {where}
+        ORDER BY b.id
+    ''',
+    'reviews': '''
+        SELECT r.*, u.username AS reviewer_name, b.strain_name_th, b.strain_name_en
+        FROM reviews r
+        LEFT JOIN users u ON r.reviewer_id = u.id
+        LEFT JOIN buds_data b ON r.bud_reference_id = b.id
+        {where}
+        ORDER BY r.id
+    ''',
+    'participants': '''
+        SELECT
+            ap.*,
+            a.name AS activity_name,
+            u.username,
+            b.strain_name_th,
+            b.strain_name_en,
+            b.breeder,
+            b.strain_type,
+            b.grow_method,
+            b.grade,
+            b.thc_percentage,
+            b.cbd_percentage
+        FROM activity_participants ap
+        JOIN activities a ON ap.activity_id = a.id
+        LEFT JOIN users u ON ap.user_id = u.id
+        LEFT JOIN buds_data b ON ap.bud_id = b.id
+        {where}
+        ORDER BY ap.id
+    ''',
+}
+
 
 def get_db():
     """Get database instance"""
@@ -25,6 +98,29 @@ def get_cache():
     return current_app.cache
 
 
+def get_settings():
+    """Get admin settings snapshot"""
+    return current_app.settings
+
+
+def participants_with_standings(activity):
+    """
+    An activity's participants with scores and ranks, and whether it is judged
+
+    Activities past registration are served from the snapshot the lifecycle
+    scheduler wrote when they closed; open ones from the cached leaderboard.
+    """
+    db = get_db()
+    if activity.get('status') not in SCHEDULED_STATUSES:
+        snapshot = load_snapshot(db, activity['id'])
+        if snapshot is not None:
+            return snapshot['participants'], snapshot['leaderboard']['judged']
+
+    participants = load_participants(db, activity['id'])
+    leaderboard = get_leaderboard(db, get_cache(), activity, current_app.config['ACTIVITY_CACHE_TTL'])
+    return participants, merge_standings(participants, leaderboard)
+
+
 # ==================== Profile API ====================
 
 @api_bp.route('/profile', methods=['GET'])
@@ -58,7 +154,7 @@ def get_profile():
         return jsonify({'success': True, 'user': user})
 
     except Exception as e:
-        print(f"Get profile error: {e}")
+        current_app.logger.exception(f"Get profile error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -119,11 +215,12 @@ def update_profile():
 
         # Clear cache
         cache.clear_pattern(f'profile_{user_id}')
+        invalidate_principal(user_id)
 
         return jsonify({'success': True, 'message': 'อัพเดทโปรไฟล์สำเร็จ'})
 
     except Exception as e:
-        print(f"Update profile error: {e}")
+        current_app.logger.exception(f"Update profile error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาดในการอัพเดท'}), 500
 
 
@@ -151,16 +248,11 @@ def upload_profile_image():
         return jsonify({'error': error_msg}), 400
 
     try:
-        # Generate unique filename
-        filename = generate_unique_filename(file.filename)
-        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-
-        # Save file
-        file.save(filepath)
+        # Store by content hash (an identical image is stored once)
+        profile_image_url = save_upload(file, current_app.config['UPLOAD_FOLDER'])
 
         # Update database with full path
         db = get_db()
-        profile_image_url = f'/uploads/{filename}'
         db.execute_update(
             'UPDATE users SET profile_image_url = %s WHERE id = %s',
             (profile_image_url, user_id)
@@ -169,15 +261,16 @@ def upload_profile_image():
         # Clear cache
         cache = get_cache()
         cache.clear_pattern(f'profile_{user_id}')
+        invalidate_principal(user_id)
 
         return jsonify({
             'success': True,
             'message': 'อัพโหลดรูปภาพสำเร็จ',
-            'profile_image_url': f'/uploads/{filename}'
+            'profile_image_url': profile_image_url
         })
 
     except Exception as e:
-        print(f"Upload image error: {e}")
+        current_app.logger.exception(f"Upload image error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาดในการอัพโหลด'}), 500
 
 
@@ -217,7 +310,7 @@ def get_buds():
         return jsonify({'success': True, 'buds': buds_list})
 
     except Exception as e:
-        print(f"Get buds error: {e}")
+        current_app.logger.exception(f"Get buds error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -242,7 +335,7 @@ def handle_bud_detail(bud_id):
             return jsonify(bud)
 
         except Exception as e:
-            print(f"Get bud detail error: {e}")
+            current_app.logger.exception(f"Get bud detail error: {e}")
             return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
     elif request.method == 'PUT':
@@ -332,9 +425,7 @@ def handle_bud_detail(bud_id):
             })
 
         except Exception as e:
-            import traceback
-            print(f"Update bud error: {e}")
-            print(f"Traceback: {traceback.format_exc()}")
+            current_app.logger.exception(f"Update bud error: {e}")
             return jsonify({'error': f'เกิดข้อผิดพลาดในการอัปเดต: {str(e)}'}), 500
 
 
@@ -372,13 +463,8 @@ def upload_bud_images(bud_id):
                     if not is_valid:
                         return jsonify({'error': f'รูปที่ {i}: {error_msg}'}), 400
 
-                    # Generate unique filename and save
-                    filename = generate_unique_filename(file.filename)
-                    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                    file.save(filepath)
-
-                    # Store URL for update
-                    image_url = f'/uploads/{filename}'
+                    # Store by content hash and keep the URL for the update
+                    image_url = save_upload(file, current_app.config['UPLOAD_FOLDER'])
                     uploaded_images[f'image_{i}_url'] = image_url
                     update_fields.append(f'image_{i}_url = %s')
                     params.append(image_url)
@@ -397,13 +483,8 @@ def upload_bud_images(bud_id):
                     if not is_valid:
                         return jsonify({'error': f'ใบรับรองที่ {i}: {error_msg}'}), 400
 
-                    # Generate unique filename and save
-                    filename = generate_unique_filename(file.filename)
-                    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                    file.save(filepath)
-
-                    # Store URL for update
-                    image_url = f'/uploads/{filename}'
+                    # Store by content hash and keep the URL for the update
+                    image_url = save_upload(file, current_app.config['UPLOAD_FOLDER'])
                     uploaded_images[f'certificate_image_{i}_url'] = image_url
                     update_fields.append(f'certificate_image_{i}_url = %s')
                     params.append(image_url)
@@ -426,9 +507,7 @@ def upload_bud_images(bud_id):
             })
 
     except Exception as e:
-        import traceback
-        print(f"Upload bud images error: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
+        current_app.logger.exception(f"Upload bud images error: {e}")
         return jsonify({'error': f'เกิดข้อผิดพลาดในการอัพโหลดรูปภาพ: {str(e)}'}), 500
 
 
@@ -491,7 +570,7 @@ def get_bud_info(bud_id):
         })
 
     except Exception as e:
-        print(f"Get bud info error: {e}")
+        current_app.logger.exception(f"Get bud info error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -534,7 +613,7 @@ def create_bud():
         })
 
     except Exception as e:
-        print(f"Create bud error: {e}")
+        current_app.logger.exception(f"Create bud error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -565,7 +644,7 @@ def delete_bud(bud_id):
         return jsonify({'success': True, 'message': 'ลบข้อมูลสำเร็จ'})
 
     except Exception as e:
-        print(f"Delete bud error: {e}")
+        current_app.logger.exception(f"Delete bud error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -611,7 +690,7 @@ def update_bud_status(bud_id):
         })
 
     except Exception as e:
-        print(f"Update bud status error: {e}")
+        current_app.logger.exception(f"Update bud status error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาดในการอัปเดตสถานะ'}), 500
 
 
@@ -643,7 +722,7 @@ def get_user_buds():
                 ORDER BY b.created_at DESC
             ''', (user_id,))
         except Exception as e:
-            print(f"Error with grower_id query: {e}")
+            current_app.logger.warning(f"Error with grower_id query: {e}")
             # Fallback to user_id if grower_id doesn't exist
             buds = db.execute_query('''
                 SELECT
@@ -681,9 +760,7 @@ def get_user_buds():
         return jsonify({'buds': buds_list})
 
     except Exception as e:
-        print(f"Get user buds error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Get user buds error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด', 'buds': []}), 500
 
 
@@ -723,7 +800,7 @@ def get_reviews():
         return jsonify({'success': True, 'reviews': reviews_list})
 
     except Exception as e:
-        print(f"Get reviews error: {e}")
+        current_app.logger.exception(f"Get reviews error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -763,9 +840,7 @@ def get_review_by_id(review_id):
         return jsonify({'success': True, 'review': review_dict})
 
     except Exception as e:
-        print(f"Get review by ID error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Get review by ID error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -780,7 +855,7 @@ def update_review(review_id):
     try:
         # Check if review exists and user owns it
         existing_review = db.execute_query(
-            'SELECT id, reviewer_id FROM reviews WHERE id = %s',
+            'SELECT id, reviewer_id, bud_reference_id FROM reviews WHERE id = %s',
             (review_id,)
         )
 
@@ -821,13 +896,13 @@ def update_review(review_id):
         # Execute update
         query = f"UPDATE reviews SET {', '.join(update_fields)} WHERE id = %s"
         db.execute_update(query, tuple(params))
+        # Provisional standings score the bud's reviews
+        invalidate_bud_leaderboards(db, get_cache(), review['bud_reference_id'])
 
         return jsonify({'success': True, 'message': 'อัพเดทรีวิวสำเร็จ'})
 
     except Exception as e:
-        print(f"Update review error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Update review error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาดในการอัพเดท'}), 500
 
 
@@ -887,6 +962,8 @@ def create_review():
             aroma_flavors_str, selected_effects_str, aroma_rating,
             full_review_content, review_images_str, video_review_url
         ))
+        fan_out_review(db, review_id)
+        invalidate_bud_leaderboards(db, get_cache(), bud_reference_id)
 
         return jsonify({
             'success': True,
@@ -895,9 +972,7 @@ def create_review():
         })
 
     except Exception as e:
-        print(f"Create review error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Create review error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาดในการบันทึก'}), 500
 
 
@@ -927,7 +1002,7 @@ def get_user_reviews():
         return jsonify({'reviews': reviews_list})
 
     except Exception as e:
-        print(f"Get user reviews error: {e}")
+        current_app.logger.exception(f"Get user reviews error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด', 'reviews': []}), 500
 
 
@@ -958,59 +1033,33 @@ def get_referrer_info(referral_code):
             }), 404
 
     except Exception as e:
-        print(f"Get referrer info error: {e}")
+        current_app.logger.exception(f"Get referrer info error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
 @api_bp.route('/friends_reviews', methods=['GET'])
 @api_login_required
 def get_friends_reviews():
-    """Get reviews from user's friends"""
+    """
+    Get reviews from user's friends, newest first
+
+    Served from the user's feed_items rows: ?limit= sets the page size and
+    ?cursor= takes the next_cursor of the previous page.
+    """
     user_id = session.get('user_id')
     db = get_db()
 
     try:
-        # Get list of accepted friends
-        friends_rows = db.execute_query('''
-            SELECT
-                CASE
-                    WHEN user_id = %s THEN friend_id
-                    ELSE user_id
-                END as friend_user_id
-            FROM friends
-            WHERE (user_id = %s OR friend_id = %s)
-              AND status = 'accepted'
-        ''', (user_id, user_id, user_id))
-
-        if not friends_rows:
-            return jsonify({'reviews': []})
-
-        # Extract friend user IDs
-        friend_ids = [row['friend_user_id'] for row in friends_rows]
-
-        # Get reviews from these friends with JOIN to get reviewer info and bud info
-        placeholders = ','.join('%s' * len(friend_ids))
-        reviews = db.execute_query(f'''
-            SELECT
-                r.*,
-                u.username as reviewer_name,
-                u.profile_image_url as reviewer_image,
-                b.strain_name_th,
-                b.strain_name_en
-            FROM reviews r
-            LEFT JOIN users u ON r.reviewer_id = u.id
-            LEFT JOIN buds_data b ON r.bud_reference_id = b.id
-            WHERE r.reviewer_id IN ({placeholders})
-            ORDER BY r.created_at DESC
-        ''', tuple(friend_ids))
-
-        reviews_list = dicts_from_rows(reviews) if reviews else []
-        return jsonify({'reviews': reviews_list})
-
+        limit = min(max(int(request.args.get('limit', FEED_PAGE_SIZE)), 1), FEED_MAX_PAGE_SIZE)
+        reviews_list, next_cursor = read_feed(db, user_id, limit, request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'พารามิเตอร์ไม่ถูกต้อง', 'reviews': []}), 400
     except Exception as e:
-        print(f"Get friends reviews error: {e}")
+        current_app.logger.exception(f"Get friends reviews error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด', 'reviews': []}), 500
 
+    return jsonify({'reviews': reviews_list, 'next_cursor': next_cursor})
+
 
 @api_bp.route('/activities', methods=['GET'])
 @api_login_required
@@ -1039,9 +1088,7 @@ def get_activities():
         return jsonify({'success': True, 'activities': activities_list})
 
     except Exception as e:
-        print(f"Get activities error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Get activities error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -1063,7 +1110,7 @@ def get_pending_friends_count():
         return jsonify({'success': True, 'count': count})
 
     except Exception as e:
-        print(f"Get pending friends count error: {e}")
+        current_app.logger.exception(f"Get pending friends count error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -1096,8 +1143,8 @@ def get_friends():
                 })
 
         # Get current user's referral code
-        current_user = db.execute_query('SELECT referral_code FROM users WHERE id = %s', (user_id,))
-        referral_code = current_user[0]['referral_code'] if current_user and current_user[0]['referral_code'] else ''
+        principal = current_principal()
+        referral_code = principal['referral_code'] if principal and principal['referral_code'] else ''
 
         return jsonify({
             'success': True,
@@ -1106,9 +1153,7 @@ def get_friends():
         })
 
     except Exception as e:
-        print(f"Get friends error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Get friends error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -1147,6 +1192,10 @@ def approve_referral():
             SET referrer_approved = TRUE, referrer_approved_at = CURRENT_TIMESTAMP
             WHERE id = %s
         ''', (referred_user_id,))
+        mark_converted(db, referred_user_id)
+
+        invalidate_principal(referred_user[0]['id'])
+        invalidate_referral_cache(get_cache())
 
         return jsonify({
             'success': True,
@@ -1154,9 +1203,87 @@ def approve_referral():
         })
 
     except Exception as e:
-        print(f"Approve referral error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Approve referral error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+def referral_network(user_id, depth):
+    """Downline per level and per branch of a user, cached for SHORT_CACHE_TTL"""
+    cache = get_cache()
+    key = f'{REFERRAL_CACHE_PREFIX}{user_id}:{depth}'
+    network = cache.get(key)
+    if network is None:
+        db = get_db()
+        levels = downline_by_depth(db, user_id, depth)
+        network = {
+            'depth': depth,
+            'total': sum(level['users'] for level in levels),
+            'converted': sum(level['converted'] or 0 for level in levels),
+            'levels': levels,
+            'branches': branch_conversion(db, user_id, depth),
+            'link': click_stats(db, user_id),
+        }
+        cache.set(key, network, current_app.config['SHORT_CACHE_TTL'])
+    return network
+
+
+def referral_depth_arg():
+    return min(max(int(request.args.get('depth', REFERRAL_MAX_DEPTH)), 1), REFERRAL_MAX_DEPTH)
+
+
+@api_bp.route('/referrals/network', methods=['GET'])
+@api_login_required
+def get_referral_network():
+    """Your referral downline: counts per level and conversion per branch"""
+    try:
+        depth = referral_depth_arg()
+    except ValueError:
+        return jsonify({'error': 'พารามิเตอร์ไม่ถูกต้อง'}), 400
+
+    try:
+        return jsonify({'success': True, 'network': referral_network(session.get('user_id'), depth)})
+    except Exception as e:
+        current_app.logger.exception(f"Get referral network error: {e}")
+        return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
+
+
+@api_bp.route('/admin/referrals/<int:user_id>', methods=['GET'])
+@api_admin_required
+def get_user_referral_network(user_id):
+    """A user's referral downline (admin)"""
+    try:
+        depth = referral_depth_arg()
+    except ValueError:
+        return jsonify({'error': 'พารามิเตอร์ไม่ถูกต้อง'}), 400
+
+    try:
+        return jsonify({'success': True, 'network': referral_network(user_id, depth)})
+    except Exception as e:
+        current_app.logger.exception(f"Get user referral network error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@api_bp.route('/admin/referrals/top', methods=['GET'])
+@api_admin_required
+def get_top_referrers():
+    """Users with the largest referral downlines"""
+    try:
+        depth = referral_depth_arg()
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'พารามิเตอร์ไม่ถูกต้อง'}), 400
+
+    cache = get_cache()
+    key = f'{REFERRAL_CACHE_PREFIX}top:{depth}:{limit}'
+
+    try:
+        referrers = cache.get(key)
+        if referrers is None:
+            referrers = top_referrers(get_db(), limit, depth)
+            cache.set(key, referrers, current_app.config['SHORT_CACHE_TTL'])
+        return jsonify({'success': True, 'depth': depth, 'referrers': referrers})
+    except Exception as e:
+        current_app.logger.exception(f"Get top referrers error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -1165,43 +1292,145 @@ def approve_referral():
 @api_bp.route('/admin/stats', methods=['GET'])
 @api_admin_required
 def get_admin_stats():
-    """Get admin statistics"""
+    """
+    Get admin statistics
+
+    All counts come from one statement (a sub-select per figure) and are
+    cached for ADMIN_STATS_CACHE_TTL seconds. Trends compare rows created in
+    the last ADMIN_STATS_TREND_DAYS days against the window before it.
+    """
     db = get_db()
+    cache = get_cache()
 
     try:
-        # Count users
-        users_result = db.execute_query('SELECT COUNT(*) as count FROM users')
-        total_users = users_result[0]['count'] if users_result else 0
+        stats = cache.get('admin_stats')
+        if stats is not None:
+            return jsonify({'success': True, 'stats': stats})
+
+        days = current_app.config['ADMIN_STATS_TREND_DAYS']
+        now = datetime.utcnow()
+        window_start = (now - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+        previous_start = (now - timedelta(days=days * 2)).strftime('%Y-%m-%d %H:%M:%S')
+
+        columns = [
+            "(SELECT COUNT(*) FROM users WHERE is_approved = FALSE AND deleted_at IS NULL) AS pending_users",
+            "(SELECT COUNT(*) FROM activities WHERE status IN ('open', 'registration_open')) AS active_activities",
+        ]
+        params = []
+        windows = {
+            'total': [],
+            'recent': ['created_at >= %s'],
+            'previous': ['created_at >= %s', 'created_at < %s'],
+        }
+        for name, table, where in ADMIN_STAT_TABLES:
+            for window, conditions in windows.items():
+                conditions = ([where] if where else []) + conditions
+                clause = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+                columns.append(f'(SELECT COUNT(*) FROM {table}{clause}) AS {window}_{name}')
+            params.extend([window_start, previous_start, window_start])
+
+        row = db.execute_query(f"SELECT {', '.join(columns)}", tuple(params))[0]
+
+        stats = {
+            'pending_users': row['pending_users'],
+            'active_activities': row['active_activities'],
+            'trend_days': days,
+            'trends': {},
+        }
+        for name, _, _ in ADMIN_STAT_TABLES:
+            recent = row[f'recent_{name}']
+            previous = row[f'previous_{name}']
+            stats[f'total_{name}'] = row[f'total_{name}']
+            stats['trends'][name] = {
+                'recent': recent,
+                'previous': previous,
+                'delta': recent - previous,
+                'change_pct': round((recent - previous) / previous * 100, 1) if previous else None
+            }
+
+        cache.set('admin_stats', stats, current_app.config['ADMIN_STATS_CACHE_TTL'])
+
+        return jsonify({
+            'success': True,
+            'stats': stats
+        })
+
+    except Exception as e:
+        current_app.logger.exception(f"Get admin stats error: {e}")
+        return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
+
 
-        # Count buds
-        buds_result = db.execute_query('SELECT COUNT(*) as count FROM buds_data')
-        total_buds = buds_result[0]['count'] if buds_result else 0
+@api_bp.route('/admin/analytics', methods=['GET'])
+@api_admin_required
+def get_admin_analytics():
+    """
+    Growth analytics from the rollup tables
+
+    Query params: metrics (comma-separated, default all), bucket ('day' or
+    'hour', default 'day'), count (number of buckets, default 30 days or 48
+    hours).
+    """
+    db = get_db()
 
-        # Count reviews
-        reviews_result = db.execute_query('SELECT COUNT(*) as count FROM reviews')
-        total_reviews = reviews_result[0]['count'] if reviews_result else 0
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in ANALYTICS_BUCKETS:
+        return jsonify({'error': 'bucket ต้องเป็น day หรือ hour'}), 400
 
-        # Count activities
-        activities_result = db.execute_query('SELECT COUNT(*) as count FROM activities')
-        total_activities = activities_result[0]['count'] if activities_result else 0
+    metrics = [m.strip() for m in request.args.get('metrics', '').split(',') if m.strip()] or list(ROLLUP_METRICS)
+    unknown = [m for m in metrics if m not in ROLLUP_METRICS]
+    if unknown:
+        return jsonify({'error': f'ไม่รู้จัก metric: {", ".join(unknown)}'}), 400
 
-        # Count pending users
-        pending_result = db.execute_query('SELECT COUNT(*) as count FROM users WHERE is_approved = FALSE')
-        pending_users = pending_result[0]['count'] if pending_result else 0
+    max_count = ANALYTICS_MAX_BUCKETS[bucket]
+    count = request.args.get('count', 30 if bucket == 'day' else 48, type=int)
+    count = max(1, min(count, max_count))
 
+    try:
         return jsonify({
             'success': True,
-            'stats': {
-                'total_users': total_users,
-                'total_buds': total_buds,
-                'total_reviews': total_reviews,
-                'total_activities': total_activities,
-                'pending_users': pending_users
-            }
+            **get_series(db, metrics, bucket, count)
         })
 
     except Exception as e:
-        print(f"Get admin stats error: {e}")
+        current_app.logger.exception(f"Get admin analytics error: {e}")
+        return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
+
+
+@api_bp.route('/admin/export/<dataset>', methods=['GET'])
+@api_admin_required
+def export_dataset(dataset):
+    """
+    Stream a full dump of buds, reviews or activity participants
+
+    Query params: format ('csv' or 'ndjson', default 'csv'), gzip (1 to
+    compress), activity_id (participants only, optional).
+    """
+    db = get_db()
+
+    if dataset not in EXPORT_QUERIES:
+        return jsonify({'error': 'ไม่พบชุดข้อมูล'}), 404
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'format ต้องเป็น csv หรือ ndjson'}), 400
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    where = ''
+    params = ()
+    filename = f'{dataset}_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+
+    activity_id = request.args.get('activity_id', type=int)
+    if dataset == 'participants' and activity_id:
+        where = 'WHERE ap.activity_id = %s'
+        params = (activity_id,)
+        filename = f'activity_{activity_id}_{filename}'
+
+    try:
+        query = EXPORT_QUERIES[dataset].format(where=where)
+        return export_response(db.stream_query(query, params), filename, fmt, compress)
+
+    except Exception as e:
+        current_app.logger.exception(f"Export {dataset} error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -1215,7 +1444,7 @@ def get_pending_users():
         users = db.execute_query('''
             SELECT id, username, email, created_at
             FROM users
-            WHERE is_approved = FALSE
+            WHERE is_approved = FALSE AND deleted_at IS NULL
             ORDER BY created_at DESC
         ''')
 
@@ -1227,7 +1456,7 @@ def get_pending_users():
         })
 
     except Exception as e:
-        print(f"Get pending users error: {e}")
+        current_app.logger.exception(f"Get pending users error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -1242,6 +1471,7 @@ def get_all_users():
             SELECT id, username, email, referrer_approved, is_approved, is_verified,
                    referred_by, referral_code, created_at
             FROM users
+            WHERE deleted_at IS NULL
             ORDER BY created_at DESC
         ''')
 
@@ -1253,73 +1483,75 @@ def get_all_users():
         })
 
     except Exception as e:
-        print(f"Get all users error: {e}")
+        current_app.logger.exception(f"Get all users error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
 @api_bp.route('/admin/users/<int:user_id>', methods=['DELETE'])
 @api_admin_required
 def delete_user(user_id):
-    """Delete a user (admin only)"""
+    """
+    Delete a user (admin only)
+
+    The user is soft-deleted and logged out at once; their rows are
+    removed by the purge job (poll /admin/users/<id>/purge for progress)
+    and uploads no row refers to any more by the upload GC.
+    """
     db = get_db()
     cache = get_cache()
 
     try:
         # Check if user exists
-        user = db.execute_query('SELECT id, username FROM users WHERE id = %s', (user_id,))
+        user = db.execute_query('SELECT id, username, deleted_at FROM users WHERE id = %s', (user_id,))
         if not user:
             return jsonify({'error': 'ไม่พบผู้ใช้'}), 404
 
         username = user[0]['username']
 
-        # Delete user's related data first (to maintain referential integrity)
-
-        # Delete user's reviews (use reviewer_id)
-        db.execute_update('DELETE FROM reviews WHERE reviewer_id = %s', (user_id,))
-
-        # Delete user's activity participations
-        db.execute_update('DELETE FROM activity_participants WHERE user_id = %s', (user_id,))
-
-        # Delete user's buds (check both grower_id and created_by)
-        db.execute_update('DELETE FROM buds_data WHERE grower_id = %s OR created_by = %s', (user_id, user_id))
-
-        # Delete user's friendships
-        db.execute_update('DELETE FROM friends WHERE user_id = %s OR friend_id = %s', (user_id, user_id))
-
-        # Delete user's referrals (use referrer_user_id and referred_user_id)
-        db.execute_update('DELETE FROM referrals WHERE referrer_user_id = %s OR referred_user_id = %s', (user_id, user_id))
-
-        # Update users who were referred by this user (set referred_by to NULL)
-        db.execute_update('UPDATE users SET referred_by = NULL WHERE referred_by = %s', (user_id,))
+        if not user[0]['deleted_at']:
+            request_purge(db, user_id, session.get('admin_id'))
+            revoke_user_sessions(user_id)
+            cache.clear_pattern(f'profile_{user_id}')
+            cache.clear_pattern(f'user_{user_id}')
+            cache.clear_pattern('users_')
+            cache.clear_pattern('admin_stats')
 
-        # Delete email verifications
-        db.execute_update('DELETE FROM email_verifications WHERE user_id = %s', (user_id,))
-
-        # Delete password reset tokens
-        db.execute_update('DELETE FROM password_resets WHERE user_id = %s', (user_id,))
-
-        # Delete the user
-        db.execute_update('DELETE FROM users WHERE id = %s', (user_id,))
-
-        # Clear all related cache
-        cache.clear_pattern(f'profile_{user_id}')
-        cache.clear_pattern(f'user_{user_id}')
-        cache.clear_pattern('users_')
-        cache.clear_pattern('buds_')
-        cache.clear_pattern('activities_')
+            purge_job = getattr(current_app, 'user_purge_job', None)
+            if purge_job is not None:
+                purge_job.wake.set()
 
         return jsonify({
             'success': True,
-            'message': f'ลบผู้ใช้ {username} เรียบร้อยแล้ว'
-        })
+            'message': f'ลบผู้ใช้ {username} เรียบร้อยแล้ว ข้อมูลและไฟล์จะถูกลบในเบื้องหลัง',
+            'purge': get_purge(db, user_id)
+        }), 202
 
     except Exception as e:
-        print(f"Delete user error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Delete user error: {e}")
         return jsonify({'error': f'เกิดข้อผิดพลาดในการลบผู้ใช้: {str(e)}'}), 500
 
 
+@api_bp.route('/admin/users/<int:user_id>/purge', methods=['GET'])
+@api_admin_required
+def get_user_purge(user_id):
+    """Progress of a deleted user's purge"""
+    purge = get_purge(get_db(), user_id)
+    if not purge:
+        return jsonify({'error': 'ไม่พบรายการลบผู้ใช้'}), 404
+    return jsonify({'success': True, 'purge': purge})
+
+
+@api_bp.route('/admin/users/purges', methods=['GET'])
+@api_admin_required
+def get_user_purges():
+    """Recent user purges with their progress"""
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+    except ValueError:
+        return jsonify({'error': 'พารามิเตอร์ไม่ถูกต้อง'}), 400
+    return jsonify({'success': True, 'purges': list_purges(get_db(), limit)})
+
+
 @api_bp.route('/admin/approve_user', methods=['POST'])
 @api_admin_required
 def approve_user():
@@ -1347,6 +1579,8 @@ def approve_user():
             SET is_approved = TRUE, approved_at = CURRENT_TIMESTAMP
             WHERE id = %s
         ''', (user_id,))
+        invalidate_principal(user_id)
+        get_cache().clear_pattern('admin_stats')
 
         return jsonify({
             'success': True,
@@ -1354,9 +1588,7 @@ def approve_user():
         })
 
     except Exception as e:
-        print(f"Approve user error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Approve user error: {e}")
         return jsonify({'error': f'เกิดข้อผิดพลาด: {str(e)}'}), 500
 
 
@@ -1383,7 +1615,7 @@ def get_all_buds_report():
         })
 
     except Exception as e:
-        print(f"Get all buds report error: {e}")
+        current_app.logger.exception(f"Get all buds report error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -1417,7 +1649,7 @@ def search_strains():
         return jsonify(results)
 
     except Exception as e:
-        print(f"Search strains error: {e}")
+        current_app.logger.exception(f"Search strains error: {e}")
         return jsonify([]), 200
 
 
@@ -1442,7 +1674,7 @@ def search_breeders():
         return jsonify(results)
 
     except Exception as e:
-        print(f"Search breeders error: {e}")
+        current_app.logger.exception(f"Search breeders error: {e}")
         return jsonify([]), 200
 
 
@@ -1555,9 +1787,7 @@ def search_buds():
         })
 
     except Exception as e:
-        print(f"Search buds error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Search buds error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -1590,7 +1820,7 @@ def get_admin_reviews():
         })
 
     except Exception as e:
-        print(f"Get admin reviews error: {e}")
+        current_app.logger.exception(f"Get admin reviews error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -1598,16 +1828,8 @@ def get_admin_reviews():
 @api_admin_required
 def get_auth_images():
     """Get authentication images settings"""
-    db = get_db()
-
     try:
-        # Get settings from database
-        settings = db.execute_query('''
-            SELECT key, value FROM admin_settings
-            WHERE key LIKE 'auth_image_%'
-        ''')
-
-        settings_dict = {row['key']: row['value'] for row in settings} if settings else {}
+        settings_dict = get_settings().with_prefix('auth_image_')
 
         return jsonify({
             'success': True,
@@ -1615,7 +1837,7 @@ def get_auth_images():
         })
 
     except Exception as e:
-        print(f"Get auth images error: {e}")
+        current_app.logger.exception(f"Get auth images error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -1648,13 +1870,15 @@ def update_auth_images():
                         (key, value)
                     )
 
+        get_settings().bump()
+
         return jsonify({
             'success': True,
             'message': 'บันทึกการตั้งค่าสำเร็จ'
         })
 
     except Exception as e:
-        print(f"Update auth images error: {e}")
+        current_app.logger.exception(f"Update auth images error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -1662,12 +1886,8 @@ def update_auth_images():
 @api_admin_required
 def get_admin_settings():
     """Get all admin settings"""
-    db = get_db()
-
     try:
-        # Get all settings from database
-        settings = db.execute_query('SELECT key, value FROM admin_settings')
-        settings_dict = {row['key']: row['value'] for row in settings} if settings else {}
+        settings_dict = get_settings().all()
 
         return jsonify({
             'success': True,
@@ -1675,7 +1895,7 @@ def get_admin_settings():
         })
 
     except Exception as e:
-        print(f"Get settings error: {e}")
+        current_app.logger.exception(f"Get settings error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -1683,12 +1903,8 @@ def get_admin_settings():
 @api_admin_required
 def get_general_settings():
     """Get general settings"""
-    db = get_db()
-
     try:
-        # Get all settings from database
-        settings = db.execute_query('SELECT key, value FROM admin_settings')
-        settings_dict = {row['key']: row['value'] for row in settings} if settings else {}
+        settings_dict = get_settings().all()
 
         return jsonify({
             'success': True,
@@ -1696,7 +1912,7 @@ def get_general_settings():
         })
 
     except Exception as e:
-        print(f"Get general settings error: {e}")
+        current_app.logger.exception(f"Get general settings error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -1719,6 +1935,8 @@ def update_admin_settings():
             ''', (key, str(value)))
             saved_count += 1
 
+        get_settings().bump()
+
         return jsonify({
             'success': True,
             'message': 'บันทึกการตั้งค่าสำเร็จ',
@@ -1726,9 +1944,7 @@ def update_admin_settings():
         })
 
     except Exception as e:
-        print(f"Update settings error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Update settings error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -1751,6 +1967,8 @@ def save_general_settings():
             ''', (key, str(value)))
             saved_count += 1
 
+        get_settings().bump()
+
         return jsonify({
             'success': True,
             'message': 'บันทึกการตั้งค่าสำเร็จ',
@@ -1758,9 +1976,7 @@ def save_general_settings():
         })
 
     except Exception as e:
-        print(f"Save general settings error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Save general settings error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
 
 
@@ -1787,9 +2003,7 @@ def get_admin_activities():
         return jsonify({'success': True, 'activities': activities_list})
 
     except Exception as e:
-        print(f"Get admin activities error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Get admin activities error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -1801,7 +2015,7 @@ def create_activity():
 
     try:
         data = request.get_json()
-        print(f"[DEBUG] Received data: {data}")
+        current_app.logger.debug(f"Create activity data: {data}")
 
         # Insert activity
         activity_id = db.execute_insert('''
@@ -1860,9 +2074,7 @@ def create_activity():
         })
 
     except Exception as e:
-        print(f"Create activity error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Create activity error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -1925,6 +2137,10 @@ def update_activity(activity_id):
             data.get('preferred_effects'),
             activity_id
         ))
+        invalidate_leaderboard(get_cache(), activity_id)
+        activity_rows = db.execute_query('SELECT * FROM activities WHERE id = %s', (activity_id,))
+        if activity_rows:
+            sync_snapshot(db, dict(activity_rows[0]))
 
         return jsonify({
             'success': True,
@@ -1932,9 +2148,7 @@ def update_activity(activity_id):
         })
 
     except Exception as e:
-        print(f"Update activity error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Update activity error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -1947,6 +2161,9 @@ def delete_activity(activity_id):
     try:
         # Delete activity
         db.execute_update('DELETE FROM activities WHERE id = %s', (activity_id,))
+        reset_slots(db, [activity_id])
+        drop_snapshot(db, activity_id)
+        invalidate_leaderboard(get_cache(), activity_id)
 
         return jsonify({
             'success': True,
@@ -1954,9 +2171,7 @@ def delete_activity(activity_id):
         })
 
     except Exception as e:
-        print(f"Delete activity error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Delete activity error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -1976,53 +2191,18 @@ def get_activity_participants(activity_id):
             return jsonify({'error': 'ไม่พบกิจกรรม'}), 404
 
         activity_data = dict(activity_rows[0])
-
-        # Initialize empty participants list
-        participants_list = []
-
-        # Try to get participants - handle gracefully if table doesn't exist
-        try:
-            participants_rows = db.execute_query('''
-                SELECT
-                    ap.id,
-                    ap.user_id,
-                    ap.bud_id,
-                    ap.registered_at as joined_at,
-                    u.username,
-                    u.username as display_name,
-                    u.profile_image_url,
-                    b.id as bud_id,
-                    b.strain_name_th,
-                    b.strain_name_en,
-                    b.breeder,
-                    b.thc_percentage,
-                    b.cbd_percentage,
-                    b.image_1_url,
-                    b.strain_type,
-                    b.grade
-                FROM activity_participants ap
-                LEFT JOIN users u ON ap.user_id = u.id
-                LEFT JOIN buds_data b ON ap.bud_id = b.id
-                WHERE ap.activity_id = %s
-                ORDER BY ap.registered_at DESC
-            ''', (activity_id,))
-
-            participants_list = [dict(row) for row in participants_rows] if participants_rows else []
-        except Exception as table_error:
-            print(f"Warning: Could not fetch participants (table may not exist): {table_error}")
-            # Continue with empty list
+        participants_list, judged = participants_with_standings(activity_data)
 
         return jsonify({
             'success': True,
             'activity': activity_data,
             'participants': participants_list,
+            'judged': judged,
             'total': len(participants_list)
         })
 
     except Exception as e:
-        print(f"Get activity participants error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Get activity participants error: {e}")
         return jsonify({'error': f'เกิดข้อผิดพลาดในการโหลดข้อมูล: {str(e)}'}), 500
 
 
@@ -2065,12 +2245,37 @@ def get_my_activities():
         })
 
     except Exception as e:
-        print(f"Get my activities error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Get my activities error: {e}")
         return jsonify({'error': str(e), 'activities': []}), 500
 
 
+@api_bp.route('/activities/<int:activity_id>/eligible_buds', methods=['GET'])
+@api_login_required
+def get_eligible_buds(activity_id):
+    """The current user's buds split into eligible and ineligible for an activity"""
+    db = get_db()
+    user_id = session.get('user_id')
+
+    try:
+        activity_rows = db.execute_query('SELECT * FROM activities WHERE id = %s', (activity_id,))
+        if not activity_rows:
+            return jsonify({'error': 'ไม่พบกิจกรรมนี้'}), 404
+
+        activity = dict(activity_rows[0])
+        buds = load_user_buds(db, user_id, compile_criteria(activity))
+        eligible, ineligible = check_buds(activity, buds)
+
+        return jsonify({
+            'success': True,
+            'eligible_buds': eligible,
+            'ineligible_buds': ineligible
+        })
+
+    except Exception as e:
+        current_app.logger.exception(f"Get eligible buds error: {e}")
+        return jsonify({'error': 'เกิดข้อผิดพลาด'}), 500
+
+
 @api_bp.route('/activities/<int:activity_id>/join', methods=['POST'])
 @api_login_required
 def join_activity(activity_id):
@@ -2100,15 +2305,9 @@ def join_activity(activity_id):
         if activity['status'] not in ['open', 'registration_open']:
             return jsonify({'error': 'กิจกรรมนี้ไม่เปิดรับสมัครแล้ว'}), 400
 
-        # Check if max participants reached
-        if activity['max_participants'] > 0:
-            participant_count = db.execute_query('''
-                SELECT COUNT(*) as count FROM activity_participants
-                WHERE activity_id = %s
-            ''', (activity_id,))
-
-            if participant_count and participant_count[0]['count'] >= activity['max_participants']:
-                return jsonify({'error': 'กิจกรรมเต็มแล้ว'}), 400
+        # Turn requests away early once full (register_participant re-checks atomically)
+        if activity_is_full(db, activity):
+            return jsonify({'error': 'กิจกรรมเต็มแล้ว'}), 400
 
         # Check if user already joined
         existing = db.execute_query('''
@@ -2119,28 +2318,27 @@ def join_activity(activity_id):
         if existing:
             return jsonify({'error': 'คุณได้เข้าร่วมกิจกรรมนี้แล้ว'}), 400
 
-        # Check if bud belongs to user (try grower_id first, fallback to user_id)
-        try:
-            bud_rows = db.execute_query('''
-                SELECT * FROM buds_data WHERE id = %s AND grower_id = %s
-            ''', (bud_id, user_id))
-        except:
-            # Fallback to user_id if grower_id doesn't exist
-            bud_rows = db.execute_query('''
-                SELECT * FROM buds_data WHERE id = %s AND user_id = %s
-            ''', (bud_id, user_id))
-
-        if not bud_rows:
+        # Check the bud belongs to the user and meets the activity's criteria
+        buds = load_user_buds(db, user_id, compile_criteria(activity), bud_id=bud_id)
+        if not buds:
             return jsonify({'error': 'ไม่พบดอกที่เลือก หรือดอกนี้ไม่ใช่ของคุณ'}), 404
 
-        # Insert participation record
-        # registered_at has DEFAULT CURRENT_TIMESTAMP
-        from datetime import datetime
-        db.execute_update('''
-            INSERT INTO activity_participants
-            (activity_id, user_id, bud_id, submission_description)
-            VALUES (%s, %s, %s, %s)
-        ''', (activity_id, user_id, bud_id, submission_description))
+        _, ineligible = check_buds(activity, buds)
+        if ineligible:
+            reasons = ineligible[0]['reasons']
+            return jsonify({
+                'error': 'ดอกนี้ไม่ผ่านเกณฑ์ของกิจกรรม: ' + ', '.join(r['message'] for r in reasons),
+                'reasons': reasons
+            }), 400
+
+        # Claim a slot and insert the participation record in one transaction
+        try:
+            register_participant(db, activity, user_id, bud_id, submission_description)
+        except ActivityFull:
+            return jsonify({'error': 'กิจกรรมเต็มแล้ว'}), 400
+        except AlreadyJoined:
+            return jsonify({'error': 'คุณได้เข้าร่วมกิจกรรมนี้แล้ว'}), 400
+        invalidate_leaderboard(get_cache(), activity_id)
 
         return jsonify({
             'success': True,
@@ -2148,16 +2346,14 @@ def join_activity(activity_id):
         })
 
     except Exception as e:
-        print(f"Join activity error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Join activity error: {e}")
         return jsonify({'error': f'เกิดข้อผิดพลาดในการเข้าร่วม: {str(e)}'}), 500
 
 
 @api_bp.route('/admin/activities/<int:activity_id>/report', methods=['GET'])
 @api_admin_required
 def get_activity_report(activity_id):
-    """Get detailed activity report with participants and submitted buds"""
+    """Get detailed activity report with participants, submitted buds and standings"""
     db = get_db()
 
     try:
@@ -2172,50 +2368,7 @@ def get_activity_report(activity_id):
         # Convert to dict
         activity_data = dict(activity_rows[0])
 
-        # Initialize empty participants list
-        participants_list = []
-
-        # Try to get participants - handle gracefully if table doesn't exist
-        try:
-            participants_rows = db.execute_query('''
-                SELECT
-                    ap.id,
-                    ap.activity_id,
-                    ap.user_id,
-                    ap.bud_reference_id,
-                    ap.joined_at,
-                    ap.status,
-                    u.username,
-                    u.display_name,
-                    u.profile_image_url,
-                    b.id as bud_id,
-                    b.strain_name_th,
-                    b.strain_name_en,
-                    b.breeder,
-                    b.thc_percentage,
-                    b.cbd_percentage,
-                    b.image_url_1,
-                    b.image_url_2,
-                    b.image_url_3,
-                    b.image_url_4,
-                    b.strain_type,
-                    b.grow_method,
-                    b.grade,
-                    b.overall_rating
-                FROM activity_participants ap
-                LEFT JOIN users u ON ap.user_id = u.id
-                LEFT JOIN buds_data b ON ap.bud_reference_id = b.id
-                WHERE ap.activity_id = %s
-                ORDER BY ap.joined_at DESC
-            ''', (activity_id,))
-
-            # Convert rows to dicts
-            if participants_rows:
-                for row in participants_rows:
-                    participants_list.append(dict(row))
-        except Exception as table_error:
-            print(f"Warning: Could not fetch participants: {table_error}")
-            # Continue with empty list
+        participants_list, judged = participants_with_standings(activity_data)
 
         # Calculate statistics
         total_participants = len(participants_list)
@@ -2225,8 +2378,8 @@ def get_activity_report(activity_id):
         buds_with_thc = [p for p in participants_list if p.get('thc_percentage') is not None]
         buds_with_cbd = [p for p in participants_list if p.get('cbd_percentage') is not None]
 
-        avg_thc = sum(p['thc_percentage'] for p in buds_with_thc) / len(buds_with_thc) if buds_with_thc else 0
-        avg_cbd = sum(p['cbd_percentage'] for p in buds_with_cbd) / len(buds_with_cbd) if buds_with_cbd else 0
+        avg_thc = sum(float(p['thc_percentage']) for p in buds_with_thc) / len(buds_with_thc) if buds_with_thc else 0
+        avg_cbd = sum(float(p['cbd_percentage']) for p in buds_with_cbd) / len(buds_with_cbd) if buds_with_cbd else 0
 
         # Strain type distribution
         strain_types = {}
@@ -2238,6 +2391,7 @@ def get_activity_report(activity_id):
             'success': True,
             'activity': activity_data,
             'participants': participants_list,
+            'judged': judged,
             'statistics': {
                 'total_participants': total_participants,
                 'total_buds_submitted': total_buds_submitted,
@@ -2248,9 +2402,33 @@ def get_activity_report(activity_id):
         })
 
     except Exception as e:
-        print(f"Get activity report error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Get activity report error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@api_bp.route('/admin/activities/<int:activity_id>/judge', methods=['POST'])
+@api_admin_required
+def judge_activity_submissions(activity_id):
+    """Score every submission and store ranks and prizes"""
+    db = get_db()
+
+    try:
+        activity_rows = db.execute_query('SELECT * FROM activities WHERE id = %s', (activity_id,))
+        if not activity_rows:
+            return jsonify({'error': 'ไม่พบกิจกรรม'}), 404
+
+        leaderboard = judge_activity(db, dict(activity_rows[0]))
+        invalidate_leaderboard(get_cache(), activity_id)
+        refresh_snapshots(db, [activity_id])
+
+        return jsonify({
+            'success': True,
+            'message': 'ตัดสินผลกิจกรรมสำเร็จ',
+            'leaderboard': leaderboard['entries']
+        })
+
+    except Exception as e:
+        current_app.logger.exception(f"Judge activity error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -2259,7 +2437,7 @@ def get_activity_report(activity_id):
 @api_bp.route('/uploads/<path:filename>')
 def uploaded_file(filename):
     """Serve uploaded files"""
-    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
+    return serve_upload(current_app.config['UPLOAD_FOLDER'], filename)
 
 
 @api_bp.route('/assets/<path:filename>')
@@ -2290,16 +2468,11 @@ def upload_images():
             if file and file.filename:
                 # Check file extension inline
                 if '.' in file.filename and file.filename.rsplit('.', 1)[1].lower() in allowed_extensions:
-                    filename = generate_unique_filename(file.filename)
-                    filepath = os.path.join(upload_folder, filename)
-                    file.save(filepath)
-
-                    # Return URL path relative to uploads folder
-                    url = f'/uploads/{filename}'
+                    url = save_upload(file, upload_folder)
                     uploaded_urls.append(url)
-                    print(f"Uploaded image: {url}")
+                    current_app.logger.debug(f"Uploaded image: {url}")
                 else:
-                    print(f"File {file.filename} not allowed - invalid extension")
+                    current_app.logger.debug(f"File {file.filename} not allowed - invalid extension")
 
         if not uploaded_urls:
             return jsonify({'error': 'ไม่มีไฟล์ที่ถูกต้อง'}), 400
@@ -2311,9 +2484,7 @@ def upload_images():
         })
 
     except Exception as e:
-        print(f"Upload images error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Upload images error: {e}")
         return jsonify({'error': f'เกิดข้อผิดพลาดในการอัพโหลด: {str(e)}'}), 500
 
 
@@ -2354,13 +2525,30 @@ def submit_referral_code():
         if referrer_id == user_id:
             return jsonify({'error': 'คุณไม่สามารถใช้ Referral Code ของตัวเองได้'}), 400
 
-        # Update user's referred_by
-        db.execute_update(
-            'UPDATE users SET referred_by = %s WHERE id = %s',
-            (referrer_id, user_id)
-        )
+        # Set referred_by and add to the referral tree in one transaction under
+        # the tree lock, so concurrent submits can't give two parents or a loop
+        try:
+            with db.transaction() as tx:
+                lock_tree(tx)
+                claimed = tx.execute_update(
+                    'UPDATE users SET referred_by = %s WHERE id = %s AND referred_by IS NULL',
+                    (referrer_id, user_id)
+                )
+                if claimed:
+                    # Refused if the referrer is in your own downline (rolls back referred_by)
+                    link_referral(tx, user_id, referrer_id)
+        except ReferralCycle:
+            return jsonify({'error': 'ไม่สามารถใช้ Referral Code ของผู้ที่คุณแนะนำได้'}), 400
+
+        if not claimed:
+            return jsonify({'error': 'คุณมีผู้แนะนำอยู่แล้ว'}), 400
+
+        attribute_request_signup(db, user_id, referrer_id, referral_code)
+
+        invalidate_principal(user_id)
+        invalidate_referral_cache(get_cache())
 
-        print(f"✅ User {user_id} added referrer {referrer_id}")
+        current_app.logger.info(f"User {user_id} added referrer {referrer_id}")
 
         return jsonify({
             'success': True,
@@ -2368,7 +2556,5 @@ def submit_referral_code():
         })
 
     except Exception as e:
-        print(f"Submit referral code error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Submit referral code error: {e}")
         return jsonify({'error': f'เกิดข้อผิดพลาด: {str(e)}'}), 500
@@ -1,9 +1,12 @@
-from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, current_app, make_response
 from datetime import datetime
 from app.utils import (
     hash_password, verify_password, validate_password_strength,
-    generate_token, generate_referral_code, validate_email, validate_username
+    generate_token, generate_referral_code, validate_email, validate_username,
+    rehash_password, PasswordPoolError, login_throttled
 )
+from app.utils.referral_tree import link_referral, invalidate_referral_cache
+from app.utils.referral_clicks import UTM_FIELDS, track_click, attribute_request_signup
 from config import config
 import os
 
@@ -16,36 +19,38 @@ def get_db():
     return current_app.db
 
 
+def get_settings():
+    """Get admin settings snapshot"""
+    from flask import current_app
+    return current_app.settings
+
+
 @auth_bp.route('/auth')
 def login_page():
     """Login/signup page"""
     if 'user_id' in session:
         return redirect(url_for('main.profile'))
 
-    db = get_db()
+    settings = get_settings()
 
     # Get logo from settings
-    site_logo = '/attached_assets/budtboy_logo_20250907_064050.jpg'  # Default
-    signup_method = 'both'  # Default: both email and Google
+    site_logo = settings.get('siteLogo', '/attached_assets/budtboy_logo_20250907_064050.jpg')
+    signup_method = settings.get('signupMethod', 'both')  # Default: both email and Google
+
+    response = make_response(render_template('auth.html', site_logo=site_logo, signup_method=signup_method))
+    return track_click(response, request.args.get('ref'))
 
-    try:
-        settings = db.execute_query(
-            "SELECT key, value FROM admin_settings WHERE key IN (%s, %s)",
-            ('siteLogo', 'signupMethod')
-        )
-        if settings:
-            for setting in settings:
-                if setting['key'] == 'siteLogo':
-                    site_logo = setting['value']
-                elif setting['key'] == 'signupMethod':
-                    signup_method = setting['value']
-    except Exception as e:
-        print(f"Error loading settings: {e}")
 
-    return render_template('auth.html', site_logo=site_logo, signup_method=signup_method)
+@auth_bp.route('/r/<referral_code>')
+def referral_landing(referral_code):
+    """Short referral link: count the click and continue to the signup page"""
+    params = {field: request.args[field] for field in UTM_FIELDS if request.args.get(field)}
+    response = redirect(url_for('auth.login_page', ref=referral_code, **params))
+    return track_click(response, referral_code)
 
 
 @auth_bp.route('/login', methods=['POST'])
+@login_throttled('login', 'email')
 def login():
     """Handle user login"""
     data = request.get_json()
@@ -60,7 +65,7 @@ def login():
     try:
         # Get user by email
         users = db.execute_query(
-            'SELECT * FROM users WHERE email = ?',
+            'SELECT * FROM users WHERE email = ? AND deleted_at IS NULL',
             (email,)
         )
 
@@ -72,6 +77,7 @@ def login():
         # Verify password
         if not user['password_hash'] or not verify_password(password, user['password_hash']):
             return jsonify({'error': 'อีเมลหรือรหัสผ่านไม่ถูกต้อง'}), 401
+        rehash_password('users', user['id'], password, user['password_hash'])
 
         # Check if user is approved
         if not user.get('is_approved', False):
@@ -93,8 +99,11 @@ def login():
             }
         })
 
+    except PasswordPoolError as e:
+        current_app.logger.warning(f"Login rejected: {e}")
+        return jsonify({'error': 'ระบบกำลังทำงานหนัก กรุณาลองใหม่อีกครั้ง'}), 503
     except Exception as e:
-        print(f"Login error: {e}")
+        current_app.logger.exception(f"Login error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาดในการเข้าสู่ระบบ'}), 500
 
 
@@ -165,10 +174,14 @@ def signup():
             )
             if referrer:
                 referrer_id = referrer[0]['id']
-                db.execute_update(
-                    'UPDATE users SET referred_by = ? WHERE id = ?',
-                    (referrer_id, user_id)
-                )
+                with db.transaction() as tx:
+                    tx.execute_update(
+                        'UPDATE users SET referred_by = ? WHERE id = ?',
+                        (referrer_id, user_id)
+                    )
+                    link_referral(tx, user_id, referrer_id)
+                invalidate_referral_cache(current_app.cache)
+                attribute_request_signup(db, user_id, referrer_id, referral_code)
 
         # Set session
         session.permanent = True
@@ -186,8 +199,11 @@ def signup():
             }
         })
 
+    except PasswordPoolError as e:
+        current_app.logger.warning(f"Signup rejected: {e}")
+        return jsonify({'error': 'ระบบกำลังทำงานหนัก กรุณาลองใหม่อีกครั้ง'}), 503
     except Exception as e:
-        print(f"Signup error: {e}")
+        current_app.logger.exception(f"Signup error: {e}")
         return jsonify({'error': 'เกิดข้อผิดพลาดในการลงทะเบียน'}), 500
 
 
@@ -235,19 +251,11 @@ def google_signin():
     referral_code = request.args.get('ref')
 
     # Check if Google OAuth is enabled
-    db = get_db()
-    try:
-        signup_method_result = db.execute_query(
-            "SELECT value FROM admin_settings WHERE key = %s",
-            ('signupMethod',)
-        )
-        signup_method = signup_method_result[0]['value'] if signup_method_result else 'both'
+    signup_method = get_settings().get('signupMethod', 'both')
 
-        # If email_only mode, don't allow Google OAuth
-        if signup_method == 'email_only':
-            return jsonify({'error': 'Google OAuth ถูกปิดใช้งาน'}), 403
-    except Exception as e:
-        print(f"Error checking signup method: {e}")
+    # If email_only mode, don't allow Google OAuth
+    if signup_method == 'email_only':
+        return jsonify({'error': 'Google OAuth ถูกปิดใช้งาน'}), 403
 
     # Get Google OAuth credentials from config
     client_id = os.environ.get('GOOGLE_CLIENT_ID')
@@ -282,14 +290,10 @@ def google_signin():
     if referral_code:
         session['oauth_referral_code'] = referral_code
 
-    print("="*50)
-    print("🟢 Google OAuth Sign-in Initiated")
-    print(f"Redirect URI: {flow.redirect_uri}")
-    print(f"Authorization URL: {authorization_url}")
-    print(f"State: {state}")
-    print(f"Referral Code: {referral_code}")
-    print(f"Session keys: {list(session.keys())}")
-    print("="*50)
+    current_app.logger.debug(
+        f"Google OAuth sign-in initiated: redirect_uri={flow.redirect_uri} "
+        f"state={state} referral_code={referral_code}"
+    )
 
     return redirect(authorization_url)
 
@@ -301,21 +305,16 @@ def google_callback():
     from google.auth.transport import requests as google_requests
     import google.auth.transport.requests
 
-    print("="*50)
-    print("🔵 Google OAuth Callback Received")
-    print(f"Request URL: {request.url}")
-    print(f"Session keys: {list(session.keys())}")
-    print("="*50)
+    current_app.logger.debug(f"Google OAuth callback received: {request.url}")
 
     # Allow OAuth over HTTP for development
     os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
     # Verify state for CSRF protection
     state = session.get('oauth_state')
-    print(f"🔍 State from session: {state}")
 
     if not state:
-        print("❌ No state found in session - redirecting to login")
+        current_app.logger.warning("No OAuth state found in session - redirecting to login")
         return redirect(url_for('auth.login_page'))
 
     # Get Google OAuth credentials from config
@@ -374,6 +373,11 @@ def google_callback():
             (email,)
         )
 
+        if existing_user and existing_user[0]['deleted_at']:
+            # Deleted by an admin and waiting to be purged
+            current_app.logger.info(f"Google login refused for deleted user {existing_user[0]['id']}")
+            return redirect(url_for('auth.login_page'))
+
         if existing_user:
             # User exists, log them in
             user = dict(existing_user[0])
@@ -411,11 +415,7 @@ def google_callback():
                 counter += 1
 
             # Check if referral is required for new signups
-            signup_method_result = db.execute_query(
-                "SELECT value FROM admin_settings WHERE key = %s",
-                ('signupMethod',)
-            )
-            signup_method = signup_method_result[0]['value'] if signup_method_result else 'both'
+            signup_method = get_settings().get('signupMethod', 'both')
 
             # Get referral code from session
             referral_code = session.get('oauth_referral_code')
@@ -429,7 +429,7 @@ def google_callback():
                 )
                 if referrer:
                     referrer_id = referrer[0]['id']
-                    print(f"✅ Valid referrer found: {referrer_id}")
+                    current_app.logger.debug(f"Valid referrer found: {referrer_id}")
 
             # Insert new user - No password hash for Google OAuth users
             user_id = db.execute_insert('''
@@ -444,6 +444,12 @@ def google_callback():
                 (ref_code, user_id)
             )
 
+            if referrer_id:
+                with db.transaction() as tx:
+                    link_referral(tx, user_id, referrer_id)
+                invalidate_referral_cache(current_app.cache)
+                attribute_request_signup(db, user_id, referrer_id, referral_code)
+
             # Clear referral code from session
             if 'oauth_referral_code' in session:
                 del session['oauth_referral_code']
@@ -457,7 +463,5 @@ def google_callback():
             return redirect(url_for('main.profile'))
 
     except Exception as e:
-        print(f"Google OAuth callback error: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception(f"Google OAuth callback error: {e}")
         return redirect(url_for('auth.login_page'))
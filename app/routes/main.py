@@ -1,5 +1,6 @@
 from flask import Blueprint, render_template, session, redirect, url_for, send_from_directory, current_app
 from app.utils import login_required
+from app.utils.uploads import serve_upload
 import os
 
 main_bp = Blueprint('main', __name__)
@@ -163,6 +164,22 @@ def health_check():
     return {'status': 'ok'}, 200
 
 
+@main_bp.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics aggregated across all workers"""
+    from flask import request, Response
+    from app.utils.metrics import metrics
+
+    token = current_app.config.get('METRICS_TOKEN')
+    authorized = 'admin_logged_in' in session or (
+        token and request.headers.get('Authorization') == f'Bearer {token}'
+    )
+    if not authorized:
+        return {'error': 'Forbidden'}, 403
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @main_bp.route('/uploads/<path:filename>')
 def uploaded_file(filename):
     """Serve uploaded files"""
@@ -171,8 +188,8 @@ def uploaded_file(filename):
     if not os.path.isabs(upload_folder):
         upload_folder = os.path.join(current_app.root_path, '..', upload_folder)
         upload_folder = os.path.abspath(upload_folder)
-    print(f"Serving file: {filename} from {upload_folder}")
-    return send_from_directory(upload_folder, filename)
+    current_app.logger.debug(f"Serving file: {filename} from {upload_folder}")
+    return serve_upload(upload_folder, filename)
 
 
 @main_bp.route('/assets/<path:filename>')
@@ -1,6 +1,8 @@
 from .auth import (
     hash_password,
     verify_password,
+    password_needs_rehash,
+    rehash_password,
     validate_password_strength,
     generate_token,
     generate_referral_code,
@@ -9,7 +11,11 @@ from .auth import (
     admin_required,
     api_admin_required
 )
+from .password_pool import PasswordPoolError
+from .rate_limit import login_throttled
+from .session_store import current_principal, invalidate_principal, revoke_user_sessions
 from .cache import CacheManager
+from .settings import SettingsSnapshot
 from .validators import (
     validate_email,
     validate_username,
@@ -21,6 +27,5 @@ from .validators import (
 from .helpers import (
     safe_datetime_format,
     dict_from_row,
-    dicts_from_rows,
-    generate_unique_filename
+    dicts_from_rows
 )
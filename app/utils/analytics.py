@@ -0,0 +1,164 @@
+import time
+import logging
+from datetime import datetime, timedelta
+
+from app.utils.lifecycle import LeasedJob, start_job
+
+logger = logging.getLogger(__name__)
+
+# Rolled-up metrics: name -> (table, timestamp column)
+ROLLUP_METRICS = {
+    'signups': ('users', 'created_at'),
+    'approvals': ('users', 'approved_at'),
+    'reviews': ('reviews', 'created_at'),
+    'buds': ('buds_data', 'created_at'),
+    'activity_joins': ('activity_participants', 'registered_at'),
+    'referral_conversions': ('users', 'referrer_approved_at'),
+}
+
+LEASE_NAME = 'analytics_rollup'
+
+BUCKETS = ('hour', 'day')
+BUCKET_FORMAT = '%Y-%m-%d %H:00:00'
+
+
+def _hour_start(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _hour_expression(db, column):
+    """SQL for the start of the hour a timestamp falls in, as 'YYYY-MM-DD HH:00:00'"""
+    if db.db_type == 'postgresql':
+        return f"to_char(date_trunc('hour', {column}), 'YYYY-MM-DD HH24:00:00')"
+    return f"strftime('%Y-%m-%d %H:00:00', {column})"
+
+
+def refresh_metric(db, metric, now=None):
+    """
+    Bring one metric's rollups up to date
+
+    Only rows at or after the metric's watermark (the start of the last
+    hour processed, which may have been incomplete) are counted, so each run
+    touches the last hour or so of rows through the timestamp index. Day
+    buckets are re-summed from the hour buckets of the affected days.
+    Returns the number of hour buckets written.
+    """
+    table, column = ROLLUP_METRICS[metric]
+    now = _hour_start(now or datetime.utcnow())
+
+    state = db.execute_query('SELECT watermark FROM analytics_state WHERE metric = %s', (metric,))
+    if state:
+        start = state[0]['watermark']
+    else:
+        # First run: backfill from the oldest row
+        oldest = db.execute_query(f'SELECT MIN({column}) AS oldest FROM {table}')
+        oldest = oldest[0]['oldest'] if oldest else None
+        if isinstance(oldest, datetime):
+            oldest = oldest.strftime(BUCKET_FORMAT)
+        start = oldest[:13] + ':00:00' if oldest else now.strftime(BUCKET_FORMAT)
+
+    hour = _hour_expression(db, column)
+    rows = db.execute_query(f'''
+        SELECT {hour} AS bucket_start, COUNT(*) AS value
+        FROM {table}
+        WHERE {column} >= %s
+        GROUP BY {hour}
+    ''', (start,))
+
+    if rows:
+        db.execute_many('''
+            INSERT INTO analytics_rollups (metric, bucket, bucket_start, value)
+            VALUES (%s, 'hour', %s, %s)
+            ON CONFLICT (metric, bucket, bucket_start) DO UPDATE SET value = excluded.value
+        ''', [(metric, row['bucket_start'], row['value']) for row in rows])
+
+    db.execute_update('''
+        INSERT INTO analytics_rollups (metric, bucket, bucket_start, value)
+        SELECT metric, 'day', substr(bucket_start, 1, 10) || ' 00:00:00', SUM(value)
+        FROM analytics_rollups
+        WHERE metric = %s AND bucket = 'hour' AND bucket_start >= %s
+        GROUP BY metric, substr(bucket_start, 1, 10)
+        ON CONFLICT (metric, bucket, bucket_start) DO UPDATE SET value = excluded.value
+    ''', (metric, start[:10] + ' 00:00:00'))
+
+    db.execute_update('''
+        INSERT INTO analytics_state (metric, watermark, updated_at)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (metric) DO UPDATE SET watermark = excluded.watermark, updated_at = excluded.updated_at
+    ''', (metric, now.strftime(BUCKET_FORMAT), time.time()))
+
+    return len(rows)
+
+
+def refresh_rollups(db, now=None):
+    """Refresh every metric; one failing metric doesn't stop the others"""
+    written = {}
+    for metric in ROLLUP_METRICS:
+        try:
+            written[metric] = refresh_metric(db, metric, now)
+        except Exception as e:
+            logger.exception(f"Analytics rollup error ({metric}): {e}")
+    return written
+
+
+def get_series(db, metrics, bucket, count, now=None):
+    """
+    Chart-ready series for the last count buckets (including the current one)
+
+    Reads at most len(metrics) * count rollup rows by primary key, however
+    large the source tables are. Missing buckets are zero-filled.
+    """
+    now = _hour_start(now or datetime.utcnow())
+    if bucket == 'day':
+        now = now.replace(hour=0)
+        step = timedelta(days=1)
+    else:
+        step = timedelta(hours=1)
+
+    labels = [(now - step * n).strftime(BUCKET_FORMAT) for n in range(count - 1, -1, -1)]
+    placeholders = ', '.join(['%s'] * len(metrics))
+    rows = db.execute_query(f'''
+        SELECT metric, bucket_start, value
+        FROM analytics_rollups
+        WHERE metric IN ({placeholders}) AND bucket = %s AND bucket_start >= %s
+    ''', (*metrics, bucket, labels[0]))
+
+    values = {(row['metric'], row['bucket_start']): row['value'] for row in rows}
+    state = db.execute_query('SELECT MIN(updated_at) AS updated_at FROM analytics_state')
+
+    return {
+        'bucket': bucket,
+        'labels': labels,
+        'series': {metric: [values.get((metric, label), 0) for label in labels] for metric in metrics},
+        'updated_at': float(state[0]['updated_at']) if state and state[0]['updated_at'] else None,
+    }
+
+
+class RollupJob(LeasedJob):
+    """Refreshes the rollups every interval seconds on the lease holder"""
+
+    lease_name = LEASE_NAME
+    thread_name = 'analytics-rollup'
+
+    def run(self):
+        """Refresh the rollups; returns the buckets written per metric"""
+        start = time.perf_counter()
+        written = refresh_rollups(self.db)
+        logger.info(
+            f"Analytics rollups refreshed in {time.perf_counter() - start:.2f}s",
+            extra={'fields': {'buckets_written': sum(written.values())}}
+        )
+        return written
+
+
+def init_analytics(app, db):
+    """
+    Start the rollup job
+
+    Only the holder of the 'analytics_rollup' lease scans the source
+    tables; the other workers read the rollups it writes.
+    """
+    return start_job(
+        app, 'ANALYTICS_ROLLUP_INTERVAL', 'analytics_job',
+        lambda interval: RollupJob(db, interval)
+    )
@@ -1,20 +1,64 @@
-import bcrypt
 import secrets
 import re
 from functools import wraps
 from flask import session, redirect, url_for, jsonify
+from .metrics import metrics
+from .password_pool import password_hasher, PasswordPoolError
+
+
+def _record_bcrypt(operation, cpu_seconds):
+    metrics.inc('budtboy_bcrypt_operations_total', operation=operation)
+    metrics.inc('budtboy_bcrypt_seconds_total', cpu_seconds, operation=operation)
+
+
+password_hasher.observers.append(_record_bcrypt)
 
 
 def hash_password(password):
-    """Hash a password using bcrypt"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=12))
+    """
+    Hash a password using bcrypt (in the password pool)
+    Raises PasswordPoolError when the pool is saturated or too slow
+    """
+    try:
+        return password_hasher.hash(password)
+    except PasswordPoolError as e:
+        metrics.inc('budtboy_bcrypt_rejected_total', operation='hash', reason=type(e).__name__)
+        raise
 
 
 def verify_password(password, hashed):
-    """Verify a password against a hash"""
-    if isinstance(hashed, str):
-        hashed = hashed.encode('utf-8')
-    return bcrypt.checkpw(password.encode('utf-8'), hashed)
+    """
+    Verify a password against a hash (in the password pool)
+    Raises PasswordPoolError when the pool is saturated or too slow
+    """
+    try:
+        return password_hasher.verify(password, hashed)
+    except PasswordPoolError as e:
+        metrics.inc('budtboy_bcrypt_rejected_total', operation='verify', reason=type(e).__name__)
+        raise
+
+
+def password_needs_rehash(hashed):
+    """True if a hash was made with a different cost factor than the current one"""
+    return password_hasher.needs_rehash(hashed)
+
+
+def rehash_password(table, row_id, password, hashed):
+    """
+    Re-hash a just-verified password if its cost factor is outdated
+    (table is 'users' or 'admin_accounts'); failures never block the login
+    """
+    if not password_needs_rehash(hashed):
+        return
+    from flask import current_app
+    try:
+        new_hash = hash_password(password).decode('utf-8')
+        current_app.db.execute_update(
+            f'UPDATE {table} SET password_hash = %s WHERE id = %s',
+            (new_hash, row_id)
+        )
+    except Exception as e:
+        current_app.logger.warning(f"Password rehash error: {e}")
 
 
 def validate_password_strength(password):
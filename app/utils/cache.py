@@ -8,9 +8,20 @@ class CacheManager:
     def __init__(self):
         self.cache = {}
         self.cache_lock = threading.Lock()
+        # Callbacks receiving (hit, elapsed_seconds) for each lookup
+        self.observers = []
 
     def get(self, key, ttl=900):
         """Get cached data if not expired"""
+        start = time.perf_counter()
+        data = self._get(key)
+        if self.observers:
+            elapsed = time.perf_counter() - start
+            for observer in self.observers:
+                observer(data is not None, elapsed)
+        return data
+
+    def _get(self, key):
         with self.cache_lock:
             if key in self.cache:
                 data, timestamp, cache_ttl = self.cache[key]
@@ -0,0 +1,181 @@
+import json
+from functools import lru_cache
+
+# Activity columns that restrict which buds may enter
+CRITERIA_COLUMNS = (
+    'allowed_strain_types', 'allowed_grow_methods', 'allowed_grades',
+    'allowed_fertilizer_types', 'allowed_recommended_times', 'allowed_flowering_types',
+    'allowed_status', 'min_thc', 'max_thc', 'min_cbd', 'max_cbd',
+    'require_certificate', 'require_min_images', 'min_image_count',
+    'require_min_reviews', 'min_review_count',
+)
+
+# allowed_* column -> (bud column, message when the bud's value isn't allowed)
+ALLOWED_VALUE_RULES = {
+    'allowed_strain_types': ('strain_type', 'ประเภทดอกไม่ตรงกับที่กิจกรรมกำหนด'),
+    'allowed_grow_methods': ('grow_method', 'วิธีการปลูกไม่ตรงกับที่กิจกรรมกำหนด'),
+    'allowed_grades': ('grade', 'เกรดไม่ตรงกับที่กิจกรรมกำหนด'),
+    'allowed_fertilizer_types': ('fertilizer_type', 'ประเภทปุ๋ยไม่ตรงกับที่กิจกรรมกำหนด'),
+    'allowed_recommended_times': ('recommended_time', 'ช่วงเวลาที่แนะนำไม่ตรงกับที่กิจกรรมกำหนด'),
+    'allowed_flowering_types': ('flowering_type', 'ประเภทการออกดอกไม่ตรงกับที่กิจกรรมกำหนด'),
+    'allowed_status': ('status', 'สถานะดอกไม่ตรงกับที่กิจกรรมกำหนด'),
+}
+
+IMAGE_COLUMNS = ('image_1_url', 'image_2_url', 'image_3_url', 'image_4_url')
+CERTIFICATE_COLUMNS = (
+    'certificate_image_1_url', 'certificate_image_2_url',
+    'certificate_image_3_url', 'certificate_image_4_url',
+)
+
+# Defaults the admin form uses when a requirement is ticked without a number
+DEFAULT_MIN_IMAGES = 3
+DEFAULT_MIN_REVIEWS = 1
+
+
+def _parse_values(value):
+    """Allowed values from a column: a single value, comma-separated values or a JSON list"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, str) and value.strip().startswith('['):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+    if isinstance(value, str):
+        value = value.split(',')
+    values = frozenset(str(v).strip().lower() for v in value if str(v).strip())
+    return values or None
+
+
+def _number(value):
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _filled(bud, columns):
+    return sum(1 for column in columns if bud.get(column))
+
+
+def _in_range(value, low, high):
+    value = _number(value)
+    return value is not None and low <= value <= high
+
+
+class EligibilityRule:
+    """An activity's criteria compiled into a list of checks"""
+
+    def __init__(self, checks, needs_review_count):
+        self.checks = checks
+        self.needs_review_count = needs_review_count
+
+    def failures(self, bud):
+        """Reasons the bud can't enter ([] if it is eligible)"""
+        return [{'rule': name, 'message': message} for name, test, message in self.checks if not test(bud)]
+
+
+@lru_cache(maxsize=256)
+def _compile(criteria):
+    values = dict(zip(CRITERIA_COLUMNS, criteria))
+    checks = []
+
+    for column, (bud_column, message) in ALLOWED_VALUE_RULES.items():
+        allowed = _parse_values(values[column])
+        if allowed:
+            checks.append((
+                column,
+                lambda bud, c=bud_column, a=allowed: str(bud.get(c) or '').strip().lower() in a,
+                message,
+            ))
+
+    for name, bud_column in (('thc', 'thc_percentage'), ('cbd', 'cbd_percentage')):
+        low, high = _number(values[f'min_{name}']), _number(values[f'max_{name}'])
+        if low is None and high is None:
+            continue
+        low_bound = low if low is not None else float('-inf')
+        high_bound = high if high is not None else float('inf')
+        checks.append((
+            f'{name}_range',
+            lambda bud, c=bud_column, lo=low_bound, hi=high_bound: _in_range(bud.get(c), lo, hi),
+            f'{name.upper()} ต้องอยู่ระหว่าง {low if low is not None else 0:g}-{high if high is not None else 100:g}%',
+        ))
+
+    if values['require_certificate']:
+        checks.append((
+            'certificate',
+            lambda bud: _filled(bud, CERTIFICATE_COLUMNS) > 0,
+            'ต้องมีรูปใบรับรองผลแล็บ',
+        ))
+
+    if values['require_min_images']:
+        min_images = int(_number(values['min_image_count']) or DEFAULT_MIN_IMAGES)
+        checks.append((
+            'min_images',
+            lambda bud, n=min_images: _filled(bud, IMAGE_COLUMNS) >= n,
+            f'ต้องมีรูปภาพอย่างน้อย {min_images} รูป',
+        ))
+
+    needs_review_count = bool(values['require_min_reviews'])
+    if needs_review_count:
+        min_reviews = int(_number(values['min_review_count']) or DEFAULT_MIN_REVIEWS)
+        checks.append((
+            'min_reviews',
+            lambda bud, n=min_reviews: (bud.get('review_count') or 0) >= n,
+            f'ต้องมีรีวิวอย่างน้อย {min_reviews} รีวิว',
+        ))
+
+    return EligibilityRule(checks, needs_review_count)
+
+
+def compile_criteria(activity):
+    """
+    Compiled eligibility rule for an activity row
+
+    Compilation is cached on the criteria values themselves, so an edited
+    activity gets a fresh rule without explicit invalidation.
+    preferred_* columns are preferences for judging, not entry rules.
+    """
+    return _compile(tuple(activity.get(column) for column in CRITERIA_COLUMNS))
+
+
+def load_user_buds(db, user_id, rule, bud_id=None):
+    """A user's buds (optionally one bud) in one query, with review counts when the rule needs them"""
+    params = [user_id]
+    bud_filter = ''
+    if bud_id is not None:
+        bud_filter = 'AND b.id = %s'
+        params.append(bud_id)
+
+    if rule.needs_review_count:
+        rows = db.execute_query(f'''
+            SELECT b.*, COUNT(r.id) AS review_count
+            FROM buds_data b
+            LEFT JOIN reviews r ON r.bud_reference_id = b.id
+            WHERE b.grower_id = %s {bud_filter}
+            GROUP BY b.id
+            ORDER BY b.created_at DESC
+        ''', tuple(params))
+    else:
+        rows = db.execute_query(f'''
+            SELECT b.* FROM buds_data b
+            WHERE b.grower_id = %s {bud_filter}
+            ORDER BY b.created_at DESC
+        ''', tuple(params))
+
+    return [dict(row) for row in rows]
+
+
+def check_buds(activity, buds):
+    """Split buds into (eligible, ineligible); ineligible buds carry a 'reasons' list"""
+    rule = compile_criteria(activity)
+    eligible, ineligible = [], []
+    for bud in buds:
+        reasons = rule.failures(bud)
+        if reasons:
+            ineligible.append(dict(bud, reasons=reasons))
+        else:
+            eligible.append(bud)
+    return eligible, ineligible
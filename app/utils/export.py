@@ -0,0 +1,102 @@
+import io
+import csv
+import json
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson; charset=utf-8', 'ndjson'),
+}
+
+# Flush to the client once this many bytes are buffered
+CHUNK_SIZE = 64 * 1024
+
+
+def _plain(value):
+    """Value as written to an export (dates as ISO strings, decimals as floats)"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return value
+
+
+def _csv_chunks(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens Thai text as UTF-8
+    buffer.write('\ufeff')
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(['' if value is None else _plain(value) for value in row])
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson_chunks(columns, rows):
+    lines = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(columns, map(_plain, row))), ensure_ascii=False, default=str)
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+            size = 0
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(columns, rows, fmt='csv', compress=False):
+    """
+    Encode rows as CSV or NDJSON byte chunks
+
+    Rows are consumed one at a time and flushed every CHUNK_SIZE bytes, so
+    memory use doesn't depend on the number of rows.
+    """
+    chunks = _csv_chunks(columns, rows) if fmt == 'csv' else _ndjson_chunks(columns, rows)
+    return _gzip_chunks(chunks) if compress else chunks
+
+
+def export_response(results, filename, fmt='csv', compress=False):
+    """
+    Streaming download of stream_query() results
+
+    The query runs here (its column names are read up front), so a failing
+    query raises before any response is sent.
+    """
+    from flask import Response
+
+    columns = next(results)
+
+    content_type, extension = EXPORT_FORMATS[fmt]
+    filename = f'{filename}.{extension}'
+    if compress:
+        content_type = 'application/gzip'
+        filename += '.gz'
+
+    response = Response(export_chunks(columns, results, fmt, compress), content_type=content_type)
+    # Release the database connection even if the client disconnects mid-download
+    response.call_on_close(results.close)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # Let proxies pass chunks through instead of buffering the whole file
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
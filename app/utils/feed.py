@@ -0,0 +1,196 @@
+import logging
+import time
+
+from app.utils.lifecycle import LeasedJob, start_job
+
+logger = logging.getLogger(__name__)
+
+FEED_PAGE_SIZE = 20
+FEED_MAX_PAGE_SIZE = 100
+
+# Friend pairs reconciled per transaction by the maintenance job
+SYNC_BATCH_SIZE = 500
+
+LEASE_NAME = 'feed_maintenance'
+
+# Accepted friendships as directed (reader_id, author_id) pairs
+FRIEND_PAIRS = '''
+    SELECT user_id AS reader_id, friend_id AS author_id FROM friends WHERE status = 'accepted'
+    UNION
+    SELECT friend_id AS reader_id, user_id AS author_id FROM friends WHERE status = 'accepted'
+'''
+
+
+def fan_out_review(db, review_id):
+    """
+    Add a new review to the feed of each of its author's friends
+
+    One INSERT ... SELECT over both directions of the friends table;
+    returns the number of feeds written.
+    """
+    return db.execute_update('''
+        INSERT INTO feed_items (user_id, review_id, reviewer_id, created_at)
+        SELECT reader_id, review_id, reviewer_id, created_at FROM (
+            SELECT f.friend_id AS reader_id, r.id AS review_id, r.reviewer_id, r.created_at
+            FROM reviews r
+            JOIN friends f ON f.user_id = r.reviewer_id AND f.status = 'accepted'
+            WHERE r.id = %s
+            UNION ALL
+            SELECT f.user_id AS reader_id, r.id AS review_id, r.reviewer_id, r.created_at
+            FROM reviews r
+            JOIN friends f ON f.friend_id = r.reviewer_id AND f.status = 'accepted'
+            WHERE r.id = %s
+        ) fan
+        WHERE TRUE
+        ON CONFLICT (user_id, review_id) DO NOTHING
+    ''', (review_id, review_id))
+
+
+def encode_cursor(item):
+    return f"{item['created_at']}|{item['id']}"
+
+
+def decode_cursor(cursor):
+    """(created_at, review_id) from a cursor; raises ValueError if malformed"""
+    created_at, _, review_id = cursor.rpartition('|')
+    if not created_at:
+        raise ValueError(cursor)
+    return created_at, int(review_id)
+
+
+def read_feed(db, user_id, limit=FEED_PAGE_SIZE, cursor=None):
+    """
+    One page of a user's friends' reviews, newest first
+
+    Pages are a range scan of idx_feed_items_user_created starting after
+    the cursor of the previous page. Returns (reviews, next_cursor), with
+    next_cursor None on the last page.
+    """
+    params = [user_id]
+    after = ''
+    if cursor:
+        created_at, review_id = decode_cursor(cursor)
+        after = 'AND (f.created_at < %s OR (f.created_at = %s AND f.review_id < %s))'
+        params.extend([created_at, created_at, review_id])
+    params.append(limit + 1)
+
+    rows = db.execute_query(f'''
+        SELECT
+            r.*,
+            u.username as reviewer_name,
+            u.profile_image_url as reviewer_image,
+            b.strain_name_th,
+            b.strain_name_en
+        FROM feed_items f
+        JOIN reviews r ON r.id = f.review_id
+        LEFT JOIN users u ON r.reviewer_id = u.id
+        LEFT JOIN buds_data b ON r.bud_reference_id = b.id
+        WHERE f.user_id = %s {after}
+        ORDER BY f.created_at DESC, f.review_id DESC
+        LIMIT %s
+    ''', tuple(params))
+
+    reviews = [dict(row) for row in rows]
+    next_cursor = None
+    if len(reviews) > limit:
+        reviews = reviews[:limit]
+        next_cursor = encode_cursor(reviews[-1])
+    return reviews, next_cursor
+
+
+def backfill_feeds(db, batch_size=SYNC_BATCH_SIZE):
+    """
+    Copy past reviews into feeds for friendships not yet in feed_follows
+
+    Handles friendships accepted outside fan_out_review's view and the
+    initial fill after deploying. Returns the number of pairs backfilled.
+    """
+    total = 0
+    while True:
+        pairs = db.execute_query(f'''
+            SELECT p.reader_id, p.author_id FROM ({FRIEND_PAIRS}) p
+            WHERE NOT EXISTS (
+                SELECT 1 FROM feed_follows ff
+                WHERE ff.reader_id = p.reader_id AND ff.author_id = p.author_id
+            )
+            LIMIT %s
+        ''', (batch_size,))
+        if not pairs:
+            return total
+
+        pairs = [(row['reader_id'], row['author_id']) for row in pairs]
+        with db.transaction() as tx:
+            tx.execute_many('''
+                INSERT INTO feed_items (user_id, review_id, reviewer_id, created_at)
+                SELECT %s, r.id, r.reviewer_id, r.created_at FROM reviews r
+                WHERE r.reviewer_id = %s
+                ON CONFLICT (user_id, review_id) DO NOTHING
+            ''', pairs)
+            tx.execute_many('''
+                INSERT INTO feed_follows (reader_id, author_id) VALUES (%s, %s)
+                ON CONFLICT (reader_id, author_id) DO NOTHING
+            ''', pairs)
+        total += len(pairs)
+
+
+def prune_feeds(db, batch_size=SYNC_BATCH_SIZE):
+    """
+    Remove an author's reviews from feeds of readers who are no longer friends
+
+    Returns the number of pairs removed.
+    """
+    total = 0
+    while True:
+        pairs = db.execute_query(f'''
+            SELECT ff.reader_id, ff.author_id FROM feed_follows ff
+            WHERE NOT EXISTS (
+                SELECT 1 FROM ({FRIEND_PAIRS}) p
+                WHERE p.reader_id = ff.reader_id AND p.author_id = ff.author_id
+            )
+            LIMIT %s
+        ''', (batch_size,))
+        if not pairs:
+            return total
+
+        pairs = [(row['reader_id'], row['author_id']) for row in pairs]
+        with db.transaction() as tx:
+            tx.execute_many('DELETE FROM feed_items WHERE user_id = %s AND reviewer_id = %s', pairs)
+            tx.execute_many('DELETE FROM feed_follows WHERE reader_id = %s AND author_id = %s', pairs)
+        total += len(pairs)
+
+
+def remove_user_feed(db, user_id):
+    """Drop a deleted user's feed and their reviews from other feeds"""
+    db.execute_update('DELETE FROM feed_items WHERE user_id = %s OR reviewer_id = %s', (user_id, user_id))
+    db.execute_update('DELETE FROM feed_follows WHERE reader_id = %s OR author_id = %s', (user_id, user_id))
+
+
+class FeedMaintenanceJob(LeasedJob):
+    """Backfills and prunes feeds every interval seconds on the lease holder"""
+
+    lease_name = LEASE_NAME
+    thread_name = 'feed-maintenance'
+
+    def run(self):
+        """Prune then backfill; returns (pairs_backfilled, pairs_pruned)"""
+        start = time.perf_counter()
+        pruned = prune_feeds(self.db)
+        backfilled = backfill_feeds(self.db)
+        logger.info(
+            f"Feeds reconciled in {time.perf_counter() - start:.2f}s",
+            extra={'fields': {'pairs_backfilled': backfilled, 'pairs_pruned': pruned}}
+        )
+        return backfilled, pruned
+
+
+def init_feed(app, db):
+    """
+    Start the feed maintenance job
+
+    The first run after deploying fills every feed from the existing
+    friendships; later runs only touch friendships that changed.
+    """
+    return start_job(
+        app, 'FEED_MAINTENANCE_INTERVAL', 'feed_job',
+        lambda interval: FeedMaintenanceJob(db, interval)
+    )
@@ -30,20 +30,3 @@ def dicts_from_rows(rows):
     """Convert list of sqlite3.Row to list of dictionaries"""
     return [dict(row) for row in rows]
 
-
-def generate_unique_filename(original_filename):
-    """Generate unique filename with timestamp"""
-    import secrets
-    from datetime import datetime
-
-    # Get file extension inline
-    ext = None
-    if '.' in original_filename:
-        ext = original_filename.rsplit('.', 1)[1].lower()
-
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    random_str = secrets.token_hex(8)
-
-    if ext:
-        return f"{timestamp}_{random_str}.{ext}"
-    return f"{timestamp}_{random_str}"
@@ -0,0 +1,289 @@
+from app.utils.eligibility import _parse_values, _number
+
+# Share of the score each component carries; components the activity has no
+# preference for are left out and the remaining weights rescaled
+SCORE_WEIGHTS = {
+    'rating': 0.5,
+    'aroma': 0.15,
+    'effects': 0.15,
+    'terpenes': 0.1,
+    'potency': 0.1,
+}
+
+# activity column -> bud columns searched for the preferred values
+PREFERENCE_COLUMNS = {
+    'aroma': ('preferred_aromas', ('aroma_flavor',)),
+    'effects': ('preferred_effects', ('mental_effects_positive', 'physical_effects_positive')),
+    'terpenes': ('preferred_terpenes', ('top_terpenes_1', 'top_terpenes_2', 'top_terpenes_3')),
+}
+
+# Prize value columns, first place first
+PRIZE_COLUMNS = ('first_prize_value', 'second_prize_value', 'third_prize_value')
+
+# A bud's average rating counts as this many reviews at the activity-wide mean,
+# so one 5-star review doesn't beat twenty 4.8-star ones
+RATING_PRIOR_REVIEWS = 3
+
+# How much of the rating comes from the aroma rating (the rest is overall)
+AROMA_RATING_SHARE = 0.25
+
+# Percentage points outside the THC/CBD range over which the fit drops to 0
+POTENCY_FALLOFF = 5.0
+
+# Cached leaderboards, keyed by _leaderboard_key()
+LEADERBOARD_CACHE_PREFIX = 'activities_leaderboard_'
+
+
+def load_submissions(db, activity_id):
+    """Every submission of an activity with its bud and review aggregates, in one query (db may be a Transaction)"""
+    rows = db.execute_query('''
+        SELECT
+            ap.id AS participation_id,
+            ap.user_id,
+            ap.bud_id,
+            ap.rank,
+            ap.prize_amount,
+            ap.registered_at,
+            u.username,
+            b.strain_name_th,
+            b.strain_name_en,
+            b.image_1_url,
+            b.thc_percentage,
+            b.cbd_percentage,
+            b.aroma_flavor,
+            b.top_terpenes_1,
+            b.top_terpenes_2,
+            b.top_terpenes_3,
+            b.mental_effects_positive,
+            b.physical_effects_positive,
+            COALESCE(rs.review_count, 0) AS review_count,
+            rs.overall_sum,
+            rs.aroma_sum,
+            rs.aroma_count
+        FROM activity_participants ap
+        LEFT JOIN users u ON ap.user_id = u.id
+        LEFT JOIN buds_data b ON ap.bud_id = b.id
+        LEFT JOIN (
+            SELECT
+                bud_reference_id,
+                COUNT(overall_rating) AS review_count,
+                SUM(overall_rating) AS overall_sum,
+                SUM(aroma_rating) AS aroma_sum,
+                COUNT(aroma_rating) AS aroma_count
+            FROM reviews
+            WHERE bud_reference_id IN (SELECT bud_id FROM activity_participants WHERE activity_id = %s)
+            GROUP BY bud_reference_id
+        ) rs ON rs.bud_reference_id = ap.bud_id
+        WHERE ap.activity_id = %s
+    ''', (activity_id, activity_id))
+    return [dict(row) for row in rows]
+
+
+def load_participants(db, activity_id):
+    """An activity's participants with user and bud details, newest entry first"""
+    rows = db.execute_query('''
+        SELECT
+            ap.id,
+            ap.activity_id,
+            ap.user_id,
+            ap.bud_id,
+            ap.registered_at as joined_at,
+            ap.submission_description,
+            ap.rank,
+            ap.prize_amount,
+            u.username,
+            u.username as display_name,
+            u.profile_image_url,
+            b.strain_name_th,
+            b.strain_name_en,
+            b.breeder,
+            b.thc_percentage,
+            b.cbd_percentage,
+            b.image_1_url,
+            b.image_2_url,
+            b.image_3_url,
+            b.image_4_url,
+            b.strain_type,
+            b.grow_method,
+            b.grade
+        FROM activity_participants ap
+        LEFT JOIN users u ON ap.user_id = u.id
+        LEFT JOIN buds_data b ON ap.bud_id = b.id
+        WHERE ap.activity_id = %s
+        ORDER BY ap.registered_at DESC
+    ''', (activity_id,))
+    return [dict(row) for row in rows]
+
+
+def _match_share(preferred, bud, columns):
+    """Share of the preferred values mentioned in the bud's text columns"""
+    text = ' '.join(str(bud.get(column) or '') for column in columns).lower()
+    return sum(1 for value in preferred if value in text) / len(preferred)
+
+
+def _potency_fit(value, low, high):
+    """1 inside [low, high], falling linearly to 0 over POTENCY_FALLOFF outside it"""
+    value = _number(value)
+    if value is None:
+        return 0.0
+    if low is not None and value < low:
+        return max(0.0, 1 - (low - value) / POTENCY_FALLOFF)
+    if high is not None and value > high:
+        return max(0.0, 1 - (value - high) / POTENCY_FALLOFF)
+    return 1.0
+
+
+def score_submissions(activity, submissions):
+    """
+    Score and rank submissions (rows from load_submissions)
+
+    The activity's preferences are parsed once and every submission goes
+    through the same loop. Returns the submissions best first, each with a
+    'score' (0-100), its 'breakdown' per component (0-1), 'avg_rating' and
+    the computed 'position'. Ties go to the bud with more reviews, then to
+    the earlier entry.
+    """
+    preferences = {}
+    for name, (column, bud_columns) in PREFERENCE_COLUMNS.items():
+        preferred = _parse_values(activity.get(column))
+        if preferred:
+            preferences[name] = (preferred, bud_columns)
+
+    ranges = {}
+    for name, bud_column in (('thc', 'thc_percentage'), ('cbd', 'cbd_percentage')):
+        low, high = _number(activity.get(f'min_{name}')), _number(activity.get(f'max_{name}'))
+        if low is not None or high is not None:
+            ranges[bud_column] = (low, high)
+
+    weights = {name: SCORE_WEIGHTS[name] for name in ('rating', *preferences)}
+    if ranges:
+        weights['potency'] = SCORE_WEIGHTS['potency']
+    total_weight = sum(weights.values())
+
+    # Activity-wide mean rating is the prior every bud's average is pulled towards
+    review_total = sum(s['review_count'] for s in submissions)
+    rating_sum = sum(s['overall_sum'] or 0 for s in submissions)
+    prior = rating_sum / review_total if review_total else 2.5
+
+    scored = []
+    for submission in submissions:
+        count = submission['review_count']
+        overall = ((submission['overall_sum'] or 0) + prior * RATING_PRIOR_REVIEWS) / (count + RATING_PRIOR_REVIEWS)
+        rating = overall
+        if submission['aroma_count']:
+            aroma = (submission['aroma_sum'] + prior * RATING_PRIOR_REVIEWS) / (submission['aroma_count'] + RATING_PRIOR_REVIEWS)
+            rating = overall * (1 - AROMA_RATING_SHARE) + aroma * AROMA_RATING_SHARE
+
+        breakdown = {'rating': rating / 5}
+        for name, (preferred, bud_columns) in preferences.items():
+            breakdown[name] = _match_share(preferred, submission, bud_columns)
+        if ranges:
+            fits = [_potency_fit(submission.get(column), low, high) for column, (low, high) in ranges.items()]
+            breakdown['potency'] = sum(fits) / len(fits)
+
+        score = sum(weights[name] * value for name, value in breakdown.items()) / total_weight * 100
+        entry = {k: v for k, v in submission.items() if k not in ('overall_sum', 'aroma_sum', 'aroma_count')}
+        entry.update(
+            score=round(score, 2),
+            breakdown={name: round(value, 3) for name, value in breakdown.items()},
+            avg_rating=round(submission['overall_sum'] / count, 2) if count else None,
+        )
+        scored.append(entry)
+
+    scored.sort(key=lambda e: (-e['score'], -e['review_count'], str(e['registered_at'] or ''), e['participation_id']))
+    for position, entry in enumerate(scored, 1):
+        entry['position'] = position
+    return scored
+
+
+def judge_activity(db, activity):
+    """
+    Score an activity's submissions and store rank and prize_amount
+
+    Submissions are read and all ranks cleared and rewritten in one
+    transaction, so a late registration can't be left out of a judged
+    result and readers never see a half-judged activity. Returns the
+    leaderboard.
+    """
+    prizes = [activity.get(column) or 0 for column in PRIZE_COLUMNS]
+
+    with db.transaction() as tx:
+        scored = score_submissions(activity, load_submissions(tx, activity['id']))
+        for entry in scored:
+            entry['rank'] = entry['position']
+            entry['prize_amount'] = prizes[entry['position'] - 1] if entry['position'] <= len(prizes) else None
+
+        tx.execute_update('''
+            UPDATE activity_participants SET rank = NULL, prize_amount = NULL
+            WHERE activity_id = %s
+        ''', (activity['id'],))
+        if scored:
+            tx.execute_many(
+                'UPDATE activity_participants SET rank = %s, prize_amount = %s WHERE id = %s',
+                [(e['rank'], e['prize_amount'], e['participation_id']) for e in scored]
+            )
+
+    return {'judged': True, 'entries': scored}
+
+
+def build_leaderboard(db, activity):
+    """
+    Current standings of an activity
+
+    Once judged, the stored ranks and prizes are the official result and
+    entries are ordered by them; before that the ranks are provisional
+    (rank is None, position is the computed place).
+    """
+    scored = score_submissions(activity, load_submissions(db, activity['id']))
+    judged = any(entry['rank'] is not None for entry in scored)
+    if judged:
+        scored.sort(key=lambda e: (e['rank'] is None, e['rank'] or 0, e['position']))
+    return {'judged': judged, 'entries': scored}
+
+
+def _leaderboard_key(activity_id):
+    # The trailing ':' keeps activity 1 from matching 12 in clear_pattern
+    return f'{LEADERBOARD_CACHE_PREFIX}{activity_id}:'
+
+
+def get_leaderboard(db, cache, activity, ttl):
+    """build_leaderboard() cached per activity for ttl seconds"""
+    key = _leaderboard_key(activity['id'])
+    leaderboard = cache.get(key)
+    if leaderboard is None:
+        leaderboard = build_leaderboard(db, activity)
+        cache.set(key, leaderboard, ttl)
+    return leaderboard
+
+
+def invalidate_leaderboard(cache, activity_id=None):
+    """Drop one activity's cached leaderboard, or all of them"""
+    if activity_id is None:
+        cache.clear_pattern(LEADERBOARD_CACHE_PREFIX)
+    else:
+        cache.clear_pattern(_leaderboard_key(activity_id))
+
+
+def invalidate_bud_leaderboards(db, cache, bud_id):
+    """Drop the cached leaderboards of every activity a bud is entered in, e.g. after a review changes"""
+    rows = db.execute_query('SELECT DISTINCT activity_id FROM activity_participants WHERE bud_id = %s', (bud_id,))
+    for row in rows:
+        invalidate_leaderboard(cache, row['activity_id'])
+
+
+def merge_standings(participants, leaderboard):
+    """
+    Copy score, position, rank, prize and rating figures onto participant rows
+
+    Rows are matched on their participation id ('id'). When the activity is
+    judged they are reordered by rank. Returns leaderboard['judged'].
+    """
+    entries = {entry['participation_id']: entry for entry in leaderboard['entries']}
+    for participant in participants:
+        entry = entries.get(participant['id'])
+        if entry:
+            for key in ('score', 'breakdown', 'position', 'rank', 'prize_amount', 'avg_rating', 'review_count'):
+                participant[key] = entry[key]
+    if leaderboard['judged']:
+        participants.sort(key=lambda p: (p.get('rank') is None, p.get('rank') or 0))
+    return leaderboard['judged']
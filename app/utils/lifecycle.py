@@ -0,0 +1,283 @@
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+from decimal import Decimal
+
+from app.utils.judging import build_leaderboard, load_participants, merge_standings
+
+logger = logging.getLogger(__name__)
+
+UPCOMING = 'upcoming'
+OPEN = 'registration_open'
+CLOSED = 'registration_closed'
+
+# 'open' is the older name for registration_open
+OPEN_STATUSES = ('open', OPEN)
+
+# Statuses the scheduler moves forward; judging/completed are set by admins
+SCHEDULED_STATUSES = (UPCOMING, *OPEN_STATUSES)
+
+LEASE_NAME = 'activity_lifecycle'
+
+# The lease outlives this many missed ticks before another worker takes over
+LEASE_TICKS = 3
+
+
+def _parse_time(value):
+    """Registration date as a naive local datetime (the admin form sends local time)"""
+    if not value:
+        return None
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(str(value).strip())
+        except ValueError:
+            return None
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+
+def target_status(activity, now):
+    """
+    Status the activity's registration dates call for, or None to leave it
+
+    Transitions only go forward (upcoming -> open -> closed), so an activity
+    an admin closed early or moved on to judging is never reopened.
+    """
+    status = activity.get('status')
+    if status not in SCHEDULED_STATUSES:
+        return None
+
+    start = _parse_time(activity.get('start_registration_date'))
+    end = _parse_time(activity.get('end_registration_date'))
+
+    if end is not None and end <= now:
+        return CLOSED
+    if status == UPCOMING and start is not None and start <= now:
+        return OPEN
+    return None
+
+
+def write_snapshot(db, activity):
+    """
+    Freeze an activity's leaderboard and participant list
+
+    db may be a Transaction so the snapshot lands with the status change.
+    """
+    leaderboard = build_leaderboard(db, activity)
+    participants = load_participants(db, activity['id'])
+    merge_standings(participants, leaderboard)
+    data = json.dumps(
+        {'leaderboard': leaderboard, 'participants': participants}, ensure_ascii=False,
+        default=lambda value: float(value) if isinstance(value, Decimal) else str(value)
+    )
+    db.execute_update('''
+        INSERT INTO activity_snapshots (activity_id, data, created_at)
+        VALUES (%s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (activity_id) DO UPDATE SET data = excluded.data, created_at = excluded.created_at
+    ''', (activity['id'], data))
+
+
+def load_snapshot(db, activity_id):
+    """The frozen {'leaderboard', 'participants'} of a closed activity, or None"""
+    rows = db.execute_query('SELECT data FROM activity_snapshots WHERE activity_id = %s', (activity_id,))
+    return json.loads(rows[0]['data']) if rows else None
+
+
+def refresh_snapshots(db, activity_ids):
+    """Rebuild the existing snapshots of these activities (after judging or removing entries)"""
+    activity_ids = list(activity_ids)
+    if not activity_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(activity_ids))
+    activities = db.execute_query(f'''
+        SELECT a.* FROM activities a
+        JOIN activity_snapshots s ON s.activity_id = a.id
+        WHERE a.id IN ({placeholders})
+    ''', tuple(activity_ids))
+    for activity in activities:
+        with db.transaction() as tx:
+            write_snapshot(tx, dict(activity))
+
+
+def sync_snapshot(db, activity):
+    """
+    Keep the snapshot in line with a status an admin set by hand
+
+    Reopening an activity drops its snapshot; closing or moving it past
+    registration writes one if the scheduler hasn't.
+    """
+    if activity.get('status') in SCHEDULED_STATUSES:
+        drop_snapshot(db, activity['id'])
+    elif not db.execute_query('SELECT 1 FROM activity_snapshots WHERE activity_id = %s', (activity['id'],)):
+        with db.transaction() as tx:
+            write_snapshot(tx, activity)
+
+
+def drop_snapshot(db, activity_id):
+    """Discard a snapshot (the activity was reopened or deleted)"""
+    db.execute_update('DELETE FROM activity_snapshots WHERE activity_id = %s', (activity_id,))
+
+
+def advance_activities(db, now=None):
+    """
+    Move activities whose registration dates have passed to their next status
+
+    Each change is a compare-and-set on the status read, so an admin edit
+    made in between wins. Closing an activity writes its snapshot in the
+    same transaction. Returns [(activity_id, old_status, new_status)].
+    """
+    now = now or datetime.now()
+    placeholders = ', '.join(['%s'] * len(SCHEDULED_STATUSES))
+    activities = db.execute_query(
+        f'SELECT * FROM activities WHERE status IN ({placeholders})', SCHEDULED_STATUSES
+    )
+
+    changed = []
+    for row in activities:
+        activity = dict(row)
+        status = target_status(activity, now)
+        if status is None:
+            continue
+        with db.transaction() as tx:
+            updated = tx.execute_update(
+                'UPDATE activities SET status = %s WHERE id = %s AND status = %s',
+                (status, activity['id'], activity['status'])
+            )
+            if updated and status == CLOSED:
+                write_snapshot(tx, dict(activity, status=status))
+        if updated:
+            changed.append((activity['id'], activity['status'], status))
+    return changed
+
+
+def acquire_lease(db, name, holder, ttl):
+    """
+    Take or renew a named lease; True while this holder is the leader
+
+    The upsert only overwrites a row that this holder owns or that has
+    expired, so exactly one worker gets a row count of 1.
+    """
+    now = time.time()
+    return db.execute_update('''
+        INSERT INTO scheduler_leases (name, holder, expires_at) VALUES (%s, %s, %s)
+        ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+        WHERE scheduler_leases.holder = excluded.holder OR scheduler_leases.expires_at < %s
+    ''', (name, holder, now + ttl, now)) == 1
+
+
+def release_lease(db, name, holder):
+    db.execute_update('DELETE FROM scheduler_leases WHERE name = %s AND holder = %s', (name, holder))
+
+
+class LeasedJob(ABC):
+    """
+    Background thread doing a round of work every interval seconds on the lease holder
+
+    Every worker runs the thread; only the holder of the lease_name row in
+    scheduler_leases does the work, and the lease outlives LEASE_TICKS
+    missed rounds. Subclasses set lease_name and thread_name and implement
+    run(). Setting wake starts the next round at once.
+    """
+
+    lease_name = None
+    thread_name = None
+    # What run_once() returns on a worker that isn't the leader
+    idle_result = None
+
+    def __init__(self, db, interval):
+        self.db = db
+        self.interval = interval
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.logger = logging.getLogger(type(self).__module__)
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+        release_lease(self.db, self.lease_name, self.holder)
+
+    def run_once(self):
+        """One round if this worker holds the lease; returns run()'s result, or idle_result"""
+        if not acquire_lease(self.db, self.lease_name, self.holder, self.interval * LEASE_TICKS):
+            return self.idle_result
+        return self.run()
+
+    @abstractmethod
+    def run(self):
+        """One round of work on the lease holder"""
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                self.logger.exception(f"{self.thread_name} round failed")
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+
+class LifecycleScheduler(LeasedJob):
+    """Advances activity statuses every interval seconds on the lease holder"""
+
+    lease_name = LEASE_NAME
+    thread_name = 'activity-lifecycle'
+    idle_result = []
+
+    def run(self):
+        """One scheduling round; returns the changes made"""
+        changed = advance_activities(self.db)
+        for activity_id, old_status, new_status in changed:
+            logger.info(
+                f"Activity {activity_id} moved from {old_status} to {new_status}",
+                extra={'fields': {'activity_id': activity_id, 'status': new_status}}
+            )
+        return changed
+
+
+def start_job(app, interval_key, attr, factory):
+    """
+    Start a LeasedJob running every app.config[interval_key] seconds
+
+    factory(interval) builds the job. It is stopped at exit and kept as
+    app.<attr>. An interval of 0 disables it, and no job runs under
+    testing. Returns the job, or None.
+    """
+    interval = app.config[interval_key]
+    if not interval or app.testing:
+        return None
+
+    job = factory(interval)
+    job.start()
+    atexit.register(job.stop)
+    setattr(app, attr, job)
+    return job
+
+
+def init_scheduler(app, db):
+    """
+    Start the lifecycle scheduler
+
+    Every worker runs the thread, but only the holder of the
+    scheduler_leases row changes statuses. If it dies, the lease expires
+    after LEASE_TICKS intervals and another worker takes over.
+    """
+    return start_job(
+        app, 'ACTIVITY_SCHEDULER_INTERVAL', 'activity_scheduler',
+        lambda interval: LifecycleScheduler(db, interval)
+    )
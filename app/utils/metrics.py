@@ -0,0 +1,318 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_HELP = {
+    'budtboy_requests_total': ('counter', 'HTTP requests by endpoint, method and status'),
+    'budtboy_request_duration_seconds': ('histogram', 'HTTP request latency by endpoint'),
+    'budtboy_requests_in_flight': ('gauge', 'HTTP requests currently being served'),
+    'budtboy_db_queries_total': ('counter', 'Database connections used for queries'),
+    'budtboy_db_query_seconds_total': ('counter', 'Time spent in database queries'),
+    'budtboy_cache_requests_total': ('counter', 'In-memory cache lookups by result'),
+    'budtboy_upload_bytes_total': ('counter', 'Bytes received in multipart uploads'),
+    'budtboy_bcrypt_seconds_total': ('counter', 'CPU time spent hashing and verifying passwords'),
+    'budtboy_bcrypt_operations_total': ('counter', 'Password hash and verify operations'),
+    'budtboy_bcrypt_rejected_total': ('counter', 'Password operations rejected by the pool (busy or timeout)'),
+}
+
+
+def _key(name, labels):
+    """Serialize a metric name and its labels into a stable string key"""
+    if not labels:
+        return name
+    return name + '|' + ','.join(f'{k}={labels[k]}' for k in sorted(labels))
+
+
+def _split_key(key):
+    """Inverse of _key"""
+    if '|' not in key:
+        return key, {}
+    name, raw = key.split('|', 1)
+    return name, dict(pair.split('=', 1) for pair in raw.split(','))
+
+
+class MetricsRegistry:
+    """
+    Per-process metric store
+
+    Each worker keeps its metrics in memory and periodically writes them to
+    its own file in a shared directory. The /metrics endpoint sums the files
+    of all workers so values are correct behind a prefork server.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.metrics_dir = None
+        self.flush_interval = 5
+        self.flushed_at = 0
+
+    def configure(self, metrics_dir, flush_interval=5):
+        """Set the shared directory used to aggregate across workers"""
+        os.makedirs(metrics_dir, exist_ok=True)
+        self.metrics_dir = metrics_dir
+        self.flush_interval = flush_interval
+        self.prune()
+
+    def prune(self):
+        """
+        Delete the files of workers that are no longer running
+
+        Their counters drop out of the totals, which Prometheus treats as a
+        counter reset. Returns the number of files removed.
+        """
+        if not self.metrics_dir:
+            return 0
+        removed = 0
+        for filename in os.listdir(self.metrics_dir):
+            pid = _file_pid(filename)
+            if pid is None or _pid_alive(pid):
+                continue
+            try:
+                os.remove(os.path.join(self.metrics_dir, filename))
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Metrics prune error: {e}")
+        return removed
+
+    def inc(self, name, value=1, **labels):
+        """Increment a counter"""
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_gauge(self, name, value, **labels):
+        """Add to (or subtract from) a gauge"""
+        key = _key(name, labels)
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        """Record an observation in a histogram"""
+        key = _key(name, labels)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = {'le': list(buckets), 'counts': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0}
+                self.histograms[key] = hist
+            hist['counts'][bisect.bisect_left(hist['le'], value)] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def snapshot(self):
+        """Copy of this process's metrics"""
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'histograms': {
+                    k: {'le': list(h['le']), 'counts': list(h['counts']), 'sum': h['sum'], 'count': h['count']}
+                    for k, h in self.histograms.items()
+                },
+            }
+
+    def maybe_flush(self):
+        """Write this process's metrics file if the flush interval has passed"""
+        if self.metrics_dir and time.time() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write this process's metrics file atomically"""
+        if not self.metrics_dir:
+            return
+        self.flushed_at = time.time()
+        data = self.snapshot()
+        path = os.path.join(self.metrics_dir, f'worker_{data["pid"]}.json')
+        tmp_path = f'{path}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Metrics flush error: {e}")
+
+    def collect(self):
+        """Merge the metrics of every live worker, pruning the files of dead ones"""
+        self.flush()
+        self.prune()
+
+        snapshots = [self.snapshot()]
+        if self.metrics_dir:
+            snapshots = []
+            for filename in os.listdir(self.metrics_dir):
+                if not filename.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(self.metrics_dir, filename)) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+
+        counters, gauges, histograms = {}, {}, {}
+        for data in snapshots:
+            for k, v in data['counters'].items():
+                counters[k] = counters.get(k, 0) + v
+            if _pid_alive(data['pid']):
+                for k, v in data['gauges'].items():
+                    gauges[k] = gauges.get(k, 0) + v
+            for k, h in data['histograms'].items():
+                merged = histograms.get(k)
+                if merged is None:
+                    histograms[k] = {'le': h['le'], 'counts': list(h['counts']), 'sum': h['sum'], 'count': h['count']}
+                else:
+                    merged['counts'] = [a + b for a, b in zip(merged['counts'], h['counts'])]
+                    merged['sum'] += h['sum']
+                    merged['count'] += h['count']
+        return counters, gauges, histograms
+
+    def render(self):
+        """Render all metrics in Prometheus text exposition format"""
+        counters, gauges, histograms = self.collect()
+
+        families = {}
+        for store, kind in ((counters, 'counter'), (gauges, 'gauge'), (histograms, 'histogram')):
+            for key, value in store.items():
+                name, labels = _split_key(key)
+                families.setdefault(name, (kind, []))[1].append((labels, value))
+
+        lines = []
+        for name in sorted(families):
+            kind, samples = families[name]
+            help_text = METRIC_HELP.get(name, (kind, name))[1]
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(samples, key=lambda s: sorted(s[0].items())):
+                if kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for le, count in zip(value['le'] + ['+Inf'], value['counts']):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(dict(labels, le=le))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value["sum"])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {value["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def _file_pid(filename):
+    """pid of a worker_<pid>.json (or leftover .json.tmp) file, None for anything else"""
+    name = filename.split('.', 1)[0]
+    if not name.startswith('worker_') or not filename.endswith(('.json', '.json.tmp')):
+        return None
+    try:
+        return int(name[len('worker_'):])
+    except ValueError:
+        return None
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+# Process-wide registry
+metrics = MetricsRegistry()
+
+
+def init_metrics(app, db, cache):
+    """Collect request, DB, cache, upload and render metrics and add Server-Timing headers"""
+    from flask import g, request, has_request_context, template_rendered, before_render_template
+
+    metrics.configure(app.config['METRICS_DIR'], app.config['METRICS_FLUSH_INTERVAL'])
+
+    def record_db_time(elapsed):
+        metrics.inc('budtboy_db_queries_total')
+        metrics.inc('budtboy_db_query_seconds_total', elapsed)
+
+    def record_cache_lookup(hit, elapsed):
+        metrics.inc('budtboy_cache_requests_total', result='hit' if hit else 'miss')
+        if has_request_context():
+            g.cache_time = g.get('cache_time', 0.0) + elapsed
+
+    def render_started(sender, template, context, **extra):
+        if has_request_context():
+            g.render_start = time.perf_counter()
+
+    def render_finished(sender, template, context, **extra):
+        if has_request_context() and g.get('render_start') is not None:
+            g.render_time = g.get('render_time', 0.0) + time.perf_counter() - g.render_start
+            g.render_start = None
+
+    db.query_observers.append(record_db_time)
+    cache.observers.append(record_cache_lookup)
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.metrics_endpoint = request.endpoint or 'unknown'
+        g.cache_time = 0.0
+        g.render_time = 0.0
+        metrics.add_gauge('budtboy_requests_in_flight', 1, endpoint=g.metrics_endpoint)
+
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.get('metrics_start')
+        if start is None:
+            return response
+
+        duration = time.perf_counter() - start
+        endpoint = g.metrics_endpoint
+        metrics.observe('budtboy_request_duration_seconds', duration, endpoint=endpoint, method=request.method)
+        metrics.inc('budtboy_requests_total', endpoint=endpoint, method=request.method,
+                    status=str(response.status_code))
+
+        if request.mimetype == 'multipart/form-data' and request.content_length:
+            metrics.inc('budtboy_upload_bytes_total', request.content_length)
+
+        db_count = g.get('db_count', 0)
+        response.headers.add('Server-Timing', ', '.join([
+            f'db;dur={g.get("db_time", 0.0) * 1000:.1f};desc="{db_count} queries"',
+            f'cache;dur={g.get("cache_time", 0.0) * 1000:.1f}',
+            f'render;dur={g.get("render_time", 0.0) * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ]))
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        endpoint = g.pop('metrics_endpoint', None)
+        if endpoint is not None:
+            metrics.add_gauge('budtboy_requests_in_flight', -1, endpoint=endpoint)
+        metrics.maybe_flush()
@@ -0,0 +1,244 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+ROUNDS_SETTING = 'bcryptRounds'
+MIN_ROUNDS = 12  # never below the cost used before calibration
+MAX_ROUNDS = 16
+
+
+class PasswordPoolError(Exception):
+    """Password work could not be done in time"""
+
+
+class PasswordPoolBusy(PasswordPoolError):
+    """Too many password operations are already queued"""
+
+
+class PasswordPoolTimeout(PasswordPoolError):
+    """A password operation did not finish within the timeout"""
+
+
+class PasswordPoolBroken(PasswordPoolError):
+    """A pool process died while doing a password operation"""
+
+
+def _hash(password, rounds):
+    start = time.process_time()
+    hashed = bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+    return hashed, time.process_time() - start
+
+
+def _verify(password, hashed):
+    start = time.process_time()
+    matches = bcrypt.checkpw(password, hashed)
+    return matches, time.process_time() - start
+
+
+def _warm_up():
+    return None
+
+
+def hash_rounds(hashed):
+    """Cost factor stored in a bcrypt hash ($2b$12$...), or None"""
+    if isinstance(hashed, str):
+        hashed = hashed.encode('utf-8')
+    try:
+        return int(hashed.split(b'$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def calibrate_rounds(target_ms=250, min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS):
+    """Highest cost factor whose hash takes no longer than target_ms on this machine"""
+    start = time.perf_counter()
+    bcrypt.hashpw(b'calibration', bcrypt.gensalt(rounds=min_rounds))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    # Each extra round doubles the work
+    rounds = min_rounds
+    while rounds < max_rounds and elapsed_ms * 2 <= target_ms:
+        rounds += 1
+        elapsed_ms *= 2
+    return rounds
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a bounded process pool so password work never holds a
+    request thread's CPU or the GIL. With workers=0 (the default until
+    init_password_pool runs, e.g. in scripts) work is done inline.
+    """
+
+    def __init__(self, workers=0, max_queue=16, timeout=5.0, rounds=12):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.rounds = rounds
+        self.settings = None
+        self.observers = []  # Called with (operation, cpu_seconds) after each operation
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_queue)
+        self.executor = None
+        self.executor_pid = None
+
+    def configure(self, workers, max_queue, timeout, rounds, settings=None):
+        self.shutdown()
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.rounds = rounds
+        self.settings = settings
+        self.slots = threading.BoundedSemaphore(max_queue)
+
+    def current_rounds(self):
+        """Cost factor for new hashes (admin setting overrides the configured value)"""
+        if self.settings is not None:
+            try:
+                rounds = int(self.settings.get(ROUNDS_SETTING) or 0)
+                if MIN_ROUNDS <= rounds <= MAX_ROUNDS:
+                    return rounds
+            except ValueError:
+                pass
+        return self.rounds
+
+    def hash(self, password):
+        return self._run('hash', _hash, password.encode('utf-8'), self.current_rounds())
+
+    def verify(self, password, hashed):
+        if isinstance(hashed, str):
+            hashed = hashed.encode('utf-8')
+        return self._run('verify', _verify, password.encode('utf-8'), hashed)
+
+    def needs_rehash(self, hashed):
+        """True if the hash is weaker than the current cost (hashes are only ever upgraded)"""
+        rounds = hash_rounds(hashed)
+        return rounds is not None and rounds < self.current_rounds()
+
+    def _get_executor(self):
+        # Pools don't survive fork; each worker process creates its own
+        with self.lock:
+            if self.executor is None or self.executor_pid != os.getpid():
+                # fork keeps children light (spawn would re-run the entry script)
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self.executor_pid = os.getpid()
+            return self.executor
+
+    def start(self):
+        """
+        Fork the pool processes now
+
+        Called while the worker has no other threads yet: forking once
+        request threads, the log listener or background jobs run can leave
+        a lock held in the child. Only a pool rebuilt after a crash is
+        forked later.
+        """
+        if self.workers:
+            self._get_executor().submit(_warm_up).result(timeout=self.timeout)
+
+    def _discard_executor(self, executor):
+        """Drop a broken pool so the next operation starts a fresh one"""
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, func, *args):
+        executor = self._get_executor()
+        try:
+            return executor, executor.submit(func, *args)
+        except BrokenProcessPool:
+            # A child died since the last operation; nothing was lost yet
+            logger.warning("Password pool was broken, starting a new one")
+            self._discard_executor(executor)
+            executor = self._get_executor()
+            return executor, executor.submit(func, *args)
+
+    def _run(self, operation, func, *args):
+        if not self.workers:
+            result, cpu_seconds = func(*args)
+            self._notify(operation, cpu_seconds)
+            return result
+
+        if not self.slots.acquire(blocking=False):
+            raise PasswordPoolBusy(f'{self.max_queue} password operations already queued')
+
+        try:
+            executor, future = self._submit(func, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        # The slot is held until the work really finishes, even after a timeout
+        future.add_done_callback(lambda _: self.slots.release())
+
+        try:
+            result, cpu_seconds = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise PasswordPoolTimeout(f'Password {operation} took longer than {self.timeout}s')
+        except BrokenProcessPool:
+            logger.warning(f"Password pool process died during {operation}, starting a new pool")
+            self._discard_executor(executor)
+            raise PasswordPoolBroken(f'Password {operation} was lost when a pool process died')
+        self._notify(operation, cpu_seconds)
+        return result
+
+    def _notify(self, operation, cpu_seconds):
+        for observer in self.observers:
+            observer(operation, cpu_seconds)
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None and self.executor_pid == os.getpid():
+                self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+# Process-wide hasher
+password_hasher = PasswordHasher()
+
+
+def init_password_pool(app, settings):
+    """
+    Move bcrypt onto a process pool and pick the cost factor
+
+    BCRYPT_ROUNDS wins if set. Otherwise the bcryptRounds admin setting is
+    used, and if that is missing too the cost is calibrated against
+    BCRYPT_TARGET_MS once and saved so every worker uses the same value.
+    """
+    import atexit
+
+    rounds = app.config['BCRYPT_ROUNDS']
+    if rounds is None and settings.get(ROUNDS_SETTING) is None:
+        calibrated = calibrate_rounds(app.config['BCRYPT_TARGET_MS'])
+        try:
+            settings.db.execute_update('''
+                INSERT INTO admin_settings (key, value, updated_at)
+                VALUES (%s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (key) DO NOTHING
+            ''', (ROUNDS_SETTING, str(calibrated)))
+            settings.bump()
+            logger.info(f"Calibrated bcrypt cost factor: {calibrated}")
+        except Exception as e:
+            logger.warning(f"Could not save calibrated bcrypt cost: {e}")
+        rounds = calibrated
+
+    password_hasher.configure(
+        workers=app.config['PASSWORD_POOL_WORKERS'],
+        max_queue=app.config['PASSWORD_POOL_MAX_QUEUE'],
+        timeout=app.config['PASSWORD_POOL_TIMEOUT'],
+        rounds=rounds or 12,
+        # An explicit BCRYPT_ROUNDS is not overridden by the admin setting
+        settings=settings if app.config['BCRYPT_ROUNDS'] is None else None,
+    )
+    password_hasher.start()
+    atexit.register(password_hasher.shutdown)
@@ -0,0 +1,150 @@
+import os
+import sys
+import time
+import random
+import logging
+import cProfile
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ('sample', 'cprofile')
+
+
+class StackSampler:
+    """
+    Sampling profiler for a single thread
+
+    Periodically captures the target thread's stack and counts identical
+    stacks. Output uses the folded format understood by flamegraph.pl,
+    speedscope and inferno.
+    """
+
+    def __init__(self, thread_id, interval=0.002):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+def init_profiling(app, settings):
+    """
+    Profile individual requests on demand
+
+    A logged-in admin can profile any request by sending an X-Profile header
+    ('sample' or 'cprofile'). Admin settings can also profile a random
+    fraction of traffic: profileSampleRate (0-1), optionally restricted to
+    the comma-separated endpoints in profileEndpoints.
+    """
+    from flask import g, request, session
+
+    profile_dir = app.config['PROFILE_DIR']
+    default_mode = app.config['PROFILE_MODE']
+    sample_interval = app.config['PROFILE_SAMPLE_INTERVAL']
+
+    def requested_mode():
+        header = request.headers.get('X-Profile')
+        if header and 'admin_logged_in' in session:
+            return header if header in PROFILE_MODES else default_mode
+
+        try:
+            rate = float(settings.get('profileSampleRate', 0) or 0)
+        except ValueError:
+            return None
+        if rate <= 0:
+            return None
+
+        endpoints = settings.get('profileEndpoints', '')
+        if endpoints and request.endpoint not in [e.strip() for e in endpoints.split(',')]:
+            return None
+
+        return default_mode if random.random() < rate else None
+
+    @app.before_request
+    def start_profiler():
+        mode = requested_mode()
+        if mode is None:
+            return
+
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = StackSampler(threading.get_ident(), sample_interval)
+            profiler.start()
+
+        g.profiler = (mode, profiler, time.perf_counter())
+
+    @app.after_request
+    def add_profile_header(response):
+        if g.get('profiler') is not None:
+            g.profile_file = _profile_filename(profile_dir, request.endpoint, g.profiler[0])
+            response.headers['X-Profile-File'] = os.path.basename(g.profile_file)
+        return response
+
+    @app.teardown_request
+    def stop_profiler(exc):
+        profiler_state = g.pop('profiler', None)
+        if profiler_state is None:
+            return
+
+        mode, profiler, start = profiler_state
+        if mode == 'cprofile':
+            profiler.disable()
+        else:
+            profiler.stop()
+
+        path = g.pop('profile_file', None) or _profile_filename(profile_dir, request.endpoint, mode)
+        try:
+            os.makedirs(profile_dir, exist_ok=True)
+            if mode == 'cprofile':
+                profiler.dump_stats(path)
+            else:
+                profiler.write(path)
+            logger.info(
+                f"Profiled {request.method} {request.path} -> {path}",
+                extra={'fields': {
+                    'profile_file': path,
+                    'profile_mode': mode,
+                    'duration_ms': round((time.perf_counter() - start) * 1000, 2),
+                }}
+            )
+        except OSError as e:
+            logger.warning(f"Profile write error: {e}")
+
+
+def _profile_filename(profile_dir, endpoint, mode):
+    """logs/profiles/<timestamp>_<endpoint>_<pid>.<prof|folded>"""
+    ext = 'prof' if mode == 'cprofile' else 'folded'
+    timestamp = time.strftime('%Y%m%d_%H%M%S')
+    name = (endpoint or 'unknown').replace('.', '_')
+    return os.path.join(profile_dir, f'{timestamp}_{name}_{os.getpid()}_{random.randrange(16 ** 4):04x}.{ext}')
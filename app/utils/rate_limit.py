@@ -0,0 +1,192 @@
+import time
+import math
+import logging
+import threading
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBucketStore:
+    """Token buckets in process memory (per worker)"""
+
+    def __init__(self, max_keys=100000, max_idle=3600):
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.max_keys = max_keys
+        self.max_idle = max_idle
+
+    def take(self, key, capacity, refill_rate, now=None):
+        """
+        Take one token from a bucket
+        Returns (allowed, retry_after_seconds)
+        """
+        now = now or time.time()
+        with self.lock:
+            tokens, updated_at = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * refill_rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self._cleanup(now)
+        return allowed, 0 if allowed else (1 - tokens) / refill_rate
+
+    def reset(self, key):
+        with self.lock:
+            self.buckets.pop(key, None)
+
+    def _cleanup(self, now):
+        """Drop idle buckets (long refilled, so equal to a missing bucket)"""
+        for key in [k for k, (_, ts) in self.buckets.items() if now - ts > self.max_idle]:
+            del self.buckets[key]
+
+
+class DatabaseBucketStore:
+    """Token buckets in a database table, shared by every worker and node"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def take(self, key, capacity, refill_rate, now=None):
+        now = now or time.time()
+        refilled = '(tokens + (%s - updated_at) * %s)'
+
+        # Refill and take in one statement so concurrent workers can't both take the last token
+        taken = self.db.execute_update(f'''
+            UPDATE rate_limits
+            SET tokens = CASE WHEN {refilled} > %s THEN %s ELSE {refilled} END - 1,
+                updated_at = %s
+            WHERE key = %s AND {refilled} >= 1
+        ''', (now, refill_rate, capacity, capacity, now, refill_rate, now, key, now, refill_rate))
+        if taken:
+            return True, 0
+
+        created = self.db.execute_update('''
+            INSERT INTO rate_limits (key, tokens, updated_at)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (key) DO NOTHING
+        ''', (key, capacity - 1, now))
+        if created:
+            return True, 0
+
+        rows = self.db.execute_query('SELECT tokens, updated_at FROM rate_limits WHERE key = %s', (key,))
+        if not rows:
+            return True, 0
+        tokens = rows[0]['tokens'] + (now - rows[0]['updated_at']) * refill_rate
+        return False, max(0, (1 - tokens) / refill_rate)
+
+    def reset(self, key):
+        self.db.execute_update('DELETE FROM rate_limits WHERE key = %s', (key,))
+
+
+class RedisBucketStore:
+    """Token buckets in Redis, shared by every worker and node"""
+
+    # Atomic refill-and-take; returns {allowed, tokens}
+    TAKE_SCRIPT = '''
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+        local capacity = tonumber(ARGV[1])
+        local rate = tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+        local tokens = tonumber(bucket[1]) or capacity
+        local updated_at = tonumber(bucket[2]) or now
+        tokens = math.min(capacity, tokens + (now - updated_at) * rate)
+        local allowed = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+            allowed = 1
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+        return {allowed, tostring(tokens)}
+    '''
+
+    def __init__(self, redis_url):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("redis is required for the Redis rate limit backend. Install it with: pip install redis")
+        self.client = redis.Redis.from_url(redis_url)
+        self.take_script = self.client.register_script(self.TAKE_SCRIPT)
+
+    def take(self, key, capacity, refill_rate, now=None):
+        allowed, tokens = self.take_script(
+            keys=[f'ratelimit:{key}'],
+            args=[capacity, refill_rate, now or time.time()]
+        )
+        if allowed:
+            return True, 0
+        return False, max(0, (1 - float(tokens)) / refill_rate)
+
+    def reset(self, key):
+        self.client.delete(f'ratelimit:{key}')
+
+
+def create_bucket_store(app, db):
+    """Bucket store selected by RATE_LIMIT_BACKEND (memory, database or redis)"""
+    backend = app.config['RATE_LIMIT_BACKEND']
+    if backend == 'database':
+        return DatabaseBucketStore(db)
+    if backend == 'redis':
+        return RedisBucketStore(app.config['RATE_LIMIT_REDIS_URL'])
+    return MemoryBucketStore()
+
+
+def login_throttled(scope, account_field):
+    """
+    Decorator for login handlers: token buckets per client IP and per account
+    (the JSON field account_field) are checked before the handler runs, so a
+    throttled attempt never reaches bcrypt. A successful login refills the
+    account's bucket. Handlers sharing a scope share buckets.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            from flask import current_app, request, jsonify
+
+            if request.method != 'POST':
+                return f(*args, **kwargs)
+
+            store = current_app.rate_limits
+            limits = current_app.config['LOGIN_RATE_LIMITS']
+            data = request.get_json(silent=True) or {}
+            account = str(data.get(account_field, '')).strip().lower()
+
+            checks = [('ip', request.remote_addr or 'unknown')]
+            if account:
+                checks.append(('account', account))
+
+            for kind, value in checks:
+                capacity, period = limits[kind]
+                try:
+                    allowed, retry_after = store.take(f'{scope}:{kind}:{value}', capacity, capacity / period)
+                except Exception as e:
+                    # Fail open: a broken limiter must not lock everyone out
+                    logger.warning(f"Rate limit check error: {e}")
+                    continue
+                if not allowed:
+                    retry_after = max(1, math.ceil(retry_after))
+                    logger.warning(
+                        f"Login throttled ({kind}) for {value}",
+                        extra={'fields': {'throttle': kind, 'endpoint': scope, 'retry_after': retry_after}}
+                    )
+                    response = jsonify({
+                        'error': f'พยายามเข้าสู่ระบบบ่อยเกินไป กรุณาลองใหม่ใน {retry_after} วินาที'
+                    })
+                    response.status_code = 429
+                    response.headers['Retry-After'] = str(retry_after)
+                    return response
+
+            response = f(*args, **kwargs)
+
+            status = response[1] if isinstance(response, tuple) else getattr(response, 'status_code', 200)
+            if account and status == 200:
+                try:
+                    store.reset(f'{scope}:account:{account}')
+                except Exception as e:
+                    logger.warning(f"Rate limit reset error: {e}")
+            return response
+        return decorated_function
+    return decorator
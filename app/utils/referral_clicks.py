@@ -0,0 +1,252 @@
+import hmac
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Cookie marking a browser whose click on a code was already counted
+REF_COOKIE = 'budtboy_ref'
+
+UTM_FIELDS = ('utm_source', 'utm_medium', 'utm_campaign')
+
+# Clicks kept in memory while the database is unreachable; older ones are dropped
+MAX_BUFFERED = 10000
+
+# referrals.status as a link moves along
+CLICKED = 'pending'
+SIGNED_UP = 'signed_up'
+CONVERTED = 'converted'
+
+
+def visitor_hash(secret, value):
+    """Keyed hash of an IP or user agent, so the raw value is never stored"""
+    return hmac.new(secret.encode(), (value or '').encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def visitor_hashes(request, secret):
+    """
+    (ip_hash, user_agent_hash) of the client making a request
+
+    remote_addr is the client's address only once create_app() has applied
+    ProxyFix (TRUSTED_PROXY_HOPS); with the proxy's address every visitor
+    would share one ip_hash, merging their clicks and signups.
+    """
+    return (
+        visitor_hash(secret, request.remote_addr),
+        visitor_hash(secret, request.headers.get('User-Agent')),
+    )
+
+
+class ClickBuffer:
+    """
+    Per-process buffer of referral link clicks
+
+    record() only touches memory: a repeat click (same code, IP and user
+    agent within dedupe_window seconds) is dropped and the rest queued.
+    Queued clicks are written by flush() in one executemany INSERT ...
+    SELECT that resolves each code to its referrer; unknown codes insert
+    nothing. A background thread flushes every interval seconds, or as soon
+    as batch_size clicks are waiting.
+    """
+
+    def __init__(self, db, interval, batch_size, dedupe_window):
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self.dedupe_window = dedupe_window
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = []
+        self.seen = {}
+        self.dropped = 0
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def record(self, code, ip_hash, user_agent_hash, utm=None):
+        """Queue a click; returns False if it repeats one inside the dedupe window"""
+        now = time.time()
+        key = (code, ip_hash, user_agent_hash)
+        utm = utm or {}
+        with self.lock:
+            last = self.seen.get(key)
+            if last is not None and now - last < self.dedupe_window:
+                return False
+            self.seen[key] = now
+            self.pending.append((
+                code, datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                *(utm.get(field) for field in UTM_FIELDS), ip_hash, user_agent_hash,
+            ))
+            full = len(self.pending) >= self.batch_size
+
+        if full:
+            if self.thread is not None:
+                self.wake.set()
+            else:
+                self.flush()
+        return True
+
+    def flush(self):
+        """Write queued clicks; returns how many were flushed"""
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+                cutoff = time.time() - self.dedupe_window
+                self.seen = {key: at for key, at in self.seen.items() if at >= cutoff}
+            if not batch:
+                return 0
+
+            try:
+                self.db.execute_many(f'''
+                    INSERT INTO referrals (
+                        referrer_user_id, referral_code_used, status, first_seen_at,
+                        utm_source, utm_medium, utm_campaign, ip_hash, user_agent_hash
+                    )
+                    SELECT u.id, u.referral_code, '{CLICKED}', %s, %s, %s, %s, %s, %s
+                    FROM users u WHERE u.referral_code = %s
+                ''', [(*click[1:], click[0]) for click in batch])
+            except Exception:
+                # Put the batch back (in front of newer clicks) up to MAX_BUFFERED
+                with self.lock:
+                    self.pending = batch + self.pending
+                    overflow = len(self.pending) - MAX_BUFFERED
+                    if overflow > 0:
+                        del self.pending[:overflow]
+                        self.dropped += overflow
+                raise
+            return len(batch)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='referral-clicks', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Referral click flush failed")
+
+
+def attribute_signup(db, clicks, user_id, referrer_id, code, ip_hash, user_agent_hash, window_days):
+    """
+    Credit a signup to the visitor's latest click on the referrer's link
+
+    This worker's buffer is flushed first so a click made seconds earlier is
+    matched. Without a click in the last window_days (the code was typed in,
+    or the click is still in another worker's buffer) a signup row is
+    inserted instead, so every referred signup has exactly one row.
+    """
+    clicks.flush()
+    since = (datetime.utcnow() - timedelta(days=window_days)).strftime('%Y-%m-%d %H:%M:%S')
+    updated = db.execute_update(f'''
+        UPDATE referrals
+        SET referred_user_id = %s, signed_up_at = CURRENT_TIMESTAMP, status = '{SIGNED_UP}'
+        WHERE id = (
+            SELECT id FROM referrals
+            WHERE referrer_user_id = %s AND ip_hash = %s AND user_agent_hash = %s
+              AND referred_user_id IS NULL AND first_seen_at >= %s
+            ORDER BY first_seen_at DESC, id DESC
+            LIMIT 1
+        )
+    ''', (user_id, referrer_id, ip_hash, user_agent_hash, since))
+    if not updated:
+        db.execute_update(f'''
+            INSERT INTO referrals (
+                referrer_user_id, referred_user_id, referral_code_used, status,
+                first_seen_at, signed_up_at, ip_hash, user_agent_hash
+            )
+            VALUES (%s, %s, %s, '{SIGNED_UP}', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, %s, %s)
+        ''', (referrer_id, user_id, code, ip_hash, user_agent_hash))
+
+
+def track_click(response, code):
+    """
+    Count a referral link click and mark the browser so repeats aren't
+
+    Only the in-memory buffer is touched. The cookie catches repeat clicks
+    served by other workers; the buffer's hash window catches clients that
+    drop cookies.
+    """
+    from flask import current_app, request
+
+    if not code or request.cookies.get(REF_COOKIE) == code:
+        return response
+    ip_hash, user_agent_hash = visitor_hashes(request, current_app.config['SECRET_KEY'])
+    utm = {field: (request.args.get(field) or '')[:100] or None for field in UTM_FIELDS}
+    current_app.referral_clicks.record(code[:64], ip_hash, user_agent_hash, utm)
+    response.set_cookie(
+        REF_COOKIE, code[:64], max_age=current_app.config['REFERRAL_CLICK_DEDUPE_WINDOW'],
+        httponly=True, samesite='Lax'
+    )
+    return response
+
+
+def attribute_request_signup(db, user_id, referrer_id, code):
+    """attribute_signup() for the client of the current request; errors are logged, not raised"""
+    from flask import current_app, request
+
+    try:
+        attribute_signup(
+            db, current_app.referral_clicks, user_id, referrer_id, code,
+            *visitor_hashes(request, current_app.config['SECRET_KEY']),
+            current_app.config['REFERRAL_ATTRIBUTION_DAYS']
+        )
+    except Exception:
+        logger.exception(f"Referral attribution failed for user {user_id}")
+
+
+def mark_converted(db, user_id):
+    """The referrer approved the user; their signup row becomes a conversion"""
+    db.execute_update(f'''
+        UPDATE referrals SET status = '{CONVERTED}', converted_at = CURRENT_TIMESTAMP
+        WHERE referred_user_id = %s AND converted_at IS NULL
+    ''', (user_id,))
+
+
+def click_stats(db, referrer_id):
+    """{'clicks', 'signups', 'converted'} for one referrer's link (signups without a click count as one)"""
+    rows = db.execute_query('''
+        SELECT
+            COUNT(*) AS clicks,
+            COUNT(referred_user_id) AS signups,
+            COUNT(converted_at) AS converted
+        FROM referrals
+        WHERE referrer_user_id = %s
+    ''', (referrer_id,))
+    return dict(rows[0])
+
+
+def init_referral_clicks(app, db):
+    """
+    Create the click buffer (flushed every REFERRAL_CLICK_FLUSH_INTERVAL seconds)
+
+    With the interval at 0, or under testing, there is no thread and
+    clicks are written once REFERRAL_CLICK_BATCH_SIZE are waiting (or on
+    flush()). Queued clicks are flushed at exit.
+    """
+    import atexit
+
+    interval = app.config['REFERRAL_CLICK_FLUSH_INTERVAL']
+    clicks = ClickBuffer(
+        db, interval,
+        app.config['REFERRAL_CLICK_BATCH_SIZE'],
+        app.config['REFERRAL_CLICK_DEDUPE_WINDOW'],
+    )
+    if interval and not app.testing:
+        clicks.start()
+    atexit.register(clicks.stop)
+    app.referral_clicks = clicks
+    return clicks
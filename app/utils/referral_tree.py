@@ -0,0 +1,202 @@
+# Deepest level the analytics queries accept (and the rebuild follows)
+MAX_DEPTH = 10
+
+REFERRAL_CACHE_PREFIX = 'referral_tree_'
+
+# pg_advisory_xact_lock key serializing changes to the tree on PostgreSQL
+TREE_LOCK_KEY = 0x52454654
+
+
+class ReferralCycle(Exception):
+    """The referrer is the user or somewhere in the user's downline"""
+
+
+def lock_tree(tx):
+    """
+    Serialize changes to the tree until the transaction ends
+
+    SQLite transactions already hold the write lock (BEGIN IMMEDIATE); on
+    PostgreSQL a transaction-scoped advisory lock does the same, so two
+    crossing links can't both pass the cycle check.
+    """
+    if tx.db.db_type == 'postgresql':
+        tx.execute_query('SELECT pg_advisory_xact_lock(%s)', (TREE_LOCK_KEY,))
+
+
+def link_referral(tx, user_id, referrer_id):
+    """
+    Record that referrer_id referred user_id (inside a db.transaction())
+
+    Every ancestor of the referrer (and the referrer) becomes an ancestor of
+    the user and the user's existing downline, in one INSERT ... SELECT.
+    Raises ReferralCycle instead of creating a loop.
+    """
+    lock_tree(tx)
+    if would_cycle(tx, user_id, referrer_id):
+        raise ReferralCycle()
+
+    tx.execute_update('''
+        INSERT INTO referral_closure (ancestor_id, descendant_id, depth)
+        SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1
+        FROM (
+            SELECT ancestor_id, depth FROM referral_closure WHERE descendant_id = %s
+            UNION ALL SELECT %s, 0
+        ) a
+        CROSS JOIN (
+            SELECT descendant_id, depth FROM referral_closure WHERE ancestor_id = %s
+            UNION ALL SELECT %s, 0
+        ) d
+        WHERE TRUE
+        ON CONFLICT (ancestor_id, descendant_id) DO NOTHING
+    ''', (referrer_id, referrer_id, user_id, user_id))
+
+
+def would_cycle(db, user_id, referrer_id):
+    """True if referrer_id can't become user_id's referrer"""
+    return user_id == referrer_id or bool(db.execute_query(
+        'SELECT 1 FROM referral_closure WHERE ancestor_id = %s AND descendant_id = %s',
+        (user_id, referrer_id)
+    ))
+
+
+def unlink_user(tx, user_id):
+    """
+    Remove a user from the tree (inside the transaction deleting them)
+
+    The user's downline is cut off from the user's ancestors, as happens to
+    users.referred_by when a referrer is deleted.
+    """
+    lock_tree(tx)
+    tx.execute_update('''
+        DELETE FROM referral_closure
+        WHERE descendant_id IN (SELECT descendant_id FROM referral_closure WHERE ancestor_id = %s)
+          AND ancestor_id IN (SELECT ancestor_id FROM referral_closure WHERE descendant_id = %s)
+    ''', (user_id, user_id))
+    tx.execute_update(
+        'DELETE FROM referral_closure WHERE ancestor_id = %s OR descendant_id = %s',
+        (user_id, user_id)
+    )
+
+
+def rebuild_closure(db, if_empty=False):
+    """
+    Recompute the whole table from users.referred_by
+
+    Chains are followed MAX_DEPTH * 5 levels up, which also stops any loop
+    already in the data. Returns the number of rows written, or None when
+    if_empty is set and the table already has rows.
+    """
+    with db.transaction() as tx:
+        lock_tree(tx)
+        if if_empty and tx.execute_query('SELECT 1 FROM referral_closure LIMIT 1'):
+            return None
+        tx.execute_update('DELETE FROM referral_closure')
+        return tx.execute_update('''
+            INSERT INTO referral_closure (ancestor_id, descendant_id, depth)
+            WITH RECURSIVE chain (ancestor_id, descendant_id, depth) AS (
+                SELECT referred_by, id, 1 FROM users WHERE referred_by IS NOT NULL
+                UNION ALL
+                SELECT u.referred_by, c.descendant_id, c.depth + 1
+                FROM chain c
+                JOIN users u ON u.id = c.ancestor_id
+                WHERE u.referred_by IS NOT NULL AND c.depth < %s
+            )
+            SELECT ancestor_id, descendant_id, MIN(depth) FROM chain
+            WHERE ancestor_id <> descendant_id
+            GROUP BY ancestor_id, descendant_id
+        ''', (MAX_DEPTH * 5,))
+
+
+def downline_by_depth(db, user_id, max_depth=MAX_DEPTH):
+    """[{'depth', 'users', 'converted'}] for each level under a user"""
+    rows = db.execute_query('''
+        SELECT
+            c.depth,
+            COUNT(*) AS users,
+            SUM(CASE WHEN u.referrer_approved THEN 1 ELSE 0 END) AS converted
+        FROM referral_closure c
+        JOIN users u ON u.id = c.descendant_id
+        WHERE c.ancestor_id = %s AND c.depth <= %s
+        GROUP BY c.depth
+        ORDER BY c.depth
+    ''', (user_id, max_depth))
+    return [dict(row) for row in rows]
+
+
+def branch_conversion(db, user_id, max_depth=MAX_DEPTH):
+    """
+    Size and conversion rate of the branch under each direct referral
+
+    A branch is the direct referral plus their downline up to max_depth
+    levels below user_id. Conversion means the referrer approved the user.
+    """
+    rows = db.execute_query('''
+        SELECT
+            b.descendant_id AS branch_id,
+            ru.username,
+            ru.referrer_approved AS root_converted,
+            COUNT(m.descendant_id) AS downline,
+            SUM(CASE WHEN mu.referrer_approved THEN 1 ELSE 0 END) AS downline_converted
+        FROM referral_closure b
+        JOIN users ru ON ru.id = b.descendant_id
+        LEFT JOIN referral_closure m ON m.ancestor_id = b.descendant_id AND m.depth < %s
+        LEFT JOIN users mu ON mu.id = m.descendant_id
+        WHERE b.ancestor_id = %s AND b.depth = 1
+        GROUP BY b.descendant_id, ru.username, ru.referrer_approved
+    ''', (max_depth, user_id))
+
+    branches = []
+    for row in rows:
+        users = 1 + row['downline']
+        converted = (1 if row['root_converted'] else 0) + (row['downline_converted'] or 0)
+        branches.append({
+            'branch_id': row['branch_id'],
+            'username': row['username'],
+            'users': users,
+            'converted': converted,
+            'conversion_rate': round(converted / users, 3),
+        })
+    branches.sort(key=lambda b: (-b['users'], b['branch_id']))
+    return branches
+
+
+def top_referrers(db, limit=20, max_depth=MAX_DEPTH):
+    """Users with the largest downlines, with direct and converted counts"""
+    rows = db.execute_query('''
+        SELECT
+            c.ancestor_id AS user_id,
+            u.username,
+            COUNT(*) AS downline,
+            SUM(CASE WHEN c.depth = 1 THEN 1 ELSE 0 END) AS direct,
+            SUM(CASE WHEN d.referrer_approved THEN 1 ELSE 0 END) AS converted,
+            MAX(c.depth) AS max_depth
+        FROM referral_closure c
+        JOIN users u ON u.id = c.ancestor_id
+        JOIN users d ON d.id = c.descendant_id
+        WHERE c.depth <= %s
+        GROUP BY c.ancestor_id, u.username
+        ORDER BY downline DESC, c.ancestor_id
+        LIMIT %s
+    ''', (max_depth, limit))
+    return [dict(row) for row in rows]
+
+
+def invalidate_referral_cache(cache):
+    """Drop cached referral analytics (a link changes counts all the way up the tree)"""
+    cache.clear_pattern(REFERRAL_CACHE_PREFIX)
+
+
+def init_referral_tree(app, db):
+    """
+    Build the closure table from users.referred_by the first time the app starts with it empty
+
+    Workers starting together queue on the tree lock; the first one builds
+    the table and the others find it filled and skip.
+    """
+    if db.execute_query('SELECT 1 FROM referral_closure LIMIT 1'):
+        return
+    if not db.execute_query('SELECT 1 FROM users WHERE referred_by IS NOT NULL LIMIT 1'):
+        return
+    written = rebuild_closure(db, if_empty=True)
+    if written is not None:
+        app.logger.info(f'Referral closure table built ({written} rows)')
@@ -0,0 +1,82 @@
+class RegistrationError(Exception):
+    """A registration that was refused (the transaction is rolled back)"""
+
+
+class ActivityFull(RegistrationError):
+    """No registration slot left"""
+
+
+class AlreadyJoined(RegistrationError):
+    """The user already has an entry in the activity"""
+
+
+def activity_is_full(db, activity):
+    """
+    Cheap read-only check against the slot counter
+
+    Lets a launch spike be turned away without taking a write lock once the
+    activity has filled up. register_participant() is still authoritative.
+    """
+    max_participants = activity.get('max_participants') or 0
+    if max_participants <= 0:
+        return False
+    slots = db.execute_query('SELECT taken FROM activity_slots WHERE activity_id = %s', (activity['id'],))
+    return bool(slots) and slots[0]['taken'] >= max_participants
+
+
+def register_participant(db, activity, user_id, bud_id, submission_description=''):
+    """
+    Atomically claim a slot and insert the participant
+
+    The activity_slots row is the guard: the conditional UPDATE only
+    succeeds while taken < max_participants, and it locks the row (or the
+    database on SQLite) until commit, so concurrent registrations for the
+    same activity are serialized at that one statement and the cap can't
+    be overshot. The participant insert is skipped if the user already
+    joined, which rolls the claimed slot back.
+
+    Raises ActivityFull or AlreadyJoined.
+    """
+    activity_id = activity['id']
+    max_participants = activity.get('max_participants') or 0
+
+    with db.transaction() as tx:
+        # Counter row is created on first registration from the current count
+        tx.execute_update('''
+            INSERT INTO activity_slots (activity_id, taken)
+            SELECT %s, COUNT(*) FROM activity_participants WHERE activity_id = %s
+            ON CONFLICT (activity_id) DO NOTHING
+        ''', (activity_id, activity_id))
+
+        claimed = tx.execute_update('''
+            UPDATE activity_slots SET taken = taken + 1
+            WHERE activity_id = %s AND (%s <= 0 OR taken < %s)
+        ''', (activity_id, max_participants, max_participants))
+        if not claimed:
+            raise ActivityFull()
+
+        inserted = tx.execute_update('''
+            INSERT INTO activity_participants (activity_id, user_id, bud_id, submission_description)
+            SELECT %s, %s, %s, %s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM activity_participants WHERE activity_id = %s AND user_id = %s
+            )
+        ''', (activity_id, user_id, bud_id, submission_description, activity_id, user_id))
+        if not inserted:
+            raise AlreadyJoined()
+
+
+def reset_slots(db, activity_ids=None):
+    """
+    Drop slot counters after participants are removed outside register_participant
+
+    The next registration rebuilds each counter from activity_participants.
+    With no ids every counter is dropped.
+    """
+    if activity_ids is None:
+        db.execute_update('DELETE FROM activity_slots')
+        return
+    activity_ids = list(activity_ids)
+    if activity_ids:
+        placeholders = ', '.join(['%s'] * len(activity_ids))
+        db.execute_update(f'DELETE FROM activity_slots WHERE activity_id IN ({placeholders})', tuple(activity_ids))
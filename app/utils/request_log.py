@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import traceback
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))
+                  + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.levelno >= logging.WARNING:
+            entry['where'] = f'{record.pathname}:{record.lineno}'
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RecordQueueHandler(QueueHandler):
+    """QueueHandler that keeps the traceback separate from the message"""
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        if record.exc_info:
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class SafeRotatingFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler that can be shared by several worker processes
+
+    Rollover is serialized with an advisory lock on a sidecar .lock file, and
+    each process reopens the log file when another process has rotated it.
+    """
+
+    def __init__(self, filename, *args, **kwargs):
+        super().__init__(filename, *args, **kwargs)
+        self.lock_file = open(self.baseFilename + '.lock', 'a')
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _reopen_if_rotated(self):
+        """Reopen the stream if the file on disk is no longer ours"""
+        if self.stream is not None:
+            try:
+                on_disk = os.stat(self.baseFilename)
+                current = os.fstat(self.stream.fileno())
+                if (on_disk.st_ino, on_disk.st_dev) == (current.st_ino, current.st_dev):
+                    return
+            except FileNotFoundError:
+                pass
+            self.stream.close()
+            self.stream = None
+        self.stream = self._open()
+
+    def emit(self, record):
+        try:
+            with self._file_lock():
+                self._reopen_if_rotated()
+                if self.shouldRollover(record):
+                    self.doRollover()
+                logging.FileHandler.emit(self, record)
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        super().close()
+        if not self.lock_file.closed:
+            self.lock_file.close()
+
+
+def init_logging(app):
+    """
+    Route app.logger and the access logger through a queue so request threads
+    never block on log I/O. A single listener thread writes JSON lines to disk.
+    """
+    log_file = app.config['LOG_FILE']
+    os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+
+    level = logging.DEBUG if app.config['DEBUG'] else logging.INFO
+
+    file_handler = SafeRotatingFileHandler(
+        log_file,
+        maxBytes=app.config['LOG_MAX_BYTES'],
+        backupCount=app.config['LOG_BACKUP_COUNT']
+    )
+    file_handler.setFormatter(JsonFormatter())
+    file_handler.setLevel(level)
+    handlers = [file_handler]
+
+    # Console handler for development
+    if app.config['DEBUG']:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+        console_handler.setLevel(logging.INFO)
+        handlers.append(console_handler)
+
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    def stop_listener():
+        # Flush queued records on shutdown (no-op if already stopped)
+        if listener._thread is not None:
+            listener.stop()
+
+    atexit.register(stop_listener)
+    app.log_listener = listener
+
+    queue_handler = RecordQueueHandler(log_queue)
+
+    # Flask adds its own stderr handler; the queue replaces it
+    app.logger.handlers = [queue_handler]
+    app.logger.setLevel(level)
+    app.logger.propagate = False
+
+    access_logger = logging.getLogger('budtboy.access')
+    access_logger.handlers = [queue_handler]
+    access_logger.setLevel(logging.INFO)
+    access_logger.propagate = False
+
+    # Module loggers in app.utils (profiling, jobs, pools) log to the same
+    # queue, whatever name Flask gave app.logger
+    utils_logger = logging.getLogger(__name__.rpartition('.')[0])
+    utils_logger.handlers = [queue_handler]
+    utils_logger.setLevel(level)
+    utils_logger.propagate = False
+
+
+def init_request_logging(app, db):
+    """Record one structured access log entry per request"""
+    from flask import g, request, session, has_request_context
+
+    access_logger = logging.getLogger('budtboy.access')
+    default_rate = app.config['ACCESS_LOG_SAMPLE_RATE']
+    sample_rates = app.config['ACCESS_LOG_SAMPLE_RATES']
+    slow_ms = app.config['ACCESS_LOG_SLOW_MS']
+
+    def record_db_time(elapsed):
+        if has_request_context():
+            g.db_time = g.get('db_time', 0.0) + elapsed
+            g.db_count = g.get('db_count', 0) + 1
+
+    db.query_observers.append(record_db_time)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        g.db_time = 0.0
+        g.db_count = 0
+
+    @app.after_request
+    def log_request(response):
+        start = g.get('request_start')
+        if start is None:
+            return response
+
+        duration_ms = (time.perf_counter() - start) * 1000
+        status = response.status_code
+
+        # Errors and slow requests are always logged, the rest is sampled
+        rate = sample_rates.get(request.endpoint, default_rate)
+        if status < 500 and duration_ms < slow_ms and rate < 1.0 and random.random() >= rate:
+            return response
+
+        access_logger.info(
+            f'{request.method} {request.path} {status}',
+            extra={'fields': {
+                'method': request.method,
+                'path': request.path,
+                'endpoint': request.endpoint,
+                'status': status,
+                'duration_ms': round(duration_ms, 2),
+                'db_ms': round(g.get('db_time', 0.0) * 1000, 2),
+                'db_queries': g.get('db_count', 0),
+                'user_id': session.get('user_id'),
+                'admin_id': session.get('admin_id'),
+                'ip': request.remote_addr,
+                'sample_rate': rate,
+            }}
+        )
+        return response
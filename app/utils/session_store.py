@@ -0,0 +1,411 @@
+import json
+import time
+import random
+import secrets
+import logging
+import threading
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+logger = logging.getLogger(__name__)
+
+# Session keys that carry identity or privilege; changing any of them rotates the session id
+AUTH_KEYS = ('user_id', 'admin_logged_in', 'admin_id', 'admin_name')
+
+# Columns cached in the principal (kept small - it travels with every session load)
+PRINCIPAL_COLUMNS = 'id, username, email, profile_image_url, referral_code, referred_by, referrer_approved, is_approved'
+
+
+class MemorySessionStore:
+    """Sessions in process memory (single worker only)"""
+
+    def __init__(self):
+        self.sessions = {}  # sid -> [data, principal, user_id, expires_at]
+        self.lock = threading.Lock()
+
+    def load(self, sid):
+        """Returns (data, principal, expires_at) or None"""
+        with self.lock:
+            record = self.sessions.get(sid)
+            if record is None:
+                return None
+            if record[3] < time.time():
+                del self.sessions[sid]
+                return None
+            return record[0], record[1], record[3]
+
+    def save(self, sid, data, user_id, principal, expires_at):
+        with self.lock:
+            self.sessions[sid] = [data, principal, user_id, expires_at]
+            if random.random() < 0.01:
+                self._cleanup()
+
+    def save_principal(self, sid, principal):
+        with self.lock:
+            if sid in self.sessions:
+                self.sessions[sid][1] = principal
+
+    def delete(self, sid):
+        with self.lock:
+            self.sessions.pop(sid, None)
+
+    def invalidate_principal(self, user_id):
+        with self.lock:
+            for record in self.sessions.values():
+                if record[2] == user_id:
+                    record[1] = None
+
+    def revoke_user(self, user_id):
+        with self.lock:
+            for sid in [sid for sid, record in self.sessions.items() if record[2] == user_id]:
+                del self.sessions[sid]
+
+    def _cleanup(self):
+        now = time.time()
+        for sid in [sid for sid, record in self.sessions.items() if record[3] < now]:
+            del self.sessions[sid]
+
+
+class DatabaseSessionStore:
+    """Sessions in the sessions table (SQLite or PostgreSQL), shared by every worker"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def load(self, sid):
+        rows = self.db.execute_query(
+            'SELECT data, principal, expires_at FROM sessions WHERE id = %s AND expires_at > %s',
+            (sid, time.time())
+        )
+        if not rows:
+            return None
+        principal = json.loads(rows[0]['principal']) if rows[0]['principal'] else None
+        return rows[0]['data'], principal, rows[0]['expires_at']
+
+    def save(self, sid, data, user_id, principal, expires_at):
+        self.db.execute_update('''
+            INSERT INTO sessions (id, user_id, data, principal, expires_at)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (id) DO UPDATE SET
+                user_id = excluded.user_id,
+                data = excluded.data,
+                principal = excluded.principal,
+                expires_at = excluded.expires_at
+        ''', (sid, user_id, data, json.dumps(principal) if principal else None, expires_at))
+        if random.random() < 0.01:
+            self.db.execute_update('DELETE FROM sessions WHERE expires_at < %s', (time.time(),))
+
+    def save_principal(self, sid, principal):
+        self.db.execute_update(
+            'UPDATE sessions SET principal = %s WHERE id = %s',
+            (json.dumps(principal), sid)
+        )
+
+    def delete(self, sid):
+        self.db.execute_update('DELETE FROM sessions WHERE id = %s', (sid,))
+
+    def invalidate_principal(self, user_id):
+        self.db.execute_update('UPDATE sessions SET principal = NULL WHERE user_id = %s', (user_id,))
+
+    def revoke_user(self, user_id):
+        self.db.execute_update('DELETE FROM sessions WHERE user_id = %s', (user_id,))
+
+
+class CachedSessionStore:
+    """
+    Per-process read cache in front of another store
+
+    A session loaded in the last ttl seconds is served from memory, so a
+    page and the API calls it makes cost one store read. Writes go to the
+    store and refresh the local copy. Another worker's logout, revocation
+    or principal invalidation reaches this worker within ttl seconds.
+    """
+
+    MAX_ENTRIES = 10000
+
+    def __init__(self, store, ttl):
+        self.store = store
+        self.ttl = ttl
+        self.records = {}  # sid -> (record, cached_until)
+        self.lock = threading.Lock()
+
+    def load(self, sid):
+        now = time.time()
+        with self.lock:
+            cached = self.records.get(sid)
+        if cached is not None and cached[1] > now and (cached[0] is None or cached[0][2] > now):
+            return cached[0]
+        record = self.store.load(sid)
+        self._put(sid, record)
+        return record
+
+    def save(self, sid, data, user_id, principal, expires_at):
+        self.store.save(sid, data, user_id, principal, expires_at)
+        self._put(sid, (data, principal, expires_at))
+
+    def save_principal(self, sid, principal):
+        self.store.save_principal(sid, principal)
+        with self.lock:
+            cached = self.records.get(sid)
+            if cached is not None and cached[0] is not None:
+                self.records[sid] = ((cached[0][0], principal, cached[0][2]), cached[1])
+
+    def delete(self, sid):
+        with self.lock:
+            self.records.pop(sid, None)
+        self.store.delete(sid)
+
+    def invalidate_principal(self, user_id):
+        # Cached records don't carry their user id; these are rare, so drop them all
+        with self.lock:
+            self.records.clear()
+        self.store.invalidate_principal(user_id)
+
+    def revoke_user(self, user_id):
+        with self.lock:
+            self.records.clear()
+        self.store.revoke_user(user_id)
+
+    def _put(self, sid, record):
+        now = time.time()
+        with self.lock:
+            if len(self.records) >= self.MAX_ENTRIES:
+                self.records = {k: v for k, v in self.records.items() if v[1] > now}
+                if len(self.records) >= self.MAX_ENTRIES:
+                    self.records.clear()
+            self.records[sid] = (record, now + self.ttl)
+
+
+class RedisSessionStore:
+    """Sessions in Redis hashes, shared by every worker and node"""
+
+    def __init__(self, redis_url):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("redis is required for the Redis session backend. Install it with: pip install redis")
+        self.client = redis.Redis.from_url(redis_url, decode_responses=True)
+
+    def load(self, sid):
+        record = self.client.hgetall(f'session:{sid}')
+        if not record:
+            return None
+        principal = json.loads(record['principal']) if record.get('principal') else None
+        return record['data'], principal, float(record['expires_at'])
+
+    def save(self, sid, data, user_id, principal, expires_at):
+        key = f'session:{sid}'
+        ttl = max(1, int(expires_at - time.time()))
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping={
+            'data': data,
+            'principal': json.dumps(principal) if principal else '',
+            'user_id': user_id or '',
+            'expires_at': expires_at,
+        })
+        pipe.expire(key, ttl)
+        if user_id:
+            pipe.sadd(f'user_sessions:{user_id}', sid)
+            pipe.expire(f'user_sessions:{user_id}', ttl)
+        pipe.execute()
+
+    def save_principal(self, sid, principal):
+        key = f'session:{sid}'
+        if self.client.exists(key):
+            self.client.hset(key, 'principal', json.dumps(principal))
+
+    def delete(self, sid):
+        self.client.delete(f'session:{sid}')
+
+    def invalidate_principal(self, user_id):
+        sids = self.client.smembers(f'user_sessions:{user_id}')
+        if sids:
+            pipe = self.client.pipeline()
+            for sid in sids:
+                pipe.hdel(f'session:{sid}', 'principal')
+            pipe.execute()
+
+    def revoke_user(self, user_id):
+        sids = self.client.smembers(f'user_sessions:{user_id}')
+        self.client.delete(f'user_sessions:{user_id}', *[f'session:{sid}' for sid in sids])
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session whose data lives in a store; the cookie only carries the id"""
+
+    def __init__(self, initial=None, sid=None, principal=None, expires_at=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.principal = principal
+        self.principal_changed = False
+        self.expires_at = expires_at
+        self.new = new
+        self.modified = False
+        self.loaded_auth = self.auth_state()
+
+    def auth_state(self):
+        return tuple(self.get(key) for key in AUTH_KEYS)
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface backed by a session store"""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, skip_paths=()):
+        self.store = store
+        self.skip_paths = tuple(skip_paths)
+
+    def open_session(self, app, request):
+        if self.skip_paths and request.path.startswith(self.skip_paths):
+            # Static files and uploads never need the session; sid=None is never saved
+            return ServerSideSession(new=True)
+
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            try:
+                record = self.store.load(sid)
+            except Exception as e:
+                logger.warning(f"Session load error: {e}")
+                record = None
+            if record is not None:
+                data, principal, expires_at = record
+                return ServerSideSession(self.serializer.loads(data), sid, principal, expires_at)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.sid is None:
+            return
+
+        if not session:
+            # Cleared (logout): drop the stored session and the cookie
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # New identity or privilege (login, admin login, switch): issue a fresh
+        # id so a cookie planted or captured before it can't ride along
+        if not session.new and session.auth_state() != session.loaded_auth:
+            self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+            session.modified = True
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        refresh = session.expires_at is None or session.expires_at - now < lifetime / 2
+        if not (session.modified or refresh):
+            if session.principal_changed:
+                self.store.save_principal(session.sid, session.principal)
+            return
+
+        if session.principal and session.principal.get('id') != session.get('user_id'):
+            session.principal = None
+        session.expires_at = now + lifetime
+        self.store.save(
+            session.sid,
+            self.serializer.dumps(dict(session)),
+            session.get('user_id'),
+            session.principal,
+            session.expires_at,
+        )
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+        response.vary.add('Cookie')
+
+
+def create_session_store(app, db):
+    """
+    Session store selected by SESSION_BACKEND (memory, database or redis)
+
+    The database store is wrapped in a CachedSessionStore unless
+    SESSION_CACHE_TTL is 0.
+    """
+    backend = app.config['SESSION_BACKEND']
+    if backend == 'memory':
+        return MemorySessionStore()
+    if backend == 'redis':
+        return RedisSessionStore(app.config['SESSION_REDIS_URL'])
+    store = DatabaseSessionStore(db)
+    if app.config['SESSION_CACHE_TTL']:
+        store = CachedSessionStore(store, app.config['SESSION_CACHE_TTL'])
+    return store
+
+
+def init_sessions(app, db):
+    """Replace cookie sessions with server-side sessions"""
+    app.session_store = create_session_store(app, db)
+    app.session_interface = ServerSessionInterface(app.session_store, app.config['SESSION_SKIP_PATHS'])
+
+
+def load_principal(db, user_id):
+    """Read the compact principal for a user from the database"""
+    rows = db.execute_query(f'SELECT {PRINCIPAL_COLUMNS} FROM users WHERE id = %s AND deleted_at IS NULL', (user_id,))
+    if not rows:
+        return None
+    principal = dict(rows[0])
+    principal['has_referrer'] = principal['referred_by'] is not None
+    principal['referrer_approved'] = bool(principal['referrer_approved'])
+    principal['is_approved'] = bool(principal['is_approved'])
+    return principal
+
+
+def current_principal():
+    """
+    Cached principal of the logged-in user, or None
+
+    Loaded from the session record; the users table is only read when the
+    principal was invalidated or the session is new.
+    """
+    from flask import current_app, session
+
+    user_id = session.get('user_id')
+    if not user_id:
+        return None
+
+    principal = getattr(session, 'principal', None)
+    if not principal or principal.get('id') != user_id:
+        principal = load_principal(current_app.db, user_id)
+        if principal is None:
+            return None
+        if isinstance(session, ServerSideSession):
+            session.principal = principal
+            session.principal_changed = True
+
+    return dict(principal, is_admin=bool(session.get('admin_logged_in')))
+
+
+def invalidate_principal(user_id):
+    """Drop the cached principal of every session of a user (profile or approval changed)"""
+    from flask import current_app, session
+
+    if isinstance(session, ServerSideSession) and session.get('user_id') == user_id:
+        session.principal = None
+    try:
+        current_app.session_store.invalidate_principal(user_id)
+    except Exception as e:
+        logger.warning(f"Principal invalidation error: {e}")
+
+
+def revoke_user_sessions(user_id):
+    """Log a user out everywhere"""
+    from flask import current_app
+    current_app.session_store.revoke_user(user_id)
@@ -0,0 +1,83 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = '__settings_version__'
+
+
+class SettingsSnapshot:
+    """Process-wide snapshot of admin_settings with version-based invalidation"""
+
+    def __init__(self, db, check_interval=5):
+        """
+        Args:
+            db: Database instance
+            check_interval: Seconds between checks of the shared version counter
+        """
+        self.db = db
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.values = {}
+        self.version = None
+        self.checked_at = 0
+
+    def get(self, key, default=None):
+        """Get a single setting value"""
+        self._refresh_if_stale()
+        return self.values.get(key, default)
+
+    def all(self):
+        """Get a copy of all settings"""
+        self._refresh_if_stale()
+        return dict(self.values)
+
+    def with_prefix(self, prefix):
+        """Get settings whose key starts with prefix"""
+        self._refresh_if_stale()
+        return {k: v for k, v in self.values.items() if k.startswith(prefix)}
+
+    def bump(self):
+        """Increment the shared version counter and reload this process's snapshot"""
+        self.db.execute_update('''
+            INSERT INTO admin_settings (key, value, updated_at)
+            VALUES (%s, '1', CURRENT_TIMESTAMP)
+            ON CONFLICT (key)
+            DO UPDATE SET value = CAST(CAST(admin_settings.value AS INTEGER) + 1 AS TEXT),
+                          updated_at = CURRENT_TIMESTAMP
+        ''', (VERSION_KEY,))
+        self.reload()
+
+    def reload(self):
+        """Load all settings and the current version from the database"""
+        rows = self.db.execute_query('SELECT key, value FROM admin_settings')
+        values = {row['key']: row['value'] for row in rows} if rows else {}
+        version = values.pop(VERSION_KEY, '0')
+
+        with self.lock:
+            self.values = values
+            self.version = version
+            self.checked_at = time.time()
+
+    def _refresh_if_stale(self):
+        """Reload when the shared version counter has moved since the last load"""
+        if time.time() - self.checked_at < self.check_interval:
+            return
+
+        with self.lock:
+            # Another thread may have just checked
+            if time.time() - self.checked_at < self.check_interval:
+                return
+            self.checked_at = time.time()
+
+        try:
+            rows = self.db.execute_query(
+                'SELECT value FROM admin_settings WHERE key = %s',
+                (VERSION_KEY,)
+            )
+            version = rows[0]['value'] if rows else '0'
+            if version != self.version:
+                self.reload()
+        except Exception as e:
+            logger.warning(f"Settings refresh error: {e}")
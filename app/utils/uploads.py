@@ -0,0 +1,321 @@
+import os
+import re
+import hashlib
+import logging
+import tempfile
+import time
+
+from app.utils.lifecycle import LeasedJob, start_job
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_URL_PREFIX = '/uploads/'
+
+# Columns that may hold upload URLs: one URL, a comma-separated list
+# (review_images) or free text (admin_settings values)
+UPLOAD_REFERENCES = {
+    'users': ('profile_image_url', 'grow_license_file_url'),
+    'buds_data': (
+        'image_1_url', 'image_2_url', 'image_3_url', 'image_4_url',
+        'certificate_image_1_url', 'certificate_image_2_url',
+        'certificate_image_3_url', 'certificate_image_4_url',
+    ),
+    'reviews': ('review_images',),
+    'activities': ('first_prize_image', 'second_prize_image', 'third_prize_image'),
+    'activity_participants': ('submission_images',),
+    'admin_settings': ('value',),
+}
+
+UPLOAD_URL_PATTERN = re.compile(r'/uploads/[^\s,"\'<>()\\]+')
+
+# Content-addressed names: the SHA-256 of the file plus its extension
+CONTENT_NAME_PATTERN = re.compile(r'^[0-9a-f]{64}(\.[a-z0-9]{1,10})?$')
+
+# Bytes read (and hashed) at a time while saving an upload
+HASH_CHUNK_SIZE = 64 * 1024
+
+# Content-addressed files never change, so browsers may keep them this long
+IMMUTABLE_MAX_AGE = 365 * 86400
+
+# Prefix of the temporary files uploads are streamed into (a dotfile, so GC passes skip it)
+TEMP_PREFIX = '.upload-'
+
+
+def save_upload(file, upload_folder):
+    """
+    Store an uploaded file under its SHA-256 and return its /uploads/ URL
+
+    The stream is hashed while it is copied to a temporary file in the
+    folder, then renamed to <sha256>.<ext>. If that file already exists the
+    copy is dropped, so a duplicate upload costs no disk; its mtime is
+    refreshed so the GC grace period starts over for the new reference.
+    """
+    ext = ''
+    if file.filename and '.' in file.filename:
+        ext = file.filename.rsplit('.', 1)[1].lower()
+        ext = f'.{ext}' if ext.isalnum() and len(ext) <= 10 else ''
+
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=upload_folder)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file.stream.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+
+        name = digest.hexdigest() + ext
+        path = os.path.join(upload_folder, name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+            temp_path = None
+    finally:
+        if temp_path is not None:
+            os.remove(temp_path)
+    return UPLOAD_URL_PREFIX + name
+
+
+def serve_upload(upload_folder, filename):
+    """send_from_directory(), cached forever for content-addressed names"""
+    from flask import send_from_directory
+
+    if not CONTENT_NAME_PATTERN.match(filename):
+        return send_from_directory(upload_folder, filename)
+    response = send_from_directory(upload_folder, filename, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def find_upload_urls(value):
+    """Every /uploads/ URL mentioned in a column value"""
+    if not value:
+        return []
+    return UPLOAD_URL_PATTERN.findall(str(value))
+
+
+def referenced_uploads(db, urls=None):
+    """
+    Upload URLs still referenced by any row
+
+    Each table in UPLOAD_REFERENCES is streamed once. With urls, only those
+    are looked for and the result is a subset of them.
+    """
+    wanted = set(urls) if urls is not None else None
+    found = set()
+    for table, columns in UPLOAD_REFERENCES.items():
+        condition = ' OR '.join(f"{column} LIKE '%/uploads/%'" for column in columns)
+        rows = db.stream_query(f'SELECT {", ".join(columns)} FROM {table} WHERE {condition}')
+        next(rows)  # column names
+        for row in rows:
+            for value in row:
+                for url in find_upload_urls(value):
+                    if wanted is None or url in wanted:
+                        found.add(url)
+    return found
+
+
+# Assets shipped in the repo's uploads folder (default avatar, logo); no row refers to them
+SHIPPED_UPLOADS = ('budtboy_avatar.png', 'budtboy.png')
+
+# Files moved to or restored from quarantine per transaction
+GC_CHUNK_SIZE = 500
+
+GC_LEASE_NAME = 'upload_gc'
+
+
+def protected_uploads(template_folders=()):
+    """
+    Upload URLs the GC keeps although no row refers to them
+
+    SHIPPED_UPLOADS plus every /uploads/ URL written into a template (the
+    fallback images), read once when the job starts.
+    """
+    protected = {UPLOAD_URL_PREFIX + name for name in SHIPPED_UPLOADS}
+    for folder in template_folders:
+        for root, _, files in os.walk(folder):
+            for filename in files:
+                try:
+                    with open(os.path.join(root, filename), encoding='utf-8', errors='ignore') as f:
+                        protected.update(find_upload_urls(f.read()))
+                except OSError as e:
+                    logger.warning(f"Could not read template {filename}: {e}")
+    return protected
+
+
+def _upload_files(upload_folder):
+    """(name, mtime, size) of every regular file in the upload folder, dotfiles excluded"""
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            yield entry.name, stat.st_mtime, stat.st_size
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def restore_referenced(db, upload_folder, quarantine_folder, referenced):
+    """Move quarantined files that are referenced again back into uploads; returns the count"""
+    names = [row['name'] for row in db.execute_query('SELECT name FROM upload_quarantine')]
+    restored = [name for name in names if UPLOAD_URL_PREFIX + name in referenced]
+    for chunk in _chunks(restored, GC_CHUNK_SIZE):
+        for name in chunk:
+            try:
+                os.replace(os.path.join(quarantine_folder, name), os.path.join(upload_folder, name))
+            except FileNotFoundError:
+                pass
+        db.execute_many('DELETE FROM upload_quarantine WHERE name = %s', [(name,) for name in chunk])
+    return len(restored)
+
+
+def expire_quarantine(db, quarantine_folder, quarantined_before):
+    """Delete files quarantined before the given time; returns (files, bytes)"""
+    rows = db.execute_query(
+        'SELECT name, size FROM upload_quarantine WHERE quarantined_at < %s', (quarantined_before,)
+    )
+    for chunk in _chunks([dict(row) for row in rows], GC_CHUNK_SIZE):
+        for row in chunk:
+            try:
+                os.remove(os.path.join(quarantine_folder, row['name']))
+            except FileNotFoundError:
+                pass
+        db.execute_many('DELETE FROM upload_quarantine WHERE name = %s', [(row['name'],) for row in chunk])
+    return len(rows), sum(row['size'] or 0 for row in rows)
+
+
+def quarantine_orphans(db, upload_folder, quarantine_folder, referenced, modified_before, stopped=None):
+    """
+    Move unreferenced uploads older than modified_before into quarantine
+
+    The folder is walked GC_CHUNK_SIZE files at a time, each chunk recorded
+    in upload_quarantine with one executemany. Stops between chunks once
+    stopped is set. Returns (files, bytes).
+    """
+    now = time.time()
+    moved = size = 0
+    orphans = (
+        (name, file_size) for name, mtime, file_size in _upload_files(upload_folder)
+        if mtime < modified_before and UPLOAD_URL_PREFIX + name not in referenced
+    )
+    for chunk in _chunks(orphans, GC_CHUNK_SIZE):
+        if stopped is not None and stopped.is_set():
+            break
+        quarantined = []
+        for name, file_size in chunk:
+            try:
+                os.replace(os.path.join(upload_folder, name), os.path.join(quarantine_folder, name))
+            except FileNotFoundError:
+                continue
+            quarantined.append((name, file_size, now))
+        db.execute_many('''
+            INSERT INTO upload_quarantine (name, size, quarantined_at) VALUES (%s, %s, %s)
+            ON CONFLICT (name) DO UPDATE SET size = excluded.size, quarantined_at = excluded.quarantined_at
+        ''', quarantined)
+        moved += len(quarantined)
+        size += sum(row[1] for row in quarantined)
+    return moved, size
+
+
+def remove_stale_temp_files(upload_folder, modified_before):
+    """Delete temporary files left behind by uploads interrupted before modified_before"""
+    removed = 0
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            if entry.name.startswith(TEMP_PREFIX) and entry.stat().st_mtime < modified_before:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+    return removed
+
+
+def collect_garbage(db, upload_folder, quarantine_folder, grace_period, quarantine_period, stopped=None,
+                    protected=frozenset()):
+    """
+    One GC pass over the upload folder
+
+    The referenced set is built once from UPLOAD_REFERENCES, plus the
+    protected URLs (see protected_uploads()). Quarantined
+    files referenced again are restored, files quarantined longer than
+    quarantine_period are deleted, and unreferenced files untouched for
+    grace_period seconds are quarantined. Returns the counts of each.
+    """
+    os.makedirs(quarantine_folder, exist_ok=True)
+    now = time.time()
+    referenced = referenced_uploads(db) | set(protected)
+
+    remove_stale_temp_files(upload_folder, now - grace_period)
+    restored = restore_referenced(db, upload_folder, quarantine_folder, referenced)
+    deleted, deleted_bytes = expire_quarantine(db, quarantine_folder, now - quarantine_period)
+    quarantined, quarantined_bytes = quarantine_orphans(
+        db, upload_folder, quarantine_folder, referenced, now - grace_period, stopped
+    )
+    return {
+        'referenced': len(referenced),
+        'restored': restored,
+        'deleted': deleted,
+        'deleted_bytes': deleted_bytes,
+        'quarantined': quarantined,
+        'quarantined_bytes': quarantined_bytes,
+    }
+
+
+class UploadGCJob(LeasedJob):
+    """Collects orphaned uploads every interval seconds on the lease holder"""
+
+    lease_name = GC_LEASE_NAME
+    thread_name = 'upload-gc'
+
+    def __init__(self, db, upload_folder, quarantine_folder, interval, grace_period, quarantine_period,
+                 protected=frozenset()):
+        super().__init__(db, interval)
+        self.upload_folder = upload_folder
+        self.quarantine_folder = quarantine_folder
+        self.grace_period = grace_period
+        self.quarantine_period = quarantine_period
+        self.protected = protected
+
+    def run(self):
+        """One GC pass; returns its counts"""
+        start = time.perf_counter()
+        result = collect_garbage(
+            self.db, self.upload_folder, self.quarantine_folder,
+            self.grace_period, self.quarantine_period, self.stopped, self.protected
+        )
+        logger.info(f"Upload GC finished in {time.perf_counter() - start:.2f}s", extra={'fields': result})
+        return result
+
+
+def init_upload_gc(app, db):
+    """
+    Start the orphaned upload collector
+
+    Files nothing references are moved to UPLOAD_QUARANTINE_FOLDER once
+    they are UPLOAD_GC_GRACE_PERIOD seconds old, and deleted after
+    UPLOAD_QUARANTINE_PERIOD more seconds unless a row refers to them again.
+    Shipped assets and files the templates link to are never collected.
+    """
+    return start_job(
+        app, 'UPLOAD_GC_INTERVAL', 'upload_gc_job',
+        lambda interval: UploadGCJob(
+            db, app.config['UPLOAD_FOLDER'], app.config['UPLOAD_QUARANTINE_FOLDER'], interval,
+            app.config['UPLOAD_GC_GRACE_PERIOD'], app.config['UPLOAD_QUARANTINE_PERIOD'],
+            protected_uploads([os.path.join(app.root_path, app.template_folder)])
+        )
+    )
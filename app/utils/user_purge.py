@@ -0,0 +1,206 @@
+import logging
+import time
+
+from app.utils.feed import remove_user_feed
+from app.utils.lifecycle import LeasedJob, refresh_snapshots, start_job
+from app.utils.referral_tree import unlink_user
+from app.utils.registration import reset_slots
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = 'user_purge'
+
+# user_purges.status
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# A purge that failed this many times is left for an admin to look at
+MAX_ATTEMPTS = 3
+
+# Purges picked up per run
+PURGE_BATCH_SIZE = 20
+
+# Buds a user grew or added; they go with the user
+OWNED_BUDS = 'SELECT id FROM buds_data WHERE grower_id = %s OR created_by = %s'
+
+def request_purge(db, user_id, requested_by=None):
+    """
+    Soft-delete a user and queue their purge
+
+    The user can no longer log in or load a session from here on. Returns
+    False if the user doesn't exist or was already deleted.
+    """
+    with db.transaction() as tx:
+        marked = tx.execute_update(
+            'UPDATE users SET deleted_at = CURRENT_TIMESTAMP WHERE id = %s AND deleted_at IS NULL',
+            (user_id,)
+        )
+        if marked:
+            tx.execute_update(f'''
+                INSERT INTO user_purges (user_id, requested_by, status, step, requested_at)
+                VALUES (%s, %s, '{PENDING}', 'queued', CURRENT_TIMESTAMP)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    status = excluded.status, step = excluded.step, attempts = 0,
+                    requested_at = excluded.requested_at, error = NULL
+            ''', (user_id, requested_by))
+    return bool(marked)
+
+
+def get_purge(db, user_id):
+    rows = db.execute_query('SELECT * FROM user_purges WHERE user_id = %s', (user_id,))
+    return dict(rows[0]) if rows else None
+
+
+def list_purges(db, limit=50):
+    """Most recent purges first, with their progress"""
+    rows = db.execute_query('''
+        SELECT * FROM user_purges ORDER BY requested_at DESC, user_id DESC LIMIT %s
+    ''', (limit,))
+    return [dict(row) for row in rows]
+
+
+def _delete_user_rows(tx, user_id):
+    """
+    Delete everything a user owns inside one transaction
+
+    Returns (rows_deleted, activity_ids_left, referred_user_ids).
+    """
+    owned = (user_id, user_id)
+    deleted = 0
+    deleted += tx.execute_update('DELETE FROM reviews WHERE reviewer_id = %s', (user_id,))
+
+    # Other users' reviews and entries of the user's buds reference them
+    tx.execute_update(f'''
+        DELETE FROM feed_items WHERE review_id IN (
+            SELECT id FROM reviews WHERE bud_reference_id IN ({OWNED_BUDS})
+        )
+    ''', owned)
+    deleted += tx.execute_update(f'DELETE FROM reviews WHERE bud_reference_id IN ({OWNED_BUDS})', owned)
+
+    joined = [row['activity_id'] for row in tx.execute_query(f'''
+        SELECT DISTINCT activity_id FROM activity_participants
+        WHERE user_id = %s OR bud_id IN ({OWNED_BUDS})
+    ''', (user_id,) + owned)]
+    deleted += tx.execute_update(f'''
+        DELETE FROM activity_participants WHERE user_id = %s OR bud_id IN ({OWNED_BUDS})
+    ''', (user_id,) + owned)
+    reset_slots(tx, joined)
+
+    deleted += tx.execute_update('DELETE FROM buds_data WHERE grower_id = %s OR created_by = %s', owned)
+    deleted += tx.execute_update('DELETE FROM friends WHERE user_id = %s OR friend_id = %s', (user_id, user_id))
+    remove_user_feed(tx, user_id)
+    deleted += tx.execute_update(
+        'DELETE FROM referrals WHERE referrer_user_id = %s OR referred_user_id = %s', (user_id, user_id)
+    )
+
+    unlink_user(tx, user_id)
+    referred = [row['id'] for row in tx.execute_query('SELECT id FROM users WHERE referred_by = %s', (user_id,))]
+    tx.execute_update('UPDATE users SET referred_by = NULL WHERE referred_by = %s', (user_id,))
+    tx.execute_update('UPDATE users SET approved_by = NULL WHERE approved_by = %s', (user_id,))
+
+    deleted += tx.execute_update('DELETE FROM email_verifications WHERE user_id = %s', (user_id,))
+    deleted += tx.execute_update('DELETE FROM password_resets WHERE user_id = %s', (user_id,))
+    deleted += tx.execute_update('DELETE FROM users WHERE id = %s', (user_id,))
+    return deleted, joined, referred
+
+
+def purge_user(db, user_id):
+    """
+    Remove a soft-deleted user's rows
+
+    The rows go in one transaction, together with the progress update, so
+    a failed purge leaves the user intact and is retried. Uploaded files are
+    left to the upload GC: with content-addressed names a file may belong
+    to other users too, or be saved by one and not yet attached to a row,
+    and the GC only quarantines files that stayed unreferenced past its
+    grace period. Returns (rows_deleted, referred_user_ids).
+    """
+    db.execute_update(f'''
+        UPDATE user_purges SET status = '{RUNNING}', step = 'rows', attempts = attempts + 1,
+            started_at = CURRENT_TIMESTAMP
+        WHERE user_id = %s
+    ''', (user_id,))
+
+    with db.transaction() as tx:
+        if not tx.execute_query('SELECT 1 FROM users WHERE id = %s AND deleted_at IS NOT NULL', (user_id,)):
+            rows_deleted, joined, referred = 0, [], []
+        else:
+            rows_deleted, joined, referred = _delete_user_rows(tx, user_id)
+        tx.execute_update(
+            "UPDATE user_purges SET step = 'snapshots', rows_deleted = %s WHERE user_id = %s",
+            (rows_deleted, user_id)
+        )
+
+    refresh_snapshots(db, joined)
+
+    db.execute_update(f'''
+        UPDATE user_purges SET status = '{DONE}', step = 'done', finished_at = CURRENT_TIMESTAMP, error = NULL
+        WHERE user_id = %s
+    ''', (user_id,))
+    return rows_deleted, referred
+
+
+class UserPurgeJob(LeasedJob):
+    """Purges soft-deleted users every interval seconds on the lease holder"""
+
+    lease_name = LEASE_NAME
+    thread_name = 'user-purge'
+
+    def __init__(self, db, interval, on_purged=None):
+        super().__init__(db, interval)
+        self.on_purged = on_purged
+
+    def run(self):
+        """Purge queued users; returns the number purged"""
+        queued = self.db.execute_query(f'''
+            SELECT user_id FROM user_purges
+            WHERE status IN ('{PENDING}', '{RUNNING}', '{FAILED}') AND attempts < %s
+            ORDER BY requested_at
+            LIMIT %s
+        ''', (MAX_ATTEMPTS, PURGE_BATCH_SIZE))
+
+        purged = 0
+        for row in queued:
+            user_id = row['user_id']
+            start = time.perf_counter()
+            try:
+                rows_deleted, referred = purge_user(self.db, user_id)
+            except Exception as e:
+                logger.exception(f"Purge of user {user_id} failed")
+                self.db.execute_update(
+                    f"UPDATE user_purges SET status = '{FAILED}', error = %s WHERE user_id = %s",
+                    (str(e)[:500], user_id)
+                )
+                continue
+            purged += 1
+            if self.on_purged:
+                self.on_purged(user_id, referred)
+            logger.info(
+                f"User {user_id} purged in {time.perf_counter() - start:.2f}s",
+                extra={'fields': {'user_id': user_id, 'rows_deleted': rows_deleted}}
+            )
+        return purged
+
+
+def init_user_purge(app, db):
+    """
+    Start the user purge job
+
+    Only the holder of the 'user_purge' lease purges. Deleting a user wakes
+    this worker's job, so the purge usually starts at once when it leads.
+    """
+    def on_purged(user_id, referred):
+        from app.utils.referral_tree import invalidate_referral_cache
+
+        for referred_id in referred:
+            app.session_store.invalidate_principal(referred_id)
+        invalidate_referral_cache(app.cache)
+        for pattern in (f'profile_{user_id}', f'user_{user_id}', 'users_', 'buds_', 'activities_', 'admin_stats'):
+            app.cache.clear_pattern(pattern)
+
+    return start_job(
+        app, 'USER_PURGE_INTERVAL', 'user_purge_job',
+        lambda interval: UserPurgeJob(db, interval, on_purged)
+    )
@@ -0,0 +1,6 @@
+"""
+Benchmarking tools for BudtBoy
+
+Run modules from the project root, e.g.:
+    python -m benchmarks.generate_dataset --scale small
+"""
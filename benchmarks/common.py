@@ -0,0 +1,101 @@
+"""
+Shared helpers for benchmark scripts: latency summaries and result files
+"""
+import os
+import json
+import time
+import platform
+import subprocess
+
+
+def percentile(sorted_values, pct):
+    """Linear-interpolated percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def summarize(samples, duration=None):
+    """
+    Summarize latency samples (seconds) in milliseconds
+
+    Args:
+        samples: List of latencies in seconds
+        duration: Wall-clock seconds the samples were collected over (for throughput)
+    """
+    values = sorted(samples)
+    summary = {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 4) if values else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000, 4),
+        'p95_ms': round(percentile(values, 95) * 1000, 4),
+        'p99_ms': round(percentile(values, 99) * 1000, 4),
+        'max_ms': round(values[-1] * 1000, 4) if values else 0.0,
+    }
+    if duration:
+        summary['throughput_rps'] = round(len(values) / duration, 2)
+    return summary
+
+
+def git_revision():
+    """Current commit hash, or None outside a git checkout"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, benchmark, config, results):
+    """Write a result file tagged with the commit and machine it was measured on"""
+    data = {
+        'benchmark': benchmark,
+        'commit': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'config': config,
+        'results': results,
+    }
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    return data
+
+
+def compare_results(baseline_path, results, metric='p95_ms', threshold=0.2):
+    """
+    Compare results against a previous result file
+
+    Returns a list of (name, baseline, current, change) for every entry whose
+    metric got worse by more than threshold (0.2 = 20%).
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get(name, {}).get(metric)
+        after = current.get(metric)
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        if change > threshold:
+            regressions.append((name, before, after, change))
+    return regressions
+
+
+def print_table(results, columns=('count', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'throughput_rps')):
+    """Print result rows as an aligned table"""
+    width = max([len(name) for name in results] + [8])
+    print(f"{'name':<{width}}  " + '  '.join(f'{c:>14}' for c in columns))
+    for name, row in results.items():
+        print(f'{name:<{width}}  ' + '  '.join(f'{row.get(c, ""):>14}' for c in columns))
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Database Micro-benchmarks
+
+Times each Database primitive (execute_query, execute_insert,
+execute_update, _convert_query_placeholders) on SQLite and, when a URL is
+given, PostgreSQL - with a new connection per call (the app default) and
+with per-thread connection reuse. Separates connection overhead, row
+conversion and dialect translation cost per call.
+
+Usage:
+    python -m benchmarks.db_bench
+    python -m benchmarks.db_bench --iterations 5000 --db-url postgresql://localhost/budtboy_bench
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models import Database
+from benchmarks.common import summarize, write_results, compare_results, git_revision, print_table
+
+
+TABLE = 'bench_items'
+SEED_ROWS = 1000
+
+SAMPLE_QUERY = '''
+    SELECT b.*, u.username as grower_name
+    FROM buds_data b
+    LEFT JOIN users u ON b.grower_id = u.id
+    WHERE b.strain_type = %s AND b.grade IN (%s, %s) AND b.thc_percentage >= %s
+    ORDER BY b.created_at DESC
+    LIMIT %s
+'''
+
+
+def setup_table(db):
+    """Create and fill the scratch table used by every primitive"""
+    db.execute_update(f'DROP TABLE IF EXISTS {TABLE}')
+    db.execute_update(db._get_create_table_syntax(f'''
+        CREATE TABLE {TABLE} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            category TEXT,
+            score REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    '''))
+    db.execute_many(
+        f'INSERT INTO {TABLE} (name, category, score) VALUES (%s, %s, %s)',
+        [(f'item {n}', f'cat{n % 10}', n / 10) for n in range(SEED_ROWS)]
+    )
+
+
+def time_calls(func, iterations):
+    """Latency of each call in seconds"""
+    samples = []
+    for n in range(iterations):
+        start = time.perf_counter()
+        func(n)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_database(db, iterations):
+    """Run every primitive against db and return {primitive: summary}"""
+    id_count = SEED_ROWS
+
+    def connect_only(n):
+        with db.get_connection():
+            pass
+
+    def select_one(n):
+        db.execute_query(f'SELECT * FROM {TABLE} WHERE id = %s', (n % id_count + 1,))
+
+    def select_100_rows(n):
+        db.execute_query(f'SELECT * FROM {TABLE} WHERE category = %s LIMIT 100', (f'cat{n % 10}',))
+
+    def select_100_dicts(n):
+        rows = db.execute_query(f'SELECT * FROM {TABLE} WHERE category = %s LIMIT 100', (f'cat{n % 10}',))
+        [dict(row) for row in rows]
+
+    def insert(n):
+        db.execute_insert(f'INSERT INTO {TABLE} (name, category, score) VALUES (%s, %s, %s)',
+                          (f'new {n}', 'inserted', n))
+
+    def update(n):
+        db.execute_update(f'UPDATE {TABLE} SET score = score + 1 WHERE id = %s', (n % id_count + 1,))
+
+    def convert_placeholders(n):
+        db._convert_query_placeholders(SAMPLE_QUERY)
+
+    results = {}
+    for name, func in [
+        ('connect', connect_only),
+        ('execute_query_1_row', select_one),
+        ('execute_query_100_rows', select_100_rows),
+        ('execute_query_100_rows_to_dict', select_100_dicts),
+        ('execute_insert', insert),
+        ('execute_update', update),
+        ('convert_placeholders', convert_placeholders),
+    ]:
+        # Placeholder conversion is pure CPU and far cheaper; give it more rounds
+        rounds = iterations * 10 if name == 'convert_placeholders' else iterations
+        func(0)  # warm-up
+        samples = time_calls(func, rounds)
+        # throughput_rps is calls per second of busy time
+        results[name] = summarize(samples, sum(samples))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for the Database class')
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--db-path', help='SQLite file (default: a temporary file)')
+    parser.add_argument('--db-url', default=os.environ.get('BENCH_DATABASE_URL'),
+                        help='PostgreSQL URL; a scratch table is created and dropped')
+    parser.add_argument('--output', help='Result JSON (default benchmarks/results/db_<commit>.json)')
+    parser.add_argument('--compare', help='Previous result JSON to check for p95 regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed p95 slowdown (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    sqlite_path = args.db_path or os.path.join(tempfile.mkdtemp(prefix='budtboy_bench_'), 'bench.db')
+    backends = [('sqlite', {'db_path': sqlite_path, 'db_type': 'sqlite'})]
+    if args.db_url:
+        backends.append(('postgresql', {'db_url': args.db_url, 'db_type': 'postgresql'}))
+
+    results = {}
+    for backend, kwargs in backends:
+        for reuse in (False, True):
+            db = Database(reuse_connections=reuse, **kwargs)
+            label = f"{backend}/{'reuse' if reuse else 'connect'}"
+            print(f"⏱️  {label} ({args.iterations} iterations)")
+            setup_table(db)
+            for primitive, summary in bench_database(db, args.iterations).items():
+                results[f'{label}/{primitive}'] = summary
+            db.execute_update(f'DROP TABLE IF EXISTS {TABLE}')
+            db.close_connection()
+
+    print()
+    print_table(results, ('count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'))
+
+    output = args.output or os.path.join('benchmarks', 'results', f'db_{git_revision() or "local"}.json')
+    write_results(output, 'db_bench', {
+        'iterations': args.iterations,
+        'backends': [backend for backend, _ in backends],
+        'seed_rows': SEED_ROWS,
+    }, results)
+    print(f"\n💾 Results saved to {output}")
+
+    if args.compare:
+        regressions = compare_results(args.compare, results, threshold=args.threshold)
+        for name, before, after, change in regressions:
+            print(f"⚠️  {name}: p95 {before:.3f}ms -> {after:.3f}ms (+{change:.0%})")
+        if regressions:
+            sys.exit(1)
+        print("✅ No p95 regressions")
+
+
+if __name__ == '__main__':
+    main()
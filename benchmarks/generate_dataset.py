@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+Synthetic Dataset Generator
+
+Builds a realistically large BudtBoy database for benchmarking: users with
+referral chains, buds, reviews, friends, activities and participants.
+Output is deterministic for a given --seed and is written with bulk inserts
+through app.models.Database, so it works for both SQLite and PostgreSQL.
+
+Usage:
+    python -m benchmarks.generate_dataset --scale small --db-path bench.db
+    python -m benchmarks.generate_dataset --scale large --db-type postgresql --db-url postgresql://...
+    python -m benchmarks.generate_dataset --users 5000 --reviews 50000 --seed 7
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models import Database
+
+
+SCALES = {
+    'tiny':   {'users': 200,     'buds': 400,     'reviews': 2000,      'friends': 600,     'activities': 5,   'participants': 100},
+    'small':  {'users': 5000,    'buds': 10000,   'reviews': 50000,     'friends': 15000,   'activities': 20,  'participants': 2000},
+    'medium': {'users': 25000,   'buds': 60000,   'reviews': 250000,    'friends': 75000,   'activities': 50,  'participants': 10000},
+    'large':  {'users': 100000,  'buds': 250000,  'reviews': 1000000,   'friends': 300000,  'activities': 200, 'participants': 50000},
+}
+
+# Every generated account uses this password (hashed once, bcrypt cost 12)
+BENCH_PASSWORD = 'Bench1234'
+
+# Fixed reference point so timestamps do not depend on when the script runs
+BASE_TIME = datetime(2025, 1, 1)
+SPAN_DAYS = 365
+
+STRAIN_NAMES = [
+    'AK-47', 'Afghan Kush', 'Amnesia Haze', 'Blue Dream', 'Cherry Cola', 'Gelato',
+    'Godfather OG', 'Gorilla Glue', 'Gorilla Punch', 'Jack Herer', 'LA Kush Cake',
+    'Northern Lights', 'OG Kush', 'Pina Colada', 'Planet of the Grapes', 'Purple Haze',
+    'San Francisco Sour Dough', 'Secret Zkittlez', 'Strawberry Cough', 'Thai Stick',
+    'White Widow', 'Wedding Cake', 'Zkittlez', 'Banana Daddy',
+]
+BREEDERS = [
+    'Barney\'s Farm', 'Ace Seeds', 'Archive Seed Bank', 'Big Buddha Seeds', 'Bodhi Seeds',
+    'Dutch Passion', 'Humboldt Seed Co', 'Royal Queen Seeds', 'Sensi Seeds', 'Thai Landrace',
+]
+STRAIN_TYPES = ['Indica', 'Sativa', 'Hybrid']
+GRADES = ['A+', 'A', 'B+', 'B', 'C']
+GROW_METHODS = ['Indoor', 'Outdoor', 'Greenhouse']
+FERTILIZERS = ['Organic', 'Chemical', 'Mixed']
+FLOWERING_TYPES = ['Photoperiod', 'Autoflower']
+RECOMMENDED_TIMES = ['กลางวัน', 'กลางคืน', 'ตลอดวัน']
+TERPENES = [
+    'ไมร์ซีน (Myrcene)', 'ลิโมนีน (Limonene)', 'ลินาลูล (Linalool)',
+    'เบตา‑คาริโอฟีลลีน (β‑Caryophyllene)', 'แอลฟา‑ไพนีน (α‑Pinene)', 'ฮิวมูเลน (Humulene)',
+    'เทอร์พินอลีน (Terpinolene)', 'โอซิมีน (Ocimene)',
+]
+AROMAS = ['Citrus', 'Earthy', 'Pine', 'Sweet', 'Berry', 'Diesel', 'Skunk', 'Spicy', 'Grape', 'Floral']
+MENTAL_POSITIVE = ['ผ่อนคลาย', 'สุขใจ', 'ร่าเริง', 'สร้างสรรค์', 'โฟกัส', 'ตื่นตัว', 'เบิกบาน']
+MENTAL_NEGATIVE = ['วิตก', 'พารานอยด์', 'สับสน', 'หงุดหงิด']
+PHYSICAL_POSITIVE = ['คลายกล้าม', 'บรรเทาปวด', 'หลับง่าย', 'กระตุ้นกิน', 'ต้านอักเสบ']
+PHYSICAL_NEGATIVE = ['ปากแห้ง', 'ตาแห้ง', 'ตาแดง', 'เวียนหัว', 'ใจเต้นเร็ว']
+FRIEND_STATUSES = ['accepted'] * 4 + ['pending']
+
+
+class DatasetGenerator:
+    """Deterministic, batched generator for every core table"""
+
+    def __init__(self, db, counts, seed=42, batch_size=5000, verbose=True):
+        self.db = db
+        self.counts = counts
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.verbose = verbose
+
+        # Filled in as tables are generated; later tables refer back to them
+        self.user_ids = []
+        self.grower_ids = []
+        self.referral_codes = {}
+        self.buds_by_grower = {}
+        self.bud_ids = []
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def timestamp(self, after=None):
+        """Random timestamp in the dataset window (optionally after another one)"""
+        start = after or BASE_TIME
+        span = (BASE_TIME + timedelta(days=SPAN_DAYS) - start).total_seconds()
+        return start + timedelta(seconds=self.rng.uniform(0, max(span, 1)))
+
+    def next_id(self, table):
+        rows = self.db.execute_query(f'SELECT MAX(id) as max_id FROM {table}')
+        return (rows[0]['max_id'] or 0) + 1 if rows else 1
+
+    def bulk_insert(self, table, columns, rows):
+        """Insert an iterable of row tuples in batches, returns the row count"""
+        query = f'''
+            INSERT INTO {table} ({', '.join(columns)})
+            VALUES ({', '.join(['%s'] * len(columns))})
+        '''
+        total = 0
+        batch = []
+        start = time.perf_counter()
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self.db.execute_many(query, batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            self.db.execute_many(query, batch)
+            total += len(batch)
+
+        elapsed = time.perf_counter() - start
+        rate = total / elapsed if elapsed > 0 else 0
+        self.log(f"✅ {table}: {total:,} rows in {elapsed:.1f}s ({rate:,.0f} rows/s)")
+        return total
+
+    def reset_sequences(self, tables):
+        """PostgreSQL SERIAL sequences don't advance on explicit ids"""
+        if self.db.db_type != 'postgresql':
+            return
+        for table in tables:
+            self.db.execute_query(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table}), 1))"
+            )
+
+    def generate(self):
+        """Generate every table in dependency order"""
+        from app.utils import hash_password
+
+        start = time.perf_counter()
+        password_hash = hash_password(BENCH_PASSWORD).decode('utf-8')
+
+        self.generate_users(password_hash)
+        self.generate_buds()
+        self.generate_reviews()
+        self.generate_friends()
+        activity_ids = self.generate_activities()
+        self.generate_participants(activity_ids)
+        self.reset_sequences([
+            'users', 'referrals', 'buds_data', 'reviews', 'friends',
+            'activities', 'activity_participants',
+        ])
+
+        self.log(f"🎉 Dataset generated in {time.perf_counter() - start:.1f}s")
+
+    def generate_users(self, password_hash):
+        first_id = self.next_id('users')
+        count = self.counts['users']
+        self.user_ids = list(range(first_id, first_id + count))
+        referrals = []
+        rng = self.rng
+
+        def rows():
+            for i, user_id in enumerate(self.user_ids):
+                created_at = BASE_TIME + timedelta(seconds=SPAN_DAYS * 86400 * i / max(count, 1))
+
+                # Early users seed the tree; later users mostly join through a referral.
+                # Referrers are biased towards recent users, giving deep chains.
+                referred_by = None
+                if i >= max(10, count // 100) and rng.random() < 0.9:
+                    referred_by = self.user_ids[int(i * (1 - rng.random() ** 3))]
+                    if referred_by == user_id:
+                        referred_by = self.user_ids[i - 1]
+                    referrals.append((referred_by, user_id, created_at))
+
+                is_grower = rng.random() < 0.2
+                if is_grower:
+                    self.grower_ids.append(user_id)
+                is_approved = referred_by is None or rng.random() < 0.85
+                self.referral_codes[user_id] = f'REF{user_id}{rng.getrandbits(32):08x}'
+                yield (
+                    user_id, f'bench_user_{user_id}', f'bench_user_{user_id}@example.com', password_hash,
+                    is_grower, rng.random() < 0.1, rng.random() < 0.8, 1960 + rng.randrange(45),
+                    f'/uploads/bench_profile_{user_id % 50}.png', True,
+                    referred_by, self.referral_codes[user_id],
+                    referred_by is not None and is_approved, is_approved, created_at,
+                )
+
+        self.bulk_insert('users', [
+            'id', 'username', 'email', 'password_hash',
+            'is_grower', 'is_budtender', 'is_consumer', 'birth_year',
+            'profile_image_url', 'is_verified',
+            'referred_by', 'referral_code',
+            'referrer_approved', 'is_approved', 'created_at',
+        ], rows())
+
+        if not self.grower_ids:
+            self.grower_ids = self.user_ids[:1]
+
+        first_referral_id = self.next_id('referrals')
+        self.bulk_insert('referrals', [
+            'id', 'referrer_user_id', 'referred_user_id', 'referral_code_used', 'status',
+            'first_seen_at', 'signed_up_at', 'converted_at', 'utm_source', 'utm_medium',
+        ], (
+            (first_referral_id + n, referrer_id, referred_id, self.referral_codes[referrer_id], 'converted',
+             created_at - timedelta(minutes=rng.randrange(1, 600)), created_at, created_at,
+             rng.choice(['line', 'facebook', 'instagram', None]), rng.choice(['social', 'direct', None]))
+            for n, (referrer_id, referred_id, created_at) in enumerate(referrals)
+        ))
+
+    def generate_buds(self):
+        first_id = self.next_id('buds_data')
+        count = self.counts['buds']
+        rng = self.rng
+        self.bud_ids = list(range(first_id, first_id + count))
+
+        def rows():
+            for bud_id in self.bud_ids:
+                grower_id = rng.choice(self.grower_ids)
+                self.buds_by_grower.setdefault(grower_id, []).append(bud_id)
+                strain = rng.choice(STRAIN_NAMES)
+                terpenes = rng.sample(TERPENES, 3)
+                images = rng.randrange(0, 5)
+                certificates = rng.randrange(0, 3)
+                created_at = self.timestamp()
+                yield (
+                    bud_id, f'{strain} #{bud_id % 97}', strain, rng.choice(BREEDERS),
+                    rng.choice(STRAIN_TYPES), round(rng.uniform(8, 32), 1), round(rng.uniform(0, 12), 1),
+                    rng.choice(GRADES), ', '.join(rng.sample(AROMAS, 3)),
+                    terpenes[0], round(rng.uniform(0.5, 2.5), 2),
+                    terpenes[1], round(rng.uniform(0.2, 1.5), 2),
+                    terpenes[2], round(rng.uniform(0.1, 1.0), 2),
+                    ', '.join(rng.sample(MENTAL_POSITIVE, 2)), rng.choice(MENTAL_NEGATIVE),
+                    ', '.join(rng.sample(PHYSICAL_POSITIVE, 2)), rng.choice(PHYSICAL_NEGATIVE),
+                    rng.choice(RECOMMENDED_TIMES), rng.choice(GROW_METHODS),
+                    created_at.strftime('%Y-%m-%d'), f'B{bud_id:07d}',
+                    grower_id, rng.random() < 0.3, rng.choice(FERTILIZERS), rng.choice(FLOWERING_TYPES),
+                    'available' if rng.random() < 0.8 else 'sold_out',
+                    *[f'/uploads/bench_bud_{(bud_id + n) % 200}.jpg' if n < images else None for n in range(4)],
+                    *[f'/uploads/bench_cert_{(bud_id + n) % 50}.png' if n < certificates else None for n in range(4)],
+                    created_at, created_at, grower_id,
+                )
+
+        self.bulk_insert('buds_data', [
+            'id', 'strain_name_th', 'strain_name_en', 'breeder',
+            'strain_type', 'thc_percentage', 'cbd_percentage',
+            'grade', 'aroma_flavor',
+            'top_terpenes_1', 'top_terpenes_1_percentage',
+            'top_terpenes_2', 'top_terpenes_2_percentage',
+            'top_terpenes_3', 'top_terpenes_3_percentage',
+            'mental_effects_positive', 'mental_effects_negative',
+            'physical_effects_positive', 'physical_effects_negative',
+            'recommended_time', 'grow_method',
+            'harvest_date', 'batch_number',
+            'grower_id', 'grower_license_verified', 'fertilizer_type', 'flowering_type',
+            'status',
+            'image_1_url', 'image_2_url', 'image_3_url', 'image_4_url',
+            'certificate_image_1_url', 'certificate_image_2_url',
+            'certificate_image_3_url', 'certificate_image_4_url',
+            'created_at', 'updated_at', 'created_by',
+        ], rows())
+
+    def generate_reviews(self):
+        first_id = self.next_id('reviews')
+        rng = self.rng
+        # A small share of buds collects most of the reviews
+        popular = self.bud_ids[:max(1, len(self.bud_ids) // 20)]
+
+        def rows():
+            for n in range(self.counts['reviews']):
+                bud_id = rng.choice(popular) if rng.random() < 0.4 else rng.choice(self.bud_ids)
+                rating = max(1, min(5, round(rng.gauss(3.8, 0.9))))
+                created_at = self.timestamp()
+                images = rng.randrange(0, 4)
+                yield (
+                    first_id + n, bud_id, rng.choice(self.user_ids), rating,
+                    max(1, min(5, rating + rng.choice([-1, 0, 0, 1]))),
+                    f'Bench review {first_id + n}',
+                    'Synthetic review text. ' * rng.randrange(1, 8),
+                    ', '.join(rng.sample(MENTAL_POSITIVE, 2) + rng.sample(PHYSICAL_POSITIVE, 1)),
+                    ', '.join(rng.sample(AROMAS, 2)),
+                    ', '.join(f'/uploads/bench_review_{(n + i) % 300}.jpg' for i in range(images)) or None,
+                    created_at, created_at,
+                )
+
+        self.bulk_insert('reviews', [
+            'id', 'bud_reference_id', 'reviewer_id', 'overall_rating',
+            'aroma_rating',
+            'short_summary',
+            'full_review_content',
+            'selected_effects',
+            'aroma_flavors',
+            'review_images',
+            'created_at', 'updated_at',
+        ], rows())
+
+    def generate_friends(self):
+        first_id = self.next_id('friends')
+        rng = self.rng
+        target = min(self.counts['friends'], len(self.user_ids) * (len(self.user_ids) - 1) // 2)
+        seen = set()
+
+        def rows():
+            n = 0
+            while n < target:
+                a, b = rng.sample(self.user_ids, 2)
+                pair = (min(a, b), max(a, b))
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                yield (first_id + n, a, b, rng.choice(FRIEND_STATUSES), self.timestamp())
+                n += 1
+
+        self.bulk_insert('friends', ['id', 'user_id', 'friend_id', 'status', 'created_at'], rows())
+
+    def generate_activities(self):
+        first_id = self.next_id('activities')
+        rng = self.rng
+        activity_ids = list(range(first_id, first_id + self.counts['activities']))
+
+        def rows():
+            for activity_id in activity_ids:
+                opens = self.timestamp()
+                closes = opens + timedelta(days=rng.randrange(7, 45))
+                yield (
+                    activity_id, f'Bench Contest {activity_id}', 'Synthetic contest for benchmarking',
+                    opens, closes, 'Overall quality, aroma and effects',
+                    rng.choice([0, 0, 100, 500, 1000]), rng.choice(['upcoming', 'open', 'open', 'closed']),
+                    'Trophy', 5000, 'Medal', 2000, 'Certificate', 1000,
+                    ','.join(rng.sample(STRAIN_TYPES, rng.randrange(1, 4))),
+                    ','.join(rng.sample(GROW_METHODS, rng.randrange(1, 4))),
+                    ','.join(rng.sample(GRADES, rng.randrange(2, 6))),
+                    ','.join(rng.sample(TERPENES, 2)),
+                    rng.choice([None, 10, 15]), rng.choice([None, 30]),
+                    rng.choice([None, 0]), rng.choice([None, 10]),
+                    rng.random() < 0.2, rng.random() < 0.3, rng.choice([None, 1, 2]),
+                    rng.random() < 0.2, rng.choice([None, 1, 3]),
+                    ','.join(rng.sample(AROMAS, 2)), ','.join(rng.sample(MENTAL_POSITIVE, 2)),
+                    opens - timedelta(days=7), 1,
+                )
+
+        self.bulk_insert('activities', [
+            'id', 'name', 'description',
+            'start_registration_date', 'end_registration_date', 'judging_criteria',
+            'max_participants', 'status',
+            'first_prize_description', 'first_prize_value',
+            'second_prize_description', 'second_prize_value',
+            'third_prize_description', 'third_prize_value',
+            'allowed_strain_types',
+            'allowed_grow_methods',
+            'allowed_grades',
+            'preferred_terpenes',
+            'min_thc', 'max_thc',
+            'min_cbd', 'max_cbd',
+            'require_certificate', 'require_min_images', 'min_image_count',
+            'require_min_reviews', 'min_review_count',
+            'preferred_aromas', 'preferred_effects',
+            'created_at', 'created_by',
+        ], rows())
+        return activity_ids
+
+    def generate_participants(self, activity_ids):
+        if not activity_ids:
+            return
+        first_id = self.next_id('activity_participants')
+        rng = self.rng
+        growers = [g for g in self.grower_ids if g in self.buds_by_grower]
+        target = min(self.counts['participants'], len(growers) * len(activity_ids))
+        seen = set()
+
+        def rows():
+            n = 0
+            while n < target:
+                activity_id = rng.choice(activity_ids)
+                user_id = rng.choice(growers)
+                if (activity_id, user_id) in seen:
+                    continue
+                seen.add((activity_id, user_id))
+                bud_id = rng.choice(self.buds_by_grower[user_id])
+                yield (first_id + n, activity_id, user_id, bud_id, 'Bench submission', self.timestamp())
+                n += 1
+
+        self.bulk_insert('activity_participants', [
+            'id', 'activity_id', 'user_id', 'bud_id', 'submission_description', 'registered_at',
+        ], rows())
+
+
+def build_database(db_type='sqlite', db_path=None, db_url=None):
+    """Create a Database and make sure the schema exists"""
+    if db_type == 'postgresql':
+        db = Database(db_url=db_url, db_type='postgresql')
+    else:
+        db = Database(db_path=db_path, db_type='sqlite')
+    db.init_db()
+    if db_type == 'sqlite':
+        db.migrate_add_referrer_approval()
+        db.migrate_add_user_deleted_at()
+        db.migrate_add_activity_criteria()
+    return db
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic BudtBoy dataset')
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--db-type', choices=['sqlite', 'postgresql'], default='sqlite')
+    parser.add_argument('--db-path', default='budtboy_bench.db', help='SQLite database file')
+    parser.add_argument('--db-url', default=os.environ.get('DATABASE_URL'), help='PostgreSQL URL')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--fresh', action='store_true', help='Delete the SQLite file first')
+    for table in SCALES['small']:
+        parser.add_argument(f'--{table}', type=int, help=f'Override the number of {table}')
+    args = parser.parse_args()
+
+    counts = dict(SCALES[args.scale])
+    for table in counts:
+        if getattr(args, table) is not None:
+            counts[table] = getattr(args, table)
+
+    if args.db_type == 'postgresql' and not args.db_url:
+        parser.error('--db-url (or DATABASE_URL) is required for PostgreSQL')
+    if args.db_type == 'sqlite' and args.fresh and os.path.exists(args.db_path):
+        os.remove(args.db_path)
+
+    print("=" * 60)
+    print(f"🌿 Generating {args.scale} dataset (seed={args.seed}) into {args.db_type}")
+    print("   " + ", ".join(f"{table}={n:,}" for table, n in counts.items()))
+    print(f"   Password for every generated user: {BENCH_PASSWORD}")
+    print("=" * 60)
+
+    db = build_database(args.db_type, args.db_path, args.db_url)
+    DatasetGenerator(db, counts, seed=args.seed, batch_size=args.batch_size).generate()
+
+
+if __name__ == '__main__':
+    main()
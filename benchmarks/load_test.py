@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+HTTP Load Test
+
+Drives a weighted mix of realistic API traffic (login, profile, bud info,
+search, activities, review creation) with concurrent virtual users and
+reports p50/p95/p99 latency and throughput per endpoint.
+
+Targets either the app in-process (create_app('testing') + test clients) or
+a running server, e.g. a multi-worker gunicorn pointed at the same dataset.
+
+Usage:
+    python -m benchmarks.generate_dataset --scale small --db-path bench.db
+    python -m benchmarks.load_test --db-path bench.db --duration 30 --users 8
+
+    DATABASE_PATH=bench.db gunicorn -w 4 -b 127.0.0.1:8000 run:app
+    python -m benchmarks.load_test --db-path bench.db --base-url http://127.0.0.1:8000
+
+    python -m benchmarks.load_test --db-path bench.db --compare benchmarks/results/load_<commit>.json
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+from app import create_app
+from app.models import Database
+from benchmarks.common import summarize, write_results, compare_results, git_revision, print_table
+from benchmarks.generate_dataset import BENCH_PASSWORD, STRAIN_NAMES, STRAIN_TYPES, GRADES, AROMAS, MENTAL_POSITIVE
+
+
+# (scenario, weight) - roughly what a logged-in user does on the site
+TRAFFIC_MIX = [
+    ('login', 1),
+    ('profile', 15),
+    ('bud_info', 30),
+    ('search_buds', 12),
+    ('strain_search', 12),
+    ('activities', 10),
+    ('friends_reviews', 10),
+    ('create_review', 5),
+]
+
+
+class InProcessClient:
+    """Flask test client with the same interface as HttpClient"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, json=None):
+        response = self.client.open(path, method=method, json=json)
+        return response.status_code
+
+
+class HttpClient:
+    """requests.Session against a running server"""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, method, path, json=None):
+        response = self.session.request(method, self.base_url + path, json=json, timeout=30)
+        return response.status_code
+
+
+class Targets:
+    """Ids and names sampled from the dataset so requests hit real rows"""
+
+    def __init__(self, db, limit=5000):
+        users = db.execute_query(
+            'SELECT email FROM users WHERE is_approved = %s AND email LIKE %s LIMIT %s',
+            (True, 'bench_user_%', limit)
+        )
+        buds = db.execute_query('SELECT id FROM buds_data ORDER BY id DESC LIMIT %s', (limit,))
+        activities = db.execute_query('SELECT id FROM activities LIMIT %s', (limit,))
+
+        self.emails = [row['email'] for row in users]
+        self.bud_ids = [row['id'] for row in buds]
+        self.activity_ids = [row['id'] for row in activities]
+
+        if not self.emails or not self.bud_ids:
+            raise SystemExit('❌ Dataset is empty - run python -m benchmarks.generate_dataset first')
+
+
+class VirtualUser(threading.Thread):
+    """One logged-in user issuing requests back to back until the deadline"""
+
+    def __init__(self, client, targets, seed, deadline, warmup=0, think_time=0.0):
+        super().__init__(daemon=True)
+        self.client = client
+        self.targets = targets
+        self.rng = random.Random(seed)
+        self.deadline = deadline
+        self.warmup = warmup
+        self.think_time = think_time
+        self.samples = {}
+        self.errors = {}
+        self.email = self.rng.choice(targets.emails)
+
+        names, weights = zip(*TRAFFIC_MIX)
+        self.scenarios = names
+        self.weights = weights
+
+    def run(self):
+        self.timed('login', self.login)
+        issued = 0
+        while time.time() < self.deadline:
+            scenario = self.rng.choices(self.scenarios, self.weights)[0]
+            self.timed(scenario, getattr(self, scenario), record=issued >= self.warmup)
+            issued += 1
+            if self.think_time:
+                time.sleep(self.rng.uniform(0, self.think_time * 2))
+
+    def timed(self, scenario, action, record=True):
+        start = time.perf_counter()
+        try:
+            status = action()
+        except Exception:
+            status = 599
+        elapsed = time.perf_counter() - start
+
+        if not record:
+            return
+        self.samples.setdefault(scenario, []).append(elapsed)
+        if status >= 400:
+            self.errors[scenario] = self.errors.get(scenario, 0) + 1
+
+    def login(self):
+        return self.client.request('POST', '/login', {'email': self.email, 'password': BENCH_PASSWORD})
+
+    def profile(self):
+        return self.client.request('GET', '/api/profile')
+
+    def bud_info(self):
+        return self.client.request('GET', f'/api/buds/{self.rng.choice(self.targets.bud_ids)}/info')
+
+    def search_buds(self):
+        filters = {'strain_type': self.rng.choice(STRAIN_TYPES)}
+        if self.rng.random() < 0.5:
+            filters['strain_name_en'] = self.rng.choice(STRAIN_NAMES)[:4]
+        if self.rng.random() < 0.3:
+            filters['grade'] = self.rng.choice(GRADES)
+        return self.client.request('POST', '/api/search-buds', filters)
+
+    def strain_search(self):
+        query = self.rng.choice(STRAIN_NAMES)[:self.rng.randrange(2, 5)]
+        return self.client.request('GET', f'/api/strains/search?q={query}&lang=en&limit=10')
+
+    def activities(self):
+        return self.client.request('GET', '/api/activities')
+
+    def friends_reviews(self):
+        return self.client.request('GET', '/api/friends_reviews')
+
+    def create_review(self):
+        return self.client.request('POST', '/api/reviews', {
+            'bud_reference_id': self.rng.choice(self.targets.bud_ids),
+            'overall_rating': self.rng.randint(1, 5),
+            'category_ratings': {'aroma': self.rng.randint(1, 5)},
+            'aroma_flavors': self.rng.sample(AROMAS, 2),
+            'mental_effects': self.rng.sample(MENTAL_POSITIVE, 2),
+            'full_review_content': 'Load test review',
+        })
+
+
+def run_load_test(client_factory, targets, users, duration, warmup=0, think_time=0.0, seed=42):
+    """Run virtual users concurrently and return per-scenario summaries"""
+    deadline = time.time() + duration
+    workers = [
+        VirtualUser(client_factory(), targets, seed + n, deadline, warmup, think_time)
+        for n in range(users)
+    ]
+
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    samples, errors = {}, {}
+    for worker in workers:
+        for scenario, values in worker.samples.items():
+            samples.setdefault(scenario, []).extend(values)
+        for scenario, count in worker.errors.items():
+            errors[scenario] = errors.get(scenario, 0) + count
+
+    results = {}
+    for scenario, _ in TRAFFIC_MIX:
+        if scenario in samples:
+            results[scenario] = summarize(samples[scenario], elapsed)
+            results[scenario]['errors'] = errors.get(scenario, 0)
+
+    all_samples = [value for values in samples.values() for value in values]
+    results['total'] = summarize(all_samples, elapsed)
+    results['total']['errors'] = sum(errors.values())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP load test for the BudtBoy API')
+    parser.add_argument('--db-path', default='budtboy_bench.db', help='SQLite dataset from generate_dataset')
+    parser.add_argument('--db-type', choices=['sqlite', 'postgresql'], default='sqlite')
+    parser.add_argument('--db-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--base-url', help='Test a running server instead of an in-process app')
+    parser.add_argument('--users', type=int, default=8, help='Concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+    parser.add_argument('--warmup', type=int, default=5, help='Unrecorded requests per user')
+    parser.add_argument('--think-time', type=float, default=0.0, help='Mean pause between requests')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Result JSON (default benchmarks/results/load_<commit>.json)')
+    parser.add_argument('--compare', help='Previous result JSON to check for p95 regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed p95 slowdown (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    # Point the testing config at the benchmark dataset
+    testing_config = config['testing']
+    testing_config.DATABASE_TYPE = args.db_type
+    testing_config.DATABASE_PATH = os.path.abspath(args.db_path)
+    testing_config.DATABASE_URL = args.db_url
+
+    if args.db_type == 'postgresql':
+        db = Database(db_url=args.db_url, db_type='postgresql')
+    else:
+        if not os.path.exists(args.db_path):
+            parser.error(f'{args.db_path} not found - run python -m benchmarks.generate_dataset first')
+        db = Database(db_path=args.db_path, db_type='sqlite')
+    targets = Targets(db)
+
+    if args.base_url:
+        client_factory = lambda: HttpClient(args.base_url)
+        target = args.base_url
+    else:
+        app = create_app('testing')
+        client_factory = lambda: InProcessClient(app)
+        target = 'in-process'
+
+    print("=" * 60)
+    print(f"🌿 Load test: {args.users} users for {args.duration:.0f}s against {target}")
+    print("=" * 60)
+
+    results = run_load_test(
+        client_factory, targets, args.users, args.duration,
+        warmup=args.warmup, think_time=args.think_time, seed=args.seed
+    )
+    print_table(results, ('count', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'throughput_rps'))
+
+    output = args.output or os.path.join('benchmarks', 'results', f'load_{git_revision() or "local"}.json')
+    write_results(output, 'load_test', {
+        'target': target,
+        'db_type': args.db_type,
+        'users': args.users,
+        'duration': args.duration,
+        'warmup': args.warmup,
+        'think_time': args.think_time,
+        'seed': args.seed,
+        'traffic_mix': dict(TRAFFIC_MIX),
+    }, results)
+    print(f"\n💾 Results saved to {output}")
+
+    if args.compare:
+        regressions = compare_results(args.compare, results, threshold=args.threshold)
+        for name, before, after, change in regressions:
+            print(f"⚠️  {name}: p95 {before:.1f}ms -> {after:.1f}ms (+{change:.0%})")
+        if regressions:
+            sys.exit(1)
+        print("✅ No p95 regressions")
+
+
+if __name__ == '__main__':
+    main()
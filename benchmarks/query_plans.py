@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Query-Plan Regression Check
+
+Exercises every route in the API blueprint against a generated dataset,
+captures each SQL statement it runs and snapshots the statement's plan
+(EXPLAIN QUERY PLAN on SQLite, EXPLAIN (FORMAT JSON) on PostgreSQL).
+
+The check fails when a statement picks up a full table scan or a temp sort
+that is not in the snapshot, or when a new/edited statement scans or sorts.
+After an intentional change, refresh the snapshot with --update and commit it.
+
+Usage:
+    python -m benchmarks.generate_dataset --scale tiny --db-path plans.db --fresh
+    python -m benchmarks.query_plans --db-path plans.db
+    python -m benchmarks.query_plans --db-path plans.db --update
+"""
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import tempfile
+from functools import wraps
+from contextlib import contextmanager
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+from app import create_app
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_plans')
+
+# Routes that need a request body (or query string) to reach their SQL
+EXTRA_REQUESTS = [
+    ('GET', '/api/buds?grower_id={user_id}&status=available', None),
+    ('GET', '/api/reviews?bud_id={bud_id}', None),
+    ('GET', '/api/strains/search?q=Kush&lang=en', None),
+    ('GET', '/api/strains/search?q=Kush&lang=th', None),
+    ('GET', '/api/breeders/search?q=Seed', None),
+    ('GET', '/api/friends_reviews?cursor=2099-01-01%2000:00:00|999999999', None),
+    ('GET', '/api/admin/export/buds', None),
+    ('GET', '/api/admin/export/reviews', None),
+    ('GET', '/api/admin/export/participants?activity_id={activity_id}', None),
+    ('POST', '/api/search-buds', {
+        'strain_name_en': 'Kush', 'strain_type': 'Indica', 'grade': 'A',
+        'thc_min': 10, 'thc_max': 30, 'cbd_min': 0, 'cbd_max': 10,
+        'aroma_flavor': 'Citrus', 'terpenes': ['ไมร์ซีน (Myrcene)'],
+        'mental_effects_positive': ['ผ่อนคลาย'], 'physical_effects_positive': ['คลายกล้าม'],
+        'recommended_time': 'กลางคืน',
+    }),
+    ('POST', '/api/reviews', {
+        'bud_reference_id': '{bud_id}', 'overall_rating': 4,
+        'category_ratings': {'aroma': 4}, 'aroma_flavors': ['Citrus'],
+    }),
+    ('PUT', '/api/reviews/{review_id}', {'overall_rating': 5, 'full_review_content': 'Updated'}),
+    ('PUT', '/api/buds/{bud_id}/status', {'status': 'sold_out'}),
+    ('POST', '/api/activities/{activity_id}/join', {'bud_id': '{bud_id}'}),
+    ('POST', '/api/admin/approve_user', {'user_id': '{pending_user_id}'}),
+    ('POST', '/api/approve_referral', {'user_id': '{referee_id}'}),
+    ('POST', '/api/submit_referral_code', {'referral_code': '{referral_code}'}),
+    ('DELETE', '/api/admin/users/{leaf_user_id}', None),
+]
+
+# GET routes that serve files rather than query the database
+SKIP_ENDPOINTS = {'api.uploaded_file', 'api.asset_file'}
+
+
+def normalize_query(query):
+    """Collapse whitespace and variable-length IN lists so a statement has a stable key"""
+    query = ' '.join(query.split())
+    return re.sub(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)', '(...)', query)
+
+
+def statement_key(endpoint, query):
+    digest = hashlib.sha1(normalize_query(query).encode('utf-8')).hexdigest()[:12]
+    return f'{endpoint}:{digest}'
+
+
+class StatementRecorder:
+    """
+    Wraps a Database instance and records every statement run while serving a request
+
+    Whatever module issues it counts: route code, utils helpers and request
+    hooks alike, including statements inside db.transaction() blocks.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.statements = {}
+        for name in ('execute_query', 'execute_insert', 'execute_update', 'stream_query'):
+            setattr(db, name, self._wrap(getattr(db, name)))
+        db.execute_many = self._wrap_many(db.execute_many)
+        db.transaction = self._wrap_transaction(db.transaction)
+
+    def _record(self, query, params):
+        from flask import has_request_context, request
+
+        if has_request_context() and request.endpoint:
+            key = statement_key(request.endpoint, query)
+            self.statements.setdefault(key, (request.endpoint, query, params))
+
+    def _wrap(self, method):
+        @wraps(method)
+        def recorded(query, params=None, *args, **kwargs):
+            self._record(query, params)
+            return method(query, params, *args, **kwargs)
+        return recorded
+
+    def _wrap_many(self, method):
+        @wraps(method)
+        def recorded(query, params_seq, *args, **kwargs):
+            params_seq = list(params_seq)
+            if params_seq:
+                self._record(query, params_seq[0])
+            return method(query, params_seq, *args, **kwargs)
+        return recorded
+
+    def _wrap_transaction(self, method):
+        @wraps(method)
+        @contextmanager
+        def recorded():
+            with method() as tx:
+                tx.execute_query = self._wrap(tx.execute_query)
+                tx.execute_update = self._wrap(tx.execute_update)
+                tx.execute_many = self._wrap_many(tx.execute_many)
+                yield tx
+        return recorded
+
+
+def sample_values(db):
+    """Ids from the dataset used to fill route arguments"""
+    def first(query, params=()):
+        rows = db.execute_query(query, params)
+        return next(iter(dict(rows[0]).values())) if rows else None
+
+    user_id = first('SELECT grower_id FROM buds_data ORDER BY id LIMIT 1')
+    return {
+        'user_id': user_id,
+        'bud_id': first('SELECT id FROM buds_data WHERE grower_id = %s ORDER BY id LIMIT 1', (user_id,)),
+        'review_id': first('SELECT id FROM reviews WHERE reviewer_id = %s ORDER BY id LIMIT 1', (user_id,))
+                     or first('SELECT id FROM reviews ORDER BY id LIMIT 1'),
+        'activity_id': first('SELECT id FROM activities ORDER BY id LIMIT 1'),
+        'referral_code': first('SELECT referral_code FROM users WHERE id != %s ORDER BY id LIMIT 1', (user_id,)),
+        'pending_user_id': first('SELECT id FROM users WHERE is_approved = %s ORDER BY id LIMIT 1', (False,)),
+        'referee_id': first('SELECT id FROM users WHERE referred_by = %s ORDER BY id LIMIT 1', (user_id,)),
+        'leaf_user_id': first('''
+            SELECT u.id FROM users u
+            WHERE NOT EXISTS (SELECT 1 FROM users r WHERE r.referred_by = u.id)
+            ORDER BY u.id DESC LIMIT 1
+        '''),
+    }
+
+
+def fill(value, values):
+    """Substitute {name} placeholders in paths and JSON bodies"""
+    if isinstance(value, str):
+        match = re.fullmatch(r'\{(\w+)\}', value)
+        if match:
+            return values.get(match.group(1))
+        return value.format(**values)
+    if isinstance(value, dict):
+        return {k: fill(v, values) for k, v in value.items()}
+    if isinstance(value, list):
+        return [fill(v, values) for v in value]
+    return value
+
+
+def route_requests(app, values):
+    """Every parameter-fillable GET route in the API blueprint, then EXTRA_REQUESTS"""
+    requests = []
+    argument_values = {
+        'bud_id': values['bud_id'], 'review_id': values['review_id'],
+        'activity_id': values['activity_id'], 'user_id': values['user_id'],
+        'referral_code': values['referral_code'],
+    }
+    for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+        if not rule.endpoint.startswith('api.') or rule.endpoint in SKIP_ENDPOINTS:
+            continue
+        if 'GET' not in rule.methods or not set(rule.arguments) <= set(argument_values):
+            continue
+        path = rule.rule
+        for argument in rule.arguments:
+            path = re.sub(rf'<(?:\w+:)?{argument}>', str(argument_values[argument]), path)
+        requests.append(('GET', path, None))
+
+    for method, path, body in EXTRA_REQUESTS:
+        requests.append((method, fill(path, values), fill(body, values)))
+    return requests
+
+
+def drive_routes(app, db):
+    """Issue every request as a logged-in grower who is also an admin"""
+    recorder = StatementRecorder(db)
+    values = sample_values(db)
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = values['user_id']
+        sess['username'] = 'plan_check'
+        sess['admin_logged_in'] = True
+        sess['admin_id'] = 1
+        sess['admin_name'] = 'plan_check'
+
+    failures = []
+    for method, path, body in route_requests(app, values):
+        response = client.open(path, method=method, json=body)
+        if response.status_code >= 500:
+            failures.append(f'{method} {path} -> {response.status_code}')
+    return recorder.statements, failures
+
+
+def explain(db, query, params):
+    """Return (plan lines, full scans, temp sorts) for one statement"""
+    query = db._convert_query_placeholders(query)
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        if db.db_type == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + query, params or ())
+            lines = [row[3] for row in cursor.fetchall()]
+            scans = sorted({
+                line.split()[1] if line.split()[1] != 'TABLE' else line.split()[2]
+                for line in lines
+                if line.startswith('SCAN ') and ' USING ' not in line and 'CONSTANT ROW' not in line
+            })
+            sorts = sum(1 for line in lines if 'USE TEMP B-TREE' in line)
+            return lines, scans, sorts
+
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + query, params or None)
+        plan = cursor.fetchone()[0][0]['Plan']
+        lines, scans, sorts = [], set(), 0
+        stack = [(plan, 0)]
+        while stack:
+            node, depth = stack.pop()
+            lines.append('  ' * depth + node['Node Type'] +
+                         (f" on {node['Relation Name']}" if 'Relation Name' in node else ''))
+            if node['Node Type'] == 'Seq Scan':
+                scans.add(node.get('Alias', node.get('Relation Name')))
+            if node['Node Type'] in ('Sort', 'Incremental Sort'):
+                sorts += 1
+            stack.extend((child, depth + 1) for child in reversed(node.get('Plans', [])))
+        return lines, sorted(scans), sorts
+
+
+def build_plans(db, statements):
+    plans = {}
+    for key, (endpoint, query, params) in sorted(statements.items()):
+        if not normalize_query(query).upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')):
+            continue
+        try:
+            lines, scans, sorts = explain(db, query, params)
+        except Exception as e:
+            lines, scans, sorts = [f'EXPLAIN failed: {e}'], [], 0
+        plans[key] = {
+            'endpoint': endpoint,
+            'query': normalize_query(query),
+            'full_scans': scans,
+            'temp_sorts': sorts,
+            'plan': lines,
+        }
+    return plans
+
+
+def find_regressions(snapshot, plans):
+    """Messages for every plan that got worse than its snapshot"""
+    regressions = []
+    for key, plan in plans.items():
+        before = snapshot.get(key)
+        if before is None:
+            if plan['full_scans'] or plan['temp_sorts']:
+                regressions.append(
+                    f"{key} (new statement): scans {plan['full_scans']}, {plan['temp_sorts']} temp sort(s)\n"
+                    f"    {plan['query'][:160]}"
+                )
+            continue
+        new_scans = sorted(set(plan['full_scans']) - set(before['full_scans']))
+        if new_scans:
+            regressions.append(f"{key}: new full scan of {new_scans}\n    {plan['query'][:160]}")
+        if plan['temp_sorts'] > before['temp_sorts']:
+            regressions.append(
+                f"{key}: temp sorts {before['temp_sorts']} -> {plan['temp_sorts']}\n    {plan['query'][:160]}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check API query plans against a snapshot')
+    parser.add_argument('--db-path', default='budtboy_bench.db', help='SQLite dataset from generate_dataset')
+    parser.add_argument('--db-type', choices=['sqlite', 'postgresql'], default='sqlite')
+    parser.add_argument('--db-url', default=os.environ.get('BENCH_DATABASE_URL'),
+                        help='PostgreSQL dataset (routes that write will modify it)')
+    parser.add_argument('--snapshot', help='Snapshot file (default benchmarks/query_plans/<db-type>.json)')
+    parser.add_argument('--update', action='store_true', help='Rewrite the snapshot instead of checking')
+    args = parser.parse_args()
+
+    testing_config = config['testing']
+    testing_config.DATABASE_TYPE = args.db_type
+    testing_config.DATABASE_URL = args.db_url
+    if args.db_type == 'sqlite':
+        if not os.path.exists(args.db_path):
+            parser.error(f'{args.db_path} not found - run python -m benchmarks.generate_dataset first')
+        # Routes that write run against a throwaway copy
+        work_path = os.path.join(tempfile.mkdtemp(prefix='budtboy_plans_'), 'plans.db')
+        shutil.copyfile(args.db_path, work_path)
+        testing_config.DATABASE_PATH = work_path
+
+    app = create_app('testing')
+    statements, failures = drive_routes(app, app.db)
+    plans = build_plans(app.db, statements)
+    snapshot_path = args.snapshot or os.path.join(SNAPSHOT_DIR, f'{args.db_type}.json')
+
+    print(f"🔎 Captured {len(plans)} statements from {len({p['endpoint'] for p in plans.values()})} endpoints")
+    for failure in failures:
+        print(f"⚠️  {failure}")
+
+    if args.update:
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        with open(snapshot_path, 'w') as f:
+            json.dump(plans, f, indent=2, ensure_ascii=False, sort_keys=True)
+        print(f"💾 Snapshot written to {snapshot_path}")
+        return
+
+    if not os.path.exists(snapshot_path):
+        parser.error(f'{snapshot_path} not found - run with --update to create it')
+    with open(snapshot_path) as f:
+        snapshot = json.load(f)
+
+    missing = sorted(set(snapshot) - set(plans))
+    if missing:
+        print(f"ℹ️  {len(missing)} snapshot statements no longer run (refresh with --update)")
+
+    regressions = find_regressions(snapshot, plans)
+    for regression in regressions:
+        print(f"❌ {regression}")
+    if regressions:
+        sys.exit(1)
+    print("✅ No query-plan regressions")
+
+
+if __name__ == '__main__':
+    main()
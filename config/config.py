@@ -1,4 +1,5 @@
 import os
+import tempfile
 from datetime import timedelta
 from dotenv import load_dotenv
 
@@ -17,6 +18,7 @@ class Config:
 
     # File Upload
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
+    UPLOAD_QUARANTINE_FOLDER = os.environ.get('UPLOAD_QUARANTINE_FOLDER', 'uploads_quarantine')  # orphans awaiting deletion
     ATTACHED_ASSETS_FOLDER = 'attached_assets'
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))
     ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
@@ -26,6 +28,13 @@ class Config:
     SESSION_COOKIE_SECURE = False  # Set True in production with HTTPS
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = None  # Allow cross-site for OAuth callbacks
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'database')  # 'memory', 'database' or 'redis'
+    SESSION_REDIS_URL = os.environ.get('SESSION_REDIS_URL', 'redis://localhost:6379/1')
+    SESSION_CACHE_TTL = 5  # seconds a worker reuses a session read from the database (0 = always read)
+    SESSION_SKIP_PATHS = ('/static/', '/uploads/', '/attached_assets/')  # served without loading the session
+
+    # Reverse proxies in front of the app whose X-Forwarded-For/-Proto are trusted (0 = none)
+    TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
 
     # Email
     MAIL_SERVER = 'smtp.gmail.com'
@@ -48,6 +57,72 @@ class Config:
     SHORT_CACHE_TTL = 180  # 3 minutes
     PROFILE_CACHE_TTL = 1800  # 30 minutes
     ACTIVITY_CACHE_TTL = 600  # 10 minutes
+    ADMIN_STATS_CACHE_TTL = 60  # 1 minute
+
+    # Admin dashboard trends compare the last N days with the N days before
+    ADMIN_STATS_TREND_DAYS = 7
+
+    # Analytics rollup job interval in seconds (0 disables the job)
+    ANALYTICS_ROLLUP_INTERVAL = int(os.environ.get('ANALYTICS_ROLLUP_INTERVAL', 300))
+
+    # Activity lifecycle scheduler interval in seconds (0 disables it)
+    ACTIVITY_SCHEDULER_INTERVAL = int(os.environ.get('ACTIVITY_SCHEDULER_INTERVAL', 60))
+
+    # Friends feed backfill/unfriend cleanup interval in seconds (0 disables it)
+    FEED_MAINTENANCE_INTERVAL = int(os.environ.get('FEED_MAINTENANCE_INTERVAL', 600))
+
+    # Purge job for deleted users' rows, in seconds (0 disables it; their uploads go to the upload GC)
+    USER_PURGE_INTERVAL = int(os.environ.get('USER_PURGE_INTERVAL', 30))
+
+    # Orphaned upload collector interval in seconds (0 disables it)
+    UPLOAD_GC_INTERVAL = int(os.environ.get('UPLOAD_GC_INTERVAL', 3600))
+    UPLOAD_GC_GRACE_PERIOD = 86400  # unreferenced files younger than this are left alone
+    UPLOAD_QUARANTINE_PERIOD = 7 * 86400  # quarantined files are deleted after this
+
+    # Referral link clicks are buffered per worker and written in batches
+    REFERRAL_CLICK_FLUSH_INTERVAL = int(os.environ.get('REFERRAL_CLICK_FLUSH_INTERVAL', 5))  # seconds, 0 = only when a batch fills
+    REFERRAL_CLICK_BATCH_SIZE = 200
+    REFERRAL_CLICK_DEDUPE_WINDOW = 1800  # repeat clicks from the same IP and browser are counted once per window
+    REFERRAL_ATTRIBUTION_DAYS = 30  # a signup is credited to a click at most this old
+
+    # Logging
+    LOG_FILE = os.environ.get('LOG_FILE', 'logs/budtboy.log')
+    LOG_MAX_BYTES = 10485760  # 10MB
+    LOG_BACKUP_COUNT = 10
+    ACCESS_LOG_SAMPLE_RATE = float(os.environ.get('ACCESS_LOG_SAMPLE_RATE', 1.0))
+    ACCESS_LOG_SAMPLE_RATES = {  # Per-endpoint overrides for high-volume routes
+        'main.uploaded_file': 0.05,
+        'main.asset_file': 0.05,
+        'serve_attached_assets': 0.05,
+        'main.health_check': 0.01,
+        'api.get_pending_friends_count': 0.1,
+    }
+    ACCESS_LOG_SLOW_MS = 1000  # Always log requests slower than this
+
+    # Metrics (per-worker files are merged by /metrics)
+    METRICS_DIR = os.environ.get('METRICS_DIR', 'logs/metrics')
+    METRICS_FLUSH_INTERVAL = 5  # seconds
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # Bearer token for /metrics (admin session otherwise)
+
+    # Request profiling (admin X-Profile header or profileSampleRate setting)
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', 'logs/profiles')
+    PROFILE_MODE = 'sample'  # 'sample' (folded stacks) or 'cprofile' (pstats)
+    PROFILE_SAMPLE_INTERVAL = 0.002  # seconds between stack samples
+
+    # Password hashing (bcrypt runs in a process pool)
+    BCRYPT_ROUNDS = int(os.environ['BCRYPT_ROUNDS']) if os.environ.get('BCRYPT_ROUNDS') else None  # None = calibrate
+    BCRYPT_TARGET_MS = 250  # Calibration target per hash
+    PASSWORD_POOL_WORKERS = int(os.environ.get('PASSWORD_POOL_WORKERS', 2))  # 0 = hash in the request thread
+    PASSWORD_POOL_MAX_QUEUE = 16  # Reject (503) beyond this many queued operations
+    PASSWORD_POOL_TIMEOUT = 5  # seconds
+
+    # Login throttling (token buckets checked before any bcrypt work)
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # 'memory', 'database' or 'redis'
+    RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+    LOGIN_RATE_LIMITS = {  # (attempts, per seconds)
+        'ip': (20, 60),
+        'account': (5, 300),
+    }
 
     # Application
     FALLBACK_AUTH_ENABLED = os.environ.get('FALLBACK_AUTH_ENABLED', 'True').lower() == 'true'
@@ -66,12 +141,14 @@ class ProductionConfig(Config):
     SESSION_COOKIE_SECURE = True  # Require HTTPS
     FALLBACK_AUTH_ENABLED = False
     DATABASE_TYPE = 'postgresql'  # Use PostgreSQL in production
+    TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 1))  # nginx (DEPLOYMENT.md)
 
 
 class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
-    DATABASE_PATH = ':memory:'
+    # A file, not ':memory:' - every query opens a new connection, which would get an empty database
+    DATABASE_PATH = os.environ.get('TEST_DATABASE_PATH', os.path.join(tempfile.gettempdir(), 'budtboy_test.db'))
 
 
 config = {